@@ -0,0 +1,106 @@
+"""抽出履歴の検索ベンチマーク（SQLite）
+
+指定した行数の抽出履歴を一時DBに作成し、履歴画面の検索条件ごとの処理時間と実行計画を出力する。
+全件走査（インデックスを使わない実行計画）になった条件があれば終了コード1を返す。
+
+    python -m benchmarks.history_bench [--rows 300000] [--repeat 5] [--db path/to/history.db]
+
+--db に既存のファイルを指定した場合は、行を追加せずにそのDBで計測する。
+"""
+import os
+import sys
+import random
+import argparse
+import tempfile
+import statistics
+import time
+from typing import Any, Dict, List
+
+from pipeline.history import ROW_FILE_HASH_KEY, ROW_MODEL_KEY, HistoryStore
+
+INSURERS = ["東京海上日動", "損保ジャパン", "三井住友海上"]
+CUSTOMER_COUNT = 20000
+
+# 履歴画面で使われる検索条件
+QUERIES = [
+    ("氏名（広い前方一致）＋保険会社", {"customer_prefix": "顧客", "insurer": "損保ジャパン"}),
+    ("氏名（狭い前方一致）＋保険会社", {"customer_prefix": "顧客0123", "insurer": "損保ジャパン"}),
+    ("氏名（前方一致）", {"customer_prefix": "顧客01234"}),
+    ("保険会社", {"insurer": "損保ジャパン"}),
+    ("氏名＋保険会社＋抽出日", {"customer_prefix": "顧客", "insurer": "損保ジャパン", "date_from": "2025-12-01"}),
+    ("抽出日の範囲", {"date_from": "2025-06-01", "date_to": "2025-06-30"}),
+    ("条件なし（最新）", {}),
+]
+
+
+def make_rows(count: int, rng: random.Random) -> List[Dict[str, Any]]:
+    rows = []
+    for _ in range(count):
+        customer = f"顧客{rng.randrange(CUSTOMER_COUNT):05d}"
+        insurer = rng.choice(INSURERS)
+        rows.append({
+            "氏名": customer,
+            "保険会社": insurer,
+            "プラン": f"プラン{rng.randint(1, 3)}",
+            "抽出日": f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            "ファイル名": f"{customer}_{insurer}.pdf",
+            "保険料": f"{rng.randint(10, 200) * 1000:,}円",
+            ROW_MODEL_KEY: "gemini-2.5-flash-lite",
+            ROW_FILE_HASH_KEY: f"{rng.getrandbits(64):016x}",
+        })
+    return rows
+
+
+def populate(store: HistoryStore, total_rows: int, rows_per_run: int, seed: int = 0) -> None:
+    rng = random.Random(seed)
+    for start in range(0, total_rows, rows_per_run):
+        rows = make_rows(min(rows_per_run, total_rows - start), rng)
+        store.record_run(rows, user="bench", fields=["氏名", "保険料"], source="ベンチマーク")
+
+
+def measure(store: HistoryStore, filters: Dict[str, Any], repeat: int) -> Dict[str, Any]:
+    store.query_rows(**filters)
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        rows = store.query_rows(**filters)
+        timings.append(time.perf_counter() - started_at)
+    return {
+        "rows": len(rows),
+        "median_ms": statistics.median(timings) * 1000,
+        "max_ms": max(timings) * 1000,
+        "plan": store.explain_query_rows(**filters),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=300000)
+    parser.add_argument("--rows-per-run", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--db", help="計測に使うDBのパス（省略時は一時ファイル）")
+    args = parser.parse_args(argv)
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix="history_bench_"), "extraction_history.db")
+    exists = os.path.exists(db_path)
+    store = HistoryStore(db_path)
+    if not exists:
+        started_at = time.perf_counter()
+        populate(store, args.rows, args.rows_per_run)
+        print(f"{args.rows}行を作成（{time.perf_counter() - started_at:.1f}s）: {db_path}")
+
+    failures = []
+    print(f"{'検索条件':<26} {'件数':>6} {'中央値':>9} {'最大':>9}  実行計画")
+    for label, filters in QUERIES:
+        r = measure(store, filters, args.repeat)
+        print(f"{label:<22} {r['rows']:>6} {r['median_ms']:7.1f}ms {r['max_ms']:7.1f}ms  {' / '.join(r['plan'])}")
+        if any(detail.startswith("SCAN extraction_rows") and "USING" not in detail for detail in r["plan"]):
+            failures.append(f"{label}: 全件走査になっています")
+
+    for failure in failures:
+        print(f"❌ {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
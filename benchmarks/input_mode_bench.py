@@ -0,0 +1,145 @@
+"""入力モード比較ベンチマーク（Markdown＋画像 / PDF直接送信）
+
+評価セットのディレクトリに見積書PDFと labels.json を置き、同じPDFを両方の入力モードで
+抽出して、処理時間・抽出精度・ワーカーのCPU時間を比較する。実際にGemini APIを呼び出す。
+
+    labels.json:
+    [
+      {"file": "tokio_001.pdf", "expected": [
+        {"プラン": "プラン1", "保険料": "12,340円", "建物保険金額": "2,000万円"},
+        ...
+      ]},
+      ...
+    ]
+
+    GEMINI_API_KEY=... python -m benchmarks.input_mode_bench path/to/eval_set [--model gemini-2.5-flash]
+
+CPU時間は time.process_time() の差分（プロセス全体）で、Gemini応答待ちの時間は含まない。
+ページキャッシュは1件ごとに消去し、毎回前処理から計測する。
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+from typing import Any, Dict, List
+
+from pipeline.modality import INPUT_MODE_LABELS
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_app():
+    """アプリをモジュールとして読み込む（未ログイン状態のため画面処理は行われない）"""
+    sys.path.insert(0, ROOT_DIR)
+    import insurance_automation_app_v2 as app
+
+    return app
+
+
+def load_cases(eval_dir: str) -> List[Dict[str, Any]]:
+    with open(os.path.join(eval_dir, "labels.json"), encoding="utf-8") as f:
+        labels = json.load(f)
+    cases = []
+    for label in labels:
+        with open(os.path.join(eval_dir, label["file"]), "rb") as f:
+            cases.append({"file": label["file"], "pdf_bytes": f.read(), "expected": label["expected"]})
+    return cases
+
+
+def score_rows(app, rows: List[Dict[str, Any]], expected: List[Dict[str, Any]]) -> Dict[str, int]:
+    """プラン名で対応付け、期待値と一致した項目数を数える"""
+    by_plan = {app.normalize_label(row.get("プラン", "")): row for row in rows}
+    matched = total = 0
+    for expected_row in expected:
+        row = by_plan.get(app.normalize_label(expected_row.get("プラン", "")), {})
+        for field, value in expected_row.items():
+            total += 1
+            if app.normalize_label(app.clean_value(row.get(field, ""))) == app.normalize_label(app.clean_value(value)):
+                matched += 1
+    return {"matched": matched, "total": total, "plans": len(rows), "expected_plans": len(expected)}
+
+
+def run_case(app, model, case: Dict[str, Any], input_mode: str) -> Dict[str, Any]:
+    fields = list(dict.fromkeys(k for row in case["expected"] for k in row))
+    app.get_page_cache().clear()
+    app.st.session_state["extract_messages"] = []
+    started_wall = time.perf_counter()
+    started_cpu = time.process_time()
+    rows = app.extract_info_with_gemini_multi_plan(
+        case["pdf_bytes"], fields, case["file"], model, input_mode=input_mode
+    )
+    result = {
+        "seconds": time.perf_counter() - started_wall,
+        "cpu_seconds": time.process_time() - started_cpu,
+    }
+    result.update(score_rows(app, rows, case["expected"]))
+    return result
+
+
+def summarize(results: List[Dict[str, Any]]) -> Dict[str, float]:
+    total = sum(r["total"] for r in results)
+    return {
+        "p50": statistics.median(r["seconds"] for r in results),
+        "max": max(r["seconds"] for r in results),
+        "cpu_mean": statistics.mean(r["cpu_seconds"] for r in results),
+        "accuracy": sum(r["matched"] for r in results) / total if total else 0.0,
+        "plan_hits": sum(r["plans"] >= r["expected_plans"] for r in results),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("eval_dir")
+    parser.add_argument("--model", default="gemini-2.5-flash")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--json", help="結果をJSONで保存するパス")
+    args = parser.parse_args(argv)
+
+    api_key = os.environ.get("GEMINI_API_KEY")
+    if not api_key:
+        print("環境変数 GEMINI_API_KEY を設定してください。")
+        return 1
+
+    cases = load_cases(args.eval_dir)
+    if not cases:
+        print("評価ケースがありません。")
+        return 1
+
+    app = load_app()
+    # バックグラウンドでのSDK読み込みがCPU計測に混ざらないよう、完了を待ってから始める
+    for future in app.start_background_init().values():
+        future.result()
+    app.genai.configure(api_key=api_key)
+    model = app.genai.GenerativeModel(args.model)
+
+    report = {}
+    for input_mode, label in INPUT_MODE_LABELS.items():
+        results = []
+        for _ in range(args.repeat):
+            for case in cases:
+                r = run_case(app, model, case, input_mode)
+                print(
+                    f"[{label}] {case['file']}: {r['seconds']:.2f}s CPU={r['cpu_seconds']:.2f}s "
+                    f"一致={r['matched']}/{r['total']} プラン={r['plans']}/{r['expected_plans']}"
+                )
+                results.append(r)
+        report[input_mode] = summarize(results)
+
+    print()
+    print(f"{'入力モード':<34} {'p50':>7} {'最大':>7} {'CPU平均':>8} {'項目一致率':>8} {'プラン数一致':>8}")
+    for input_mode, s in report.items():
+        print(
+            f"{INPUT_MODE_LABELS[input_mode]:<30} {s['p50']:6.2f}s {s['max']:6.2f}s {s['cpu_mean']:7.2f}s "
+            f"{s['accuracy']:9.1%} {s['plan_hits']:>6}/{len(cases) * args.repeat}"
+        )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,489 @@
+"""複数セッション負荷試験（AppTest＋偽Gemini＋ローカルGCS）
+
+同時にログインした担当者N人が「ログイン → 顧客Excel読み込み → GCSプレフィックスのPDFを抽出
+→ 比較表の再描画・Excel出力 → 提案メッセージ作成」を行う状況を、1プロセス内のAppTestセッションで再現する。
+Gemini は応答時間を指定できる偽モジュールに、GCS は gcs_config.local_root のローカルディレクトリに置き換える。
+
+    # 現在の環境で基準値を記録
+    python -m benchmarks.load_test --sessions 1,2,4,8 --update-baseline
+
+    # 基準値と比較（劣化していれば終了コード1）
+    python -m benchmarks.load_test --sessions 1,2,4,8
+
+セッション数ごとに、操作別の処理時間（p50/p95/p99）、プロセスのRSS、CPU時間を出力する。
+RSSは計測中にバックグラウンドで定期的に読み取り、セッション数ごとの最大値を基準値と比較する
+（VmHWM はプロセス起動以降の最大値のため、2段目以降の計測には使えない）。
+AppTest はファイルアップロードに対応していないため、顧客Excelは画面と同じ処理で読み込んだ
+DataFrameをセッションに設定し、PDFはGCSプレフィックスから取り込む。
+基準値はマシン依存のため、CIなど計測するのと同じ環境で記録すること。
+"""
+import io
+import os
+import sys
+import json
+import math
+import time
+import types
+import random
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, List
+from unittest import mock
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_FILE = os.path.join(ROOT_DIR, "insurance_automation_app_v2.py")
+BASELINE_FILE = os.path.join(ROOT_DIR, "benchmarks", "load_baseline.json")
+
+from pipeline.numeric import COVERAGE_COLUMNS, MONEY_COLUMNS
+
+BUCKET_NAME = "loadtest"
+PASSWORD = "loadtest"
+
+ACTIONS = ["初回描画", "ログイン", "Excel読み込み", "取り込み設定", "PDF抽出", "再描画・出力", "提案メッセージ"]
+
+# 顧客Excelの列（＝抽出項目）
+CUSTOMER_FIELDS = ["氏名", "所在地", "建築年月", "保険期間"] + MONEY_COLUMNS + COVERAGE_COLUMNS
+
+QUOTE_TEMPLATES = {
+    "東京海上日動": ("東京海上日動火災保険 トータルアシスト 住まいの保険 お見積書", "免責金額"),
+    "損保ジャパン": ("損保ジャパン ＴＨＥ すまいの保険 お見積書", "自己負担額"),
+    "三井住友海上": ("三井住友海上 ＧＫ すまいの保険 お見積書", "免責金額"),
+}
+
+# 基準値に対する許容幅（相対・絶対）
+TOLERANCE_RATIO = 1.5
+TOLERANCE_SECONDS = 0.25
+TOLERANCE_RSS_MB = 50.0
+RSS_SAMPLE_INTERVAL = 0.05
+
+
+# ======================
+# 偽Gemini・ローカルGCSの遅延
+# ======================
+class LatencyModel:
+    """対数正規分布の応答時間。slow_ratio の割合で slow_factor 倍の遅い応答を混ぜる"""
+
+    def __init__(self, mean: float, sigma: float, slow_ratio: float, slow_factor: float, seed: int = 0):
+        self.mean = mean
+        self.sigma = sigma
+        self.slow_ratio = slow_ratio
+        self.slow_factor = slow_factor
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self) -> float:
+        if self.mean <= 0:
+            return 0.0
+        with self._lock:
+            seconds = self._random.lognormvariate(math.log(self.mean), self.sigma)
+            if self._random.random() < self.slow_ratio:
+                seconds *= self.slow_factor
+        return seconds
+
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+def fake_plan_rows() -> List[Dict[str, str]]:
+    rows = []
+    for i, premium in enumerate(["12,340円", "10,200円", "8,900円"], start=1):
+        row = {field: "テスト" for field in CUSTOMER_FIELDS}
+        row.update({field: "1,000万円" for field in MONEY_COLUMNS})
+        row.update({field: "5万円" for field in COVERAGE_COLUMNS})
+        row.update({"プラン": f"プラン{i}", "プラン識別子": f"プラン{i}", "保険料": premium, "建築年月": "2005年4月"})
+        rows.append(row)
+    return rows
+
+
+def make_fake_genai(latency: LatencyModel) -> types.ModuleType:
+    """google.generativeai の代わりに sys.modules へ登録する偽モジュール"""
+    module = types.ModuleType("google.generativeai")
+    plan_json = json.dumps(fake_plan_rows(), ensure_ascii=False)
+
+    class GenerativeModel:
+        def __init__(self, model_name: str, **kwargs):
+            self.model_name = f"models/{model_name}"
+
+        def generate_content(self, contents, **kwargs):
+            time.sleep(latency.sample())
+            if isinstance(contents, str):
+                return FakeResponse("負荷試験用の提案メッセージです。")
+            return FakeResponse(plan_json)
+
+    module.GenerativeModel = GenerativeModel
+    module.configure = lambda **kwargs: None
+    module.upload_file = lambda **kwargs: types.SimpleNamespace(name="files/loadtest")
+    module.delete_file = lambda name: None
+    return module
+
+
+@contextmanager
+def patched_environment(latency: LatencyModel, gcs_latency: float):
+    """偽Gemini・GCS遅延・共有ランタイムを有効にする
+
+    AppTest は実行のたびにプロセス共通のランタイムとsecretsを差し替えるため、
+    そのままでは複数セッションを同時に実行できない。負荷試験中は1つのランタイムに固定し、
+    secretsも全セッション共通のものを事前に設定する（実サーバーと同じく全セッションでキャッシュを共有する）。
+    また、AppTest は実行ごとにスクリプトを構文解析し直すが、Python 3.11 の ast.parse は
+    複数スレッドから同時に呼ぶと失敗することがあるため、実サーバーと同様にバイトコードを1回だけ作って共有する。
+    """
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from pipeline.ingest import LocalBlob
+
+    runtime = mock.MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+
+    compile_lock = threading.Lock()
+    bytecode_cache = {}
+    get_bytecode = ScriptCache.get_bytecode
+
+    def shared_bytecode(self, script_path: str):
+        with compile_lock:
+            if script_path not in bytecode_cache:
+                bytecode_cache[script_path] = get_bytecode(self, script_path)
+            return bytecode_cache[script_path]
+
+    def delayed(method):
+        def wrapper(*args, **kwargs):
+            time.sleep(gcs_latency)
+            return method(*args, **kwargs)
+        return wrapper
+
+    config.set_option("global.appTest", True)
+    saved_genai = sys.modules.get("google.generativeai")
+    sys.modules["google.generativeai"] = make_fake_genai(latency)
+    try:
+        with mock.patch.object(Runtime, "instance", classmethod(lambda cls: runtime)), \
+                mock.patch.object(Runtime, "exists", classmethod(lambda cls: True)), \
+                mock.patch.object(ScriptCache, "get_bytecode", shared_bytecode), \
+                mock.patch.object(LocalBlob, "download_as_bytes", delayed(LocalBlob.download_as_bytes)), \
+                mock.patch.object(LocalBlob, "upload_from_string", delayed(LocalBlob.upload_from_string)):
+            yield
+    finally:
+        if saved_genai is None:
+            sys.modules.pop("google.generativeai", None)
+        else:
+            sys.modules["google.generativeai"] = saved_genai
+
+
+def set_global_secrets(secrets: Dict[str, Any]) -> None:
+    import streamlit as st
+    from streamlit.runtime.secrets import Secrets
+
+    shared = Secrets()
+    shared._secrets = secrets
+    st.secrets = shared
+
+
+# ======================
+# テストデータ
+# ======================
+def write_quote_pdf(path: str, insurer: str, tag: str) -> None:
+    import pymupdf
+
+    title, deductible = QUOTE_TEMPLATES[insurer]
+    lines = [
+        title,
+        f"お客様: 負荷試験 {tag} 様",
+        "建築年月: 2005年4月 保険期間: 5年",
+        f"プラン1 保険料 12,340円 {deductible} 0円",
+        f"プラン2 保険料 10,200円 {deductible} 5万円",
+        f"プラン3 保険料 8,900円 {deductible} 10万円",
+    ]
+    doc = pymupdf.open()
+    page = doc.new_page()
+    for i, line in enumerate(lines):
+        page.insert_text((50, 72 + i * 20), line, fontname="japan", fontsize=11)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    doc.save(path)
+
+
+def prepare_data(root: str, level: int, sessions: int, pdfs_per_session: int) -> List[str]:
+    """セッションごとのGCSプレフィックスにPDFを置く（内容を変えてキャッシュに当たらないようにする）"""
+    prefixes = []
+    insurers = list(QUOTE_TEMPLATES)
+    for s in range(sessions):
+        prefix = f"quotes/level{level}/session{s}/"
+        for k in range(pdfs_per_session):
+            insurer = insurers[k % len(insurers)]
+            path = os.path.join(root, BUCKET_NAME, *prefix.split("/"), f"quote{k}.pdf")
+            write_quote_pdf(path, insurer, f"L{level}-S{s}-Q{k}")
+        prefixes.append(prefix)
+    return prefixes
+
+
+def make_customer_excel() -> bytes:
+    import pandas as pd
+
+    buf = io.BytesIO()
+    pd.DataFrame([{field: "" for field in CUSTOMER_FIELDS}]).to_excel(buf, index=False)
+    return buf.getvalue()
+
+
+# ======================
+# 計測
+# ======================
+def read_proc_status() -> Dict[str, float]:
+    """/proc/self/status の VmRSS・VmHWM（MB）"""
+    values = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            key, _, rest = line.partition(":")
+            if key in ("VmRSS", "VmHWM"):
+                values[key] = int(rest.split()[0]) / 1024
+    return values
+
+
+class RssSampler:
+    """with ブロックの間、VmRSS を一定間隔で読み取り、その間の最大値を記録する"""
+
+    def __init__(self, interval: float = RSS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.peak_mb = 0.0
+        self.last_mb = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    def _sample(self) -> None:
+        self.last_mb = read_proc_status().get("VmRSS", 0.0)
+        self.peak_mb = max(self.peak_mb, self.last_mb)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self) -> "RssSampler":
+        self._sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+
+def cpu_seconds() -> float:
+    t = os.times()
+    return t.user + t.system
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def run_session(user: str, prefix: str, excel_bytes: bytes, timeout: float) -> Dict[str, Any]:
+    import pandas as pd
+    from streamlit.testing.v1 import AppTest
+
+    from pipeline.numeric import strip_derived_columns
+
+    at = AppTest.from_file(APP_FILE, default_timeout=timeout)
+    timings: Dict[str, float] = {}
+
+    def timed(action: str, step):
+        started_at = time.perf_counter()
+        step()
+        timings[action] = time.perf_counter() - started_at
+        if at.exception:
+            raise RuntimeError(f"{action}: {at.exception[0].value}")
+
+    def login():
+        at.sidebar.text_input[0].input(user)
+        at.sidebar.text_input[1].input(PASSWORD)
+        at.sidebar.button[0].click().run()
+
+    def load_excel():
+        # 画面の「顧客情報ファイルをアップロード」と同じ処理で読み込む
+        df_customer = pd.read_excel(io.BytesIO(excel_bytes))
+        df_customer.columns = [str(c) for c in df_customer.columns]
+        df_customer = strip_derived_columns(df_customer)
+        at.session_state["customer_file_name"] = "負荷試験.xlsx"
+        at.session_state["fields"] = df_customer.columns.tolist()
+        at.session_state["customer_df"] = df_customer
+        at.run()
+
+    def select_source():
+        at.radio(key="ingest_source").set_value("GCSプレフィックス").run()
+        at.text_input(key="gcs_prefix").input(prefix).run()
+
+    def extract():
+        at.button(key="extract_button").click().run()
+        if at.session_state["comparison_df"].empty:
+            raise RuntimeError(f"PDF抽出: 比較表が空です {at.session_state['extract_messages']}")
+
+    timed("初回描画", at.run)
+    timed("ログイン", login)
+    timed("Excel読み込み", load_excel)
+    timed("取り込み設定", select_source)
+    timed("PDF抽出", extract)
+    timed("再描画・出力", at.run)
+    timed("提案メッセージ", lambda: at.button(key="analyze_button").click().run())
+    return timings
+
+
+def run_level(level: int, args, root: str, excel_bytes: bytes) -> Dict[str, Any]:
+    prefixes = prepare_data(root, level, level * args.rounds, args.pdfs)
+    jobs = [(f"user{i % level}", prefixes[i]) for i in range(level * args.rounds)]
+
+    samples: Dict[str, List[float]] = {action: [] for action in ACTIONS}
+    errors: List[str] = []
+    lock = threading.Lock()
+
+    def worker(job):
+        user, prefix = job
+        try:
+            timings = run_session(user, prefix, excel_bytes, args.timeout)
+        except Exception as e:
+            with lock:
+                errors.append(f"{user} {prefix}: {e}")
+            return
+        with lock:
+            for action, seconds in timings.items():
+                samples[action].append(seconds)
+
+    cpu_before = cpu_seconds()
+    started_at = time.perf_counter()
+    with RssSampler() as rss, ThreadPoolExecutor(max_workers=level) as executor:
+        list(executor.map(worker, jobs))
+    wall = time.perf_counter() - started_at
+    cpu = cpu_seconds() - cpu_before
+
+    return {
+        "sessions": level,
+        "completed": len(samples["提案メッセージ"]),
+        "wall_seconds": wall,
+        "cpu_seconds": cpu,
+        "cpu_per_session": cpu / max(len(jobs), 1),
+        "cpu_utilization": cpu / wall if wall else 0.0,
+        # rss_mb は終了時点、peak_rss_mb はこのセッション数での計測中の最大値
+        "rss_mb": rss.last_mb,
+        "peak_rss_mb": rss.peak_mb,
+        "actions": {
+            action: {
+                "p50": percentile(values, 0.5),
+                "p95": percentile(values, 0.95),
+                "p99": percentile(values, 0.99),
+                "max": max(values) if values else 0.0,
+            }
+            for action, values in samples.items()
+        },
+        "errors": errors,
+    }
+
+
+def run_load_test(args) -> List[Dict[str, Any]]:
+    levels = [int(n) for n in args.sessions.split(",")]
+    root = tempfile.mkdtemp(prefix="loadtest_")
+    os.makedirs(os.path.join(root, BUCKET_NAME), exist_ok=True)
+
+    auth_users = {}
+    for i in range(max(levels)):
+        auth_users[f"user{i}_username"] = f"user{i}"
+        auth_users[f"user{i}_name"] = f"負荷試験{i}"
+        auth_users[f"user{i}_password"] = PASSWORD
+    set_global_secrets({
+        "auth_users": auth_users,
+        "GEMINI_API_KEY": "loadtest",
+        "gcs_config": {"bucket_name": BUCKET_NAME, "log_file_name": "logs/app_usage.log", "local_root": root},
+        "history_config": {"db_path": os.path.join(root, "extraction_history.db")},
+        "cache_config": {"disk_dir": ""},
+        "input_mode_config": {"default": args.input_mode},
+    })
+
+    latency = LatencyModel(args.gemini_latency, args.gemini_sigma, args.slow_ratio, args.slow_factor)
+    excel_bytes = make_customer_excel()
+    results = []
+    with patched_environment(latency, args.gcs_latency):
+        for level in levels:
+            result = run_level(level, args, root, excel_bytes)
+            results.append(result)
+            print_level(result)
+    return results
+
+
+def print_level(result: Dict[str, Any]) -> None:
+    print(
+        f"\n== {result['sessions']}セッション（完了 {result['completed']}件） "
+        f"経過 {result['wall_seconds']:.1f}s CPU {result['cpu_seconds']:.1f}s "
+        f"（1セッションあたり {result['cpu_per_session']:.2f}s・使用率 {result['cpu_utilization']:.0%}） "
+        f"RSS 最大 {result['peak_rss_mb']:.0f}MB（終了時 {result['rss_mb']:.0f}MB）"
+    )
+    for action, stats in result["actions"].items():
+        print(
+            f"  {action:<10} p50 {stats['p50']:6.2f}s  p95 {stats['p95']:6.2f}s  "
+            f"p99 {stats['p99']:6.2f}s  最大 {stats['max']:6.2f}s"
+        )
+    for error in result["errors"]:
+        print(f"  ❌ {error}")
+
+
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Any]) -> List[str]:
+    failures = []
+    base_levels = {str(b["sessions"]): b for b in baseline.get("levels", [])}
+    for result in results:
+        base = base_levels.get(str(result["sessions"]))
+        if base is None:
+            continue
+        label = f"{result['sessions']}セッション"
+        for action, stats in result["actions"].items():
+            base_p95 = base["actions"].get(action, {}).get("p95")
+            if base_p95 is not None and stats["p95"] > base_p95 * TOLERANCE_RATIO + TOLERANCE_SECONDS:
+                failures.append(f"{label} {action} p95: {stats['p95']:.2f}s（基準 {base_p95:.2f}s）")
+        if result["cpu_per_session"] > base["cpu_per_session"] * TOLERANCE_RATIO + TOLERANCE_SECONDS:
+            failures.append(
+                f"{label} 1セッションあたりCPU: {result['cpu_per_session']:.2f}s（基準 {base['cpu_per_session']:.2f}s）"
+            )
+        if result["peak_rss_mb"] > base["peak_rss_mb"] + TOLERANCE_RSS_MB:
+            failures.append(f"{label} 最大RSS: {result['peak_rss_mb']:.0f}MB（基準 {base['peak_rss_mb']:.0f}MB）")
+    return failures
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", default="1,2,4,8", help="同時セッション数（カンマ区切り）")
+    parser.add_argument("--rounds", type=int, default=1, help="各セッションが操作を繰り返す回数")
+    parser.add_argument("--pdfs", type=int, default=3, help="1セッションあたりのPDF数")
+    parser.add_argument("--gemini-latency", type=float, default=1.0, help="偽Geminiの応答時間の中央値（秒）")
+    parser.add_argument("--gemini-sigma", type=float, default=0.3, help="応答時間のばらつき（対数正規分布のσ）")
+    parser.add_argument("--slow-ratio", type=float, default=0.02, help="遅い応答の割合")
+    parser.add_argument("--slow-factor", type=float, default=10.0, help="遅い応答の倍率")
+    parser.add_argument("--gcs-latency", type=float, default=0.05, help="GCSの読み書き1回あたりの遅延（秒）")
+    parser.add_argument("--input-mode", default="markdown", choices=["markdown", "native_pdf"])
+    parser.add_argument("--timeout", type=float, default=600.0, help="1回の再実行の上限（秒）")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args(argv)
+
+    results = run_load_test(args)
+
+    failures = [f"{r['sessions']}セッション: エラー {len(r['errors'])}件" for r in results if r["errors"]]
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"levels": results}, f, ensure_ascii=False, indent=2)
+        print(f"\n基準値を更新しました: {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            failures += compare(results, json.load(f))
+    else:
+        print("\n基準値ファイルがありません（--update-baseline で作成）。比較は省略します。")
+
+    for failure in failures:
+        print(f"❌ {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+"""モダリティ選択しきい値のオフライン評価
+
+評価セットのディレクトリに、見積書ごとのテキスト層（.md、または .pdf）と
+labels.json を置いて実行する。
+
+    labels.json:
+    [
+      {"file": "tokio_001.md", "insurer": "東京海上日動", "expected": "text"},
+      {"file": "scan_004.pdf", "insurer": "損保ジャパン", "expected": "image"},
+      ...
+    ]
+
+expected には、その文書で正しい抽出結果が得られた最も安いモダリティ
+（text / image / both）を記録しておく。
+
+    python -m benchmarks.modality_eval path/to/eval_set [--grid]
+
+期待と異なる単独モダリティ（text / image）を選んだ件数を「危険」として数え、
+危険 0 件の中で一致率が最も高いしきい値を [modality_config] として出力する。
+"""
+import os
+import sys
+import json
+import argparse
+import itertools
+from typing import Any, Dict, List
+
+from pipeline.modality import (
+    MODALITY_BOTH,
+    DEFAULT_MODALITY_THRESHOLDS,
+    plan_modality,
+)
+
+GRID = {
+    "text_only_min_ratio": [0.15, 0.2, 0.25, 0.3, 0.35],
+    "text_only_min_chars": [200, 400, 800],
+    "text_only_min_anchor_ratio": [0.75, 1.0],
+    "image_only_max_ratio": [0.02, 0.05, 0.1],
+    "image_only_max_chars": [40, 80, 160],
+}
+
+
+def load_text(path: str) -> str:
+    if path.lower().endswith(".pdf"):
+        import pymupdf4llm
+
+        return pymupdf4llm.to_markdown(path)
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def load_cases(eval_dir: str) -> List[Dict[str, Any]]:
+    with open(os.path.join(eval_dir, "labels.json"), encoding="utf-8") as f:
+        labels = json.load(f)
+    cases = []
+    for label in labels:
+        cases.append({
+            "file": label["file"],
+            "insurer": label.get("insurer", ""),
+            "expected": label["expected"],
+            "text": load_text(os.path.join(eval_dir, label["file"])),
+        })
+    return cases
+
+
+def evaluate(cases: List[Dict[str, Any]], thresholds: Dict[str, Any]) -> Dict[str, Any]:
+    matched = 0
+    unsafe = []
+    wasted = 0
+    for case in cases:
+        mode = plan_modality(case["text"], case["insurer"], thresholds)["mode"]
+        if mode == case["expected"]:
+            matched += 1
+        elif mode == MODALITY_BOTH:
+            wasted += 1
+        else:
+            unsafe.append((case["file"], case["expected"], mode))
+    return {
+        "accuracy": matched / len(cases) if cases else 0.0,
+        "matched": matched,
+        "wasted": wasted,
+        "unsafe": unsafe,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("eval_dir")
+    parser.add_argument("--grid", action="store_true", help="しきい値をグリッド探索する")
+    args = parser.parse_args(argv)
+
+    cases = load_cases(args.eval_dir)
+    if not cases:
+        print("評価ケースがありません。")
+        return 1
+
+    result = evaluate(cases, DEFAULT_MODALITY_THRESHOLDS)
+    print(f"既定しきい値: 一致率={result['accuracy']:.1%} 過剰送信={result['wasted']} 危険={len(result['unsafe'])}")
+    for file, expected, mode in result["unsafe"]:
+        print(f"  危険: {file} 期待={expected} 選択={mode}")
+
+    if args.grid:
+        best = None
+        keys = list(GRID.keys())
+        for values in itertools.product(*(GRID[k] for k in keys)):
+            thresholds = dict(zip(keys, values))
+            r = evaluate(cases, thresholds)
+            if r["unsafe"]:
+                continue
+            if best is None or r["matched"] > best[1]["matched"]:
+                best = (thresholds, r)
+        if best is None:
+            print("危険 0 件となるしきい値が見つかりませんでした。")
+            return 1
+        thresholds, r = best
+        print(f"\n最良しきい値: 一致率={r['accuracy']:.1%} 過剰送信={r['wasted']}")
+        print("[modality_config]")
+        for k, v in thresholds.items():
+            print(f"{k} = {v}")
+
+    return 1 if result["unsafe"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+"""起動時間ベンチマーク（インポート時間・初回描画時間）
+
+各モジュールのインポート時間（python -X importtime の累積値）と、
+アプリのログイン画面が描画されるまでの時間を、それぞれ新しいプロセスで計測する。
+あわせて、初回描画の時点で重いSDKが読み込まれていないことを確認する。
+
+    # 現在の環境で基準値を記録
+    python -m benchmarks.startup_bench --update-baseline
+
+    # 基準値と比較（劣化していれば終了コード1）
+    python -m benchmarks.startup_bench
+
+基準値はマシン依存のため、CIなど計測するのと同じ環境で記録すること。
+"""
+import os
+import re
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from typing import Dict, List
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_FILE = os.path.join(ROOT_DIR, "insurance_automation_app_v2.py")
+BASELINE_FILE = os.path.join(ROOT_DIR, "benchmarks", "startup_baseline.json")
+
+MODULES = [
+    "streamlit",
+    "pandas",
+    "numpy",
+    "pymupdf4llm",
+    "google.generativeai",
+    "google.cloud.storage",
+    "pdf2image",
+    "pipeline.page_cache",
+    "pipeline.modality",
+    "pipeline.numeric",
+    "pipeline.batching",
+    "pipeline.cascade",
+    "extractors.tokio",
+    "extractors.sompo",
+    "extractors.mitsui",
+    "extractors.batch",
+]
+
+# ログイン画面の描画までに読み込まれてはならないモジュール
+DEFERRED_MODULES = [
+    "pandas",
+    "pymupdf4llm",
+    "google.generativeai",
+    "google.cloud.storage",
+    "pdf2image",
+]
+
+# 基準値に対する許容幅（相対・絶対）
+TOLERANCE_RATIO = 1.3
+TOLERANCE_SECONDS = 0.05
+
+_FIRST_RENDER_SCRIPT = """
+import sys, time, json
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file({app!r}, default_timeout=120)
+at.secrets["auth_users"] = {{"bench_username": "bench", "bench_name": "bench", "bench_password": "bench"}}
+at.secrets["GEMINI_API_KEY"] = "bench"
+at.secrets["startup_config"] = {{"preload_sdks": False}}
+started = time.perf_counter()
+at.run()
+elapsed = time.perf_counter() - started
+loaded = [m for m in {deferred!r} if m in sys.modules]
+print(json.dumps({{"seconds": elapsed, "loaded": loaded, "exception": [str(e.value) for e in at.exception]}}))
+"""
+
+
+def measure_import(module: str) -> float:
+    """新しいプロセスでモジュールをインポートし、累積インポート時間（秒）を返す"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT_DIR,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"{module} のインポートに失敗しました: {proc.stderr.strip().splitlines()[-1:]}")
+    pattern = re.compile(r"^import time:\s+\d+\s+\|\s+(\d+)\s+\|\s*(\S+)\s*$")
+    for line in reversed(proc.stderr.splitlines()):
+        match = pattern.match(line)
+        if match and match.group(2) == module:
+            return int(match.group(1)) / 1e6
+    return 0.0
+
+
+def measure_first_render() -> Dict[str, object]:
+    script = _FIRST_RENDER_SCRIPT.format(app=APP_FILE, deferred=DEFERRED_MODULES)
+    proc = subprocess.run([sys.executable, "-c", script], cwd=ROOT_DIR, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"初回描画の計測に失敗しました: {proc.stderr.strip()[-500:]}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def run_benchmark(repeat: int) -> Dict[str, object]:
+    imports = {}
+    for module in MODULES:
+        imports[module] = statistics.median(measure_import(module) for _ in range(repeat))
+    renders = [measure_first_render() for _ in range(repeat)]
+    return {
+        "imports": imports,
+        "first_render": statistics.median(r["seconds"] for r in renders),
+        "loaded_before_render": sorted({m for r in renders for m in r["loaded"]}),
+        "exceptions": [e for r in renders for e in r["exception"]],
+    }
+
+
+def compare(result: Dict[str, object], baseline: Dict[str, object]) -> List[str]:
+    failures = []
+
+    def check(label: str, value: float, base: float):
+        if value > base * TOLERANCE_RATIO + TOLERANCE_SECONDS:
+            failures.append(f"{label}: {value:.3f}s（基準 {base:.3f}s）")
+
+    for module, seconds in result["imports"].items():
+        if module in baseline.get("imports", {}):
+            check(f"import {module}", seconds, baseline["imports"][module])
+    if "first_render" in baseline:
+        check("初回描画", result["first_render"], baseline["first_render"])
+    return failures
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args(argv)
+
+    result = run_benchmark(args.repeat)
+    for module, seconds in result["imports"].items():
+        print(f"import {module:<24} {seconds * 1000:8.1f} ms")
+    print(f"初回描画（ログイン画面）   {result['first_render'] * 1000:8.1f} ms")
+
+    failures = []
+    if result["exceptions"]:
+        failures.append(f"初回描画で例外: {result['exceptions']}")
+    if result["loaded_before_render"]:
+        failures.append(f"初回描画前に読み込まれたSDK: {', '.join(result['loaded_before_render'])}")
+
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"imports": result["imports"], "first_render": result["first_render"]}, f, indent=2)
+        print(f"基準値を更新しました: {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            failures += compare(result, json.load(f))
+    else:
+        print("基準値ファイルがありません（--update-baseline で作成）。比較は省略します。")
+
+    for failure in failures:
+        print(f"❌ {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,25 @@
+from typing import List
+import json
+
+def build_batch_prompt(doc_ids: List[str], step1_prompt: str, step2_prompt: str) -> str:
+    """同一保険会社の複数文書を1リクエストで抽出するためのプロンプト"""
+    template = {doc_id: [{"...": "プラン1の抽出結果"}, {"...": "プラン2の抽出結果"}] for doc_id in doc_ids[:2]}
+    template_json_str = json.dumps(template, ensure_ascii=False, indent=2)
+
+    return (
+        f"以下に {len(doc_ids)} 件の見積書があります。各文書は「<<<文書ID 開始>>>」と「<<<文書ID 終了>>>」で区切られています。\n"
+        f"文書ID: {', '.join(doc_ids)}\n\n"
+        "【絶対ルール】\n"
+        "・文書ごとに独立して抽出し、他の文書の値を混ぜないこと。\n"
+        "・まず【基本情報の抽出ルール】で各文書の基本情報を抽出し、その文書の全プランに適用すること。\n"
+        "・次に【プラン詳細の抽出ルール】で各文書のプランを抽出すること（【基本情報】が空でも上記で抽出した値を使う）。\n"
+        "・各ルール内の出力形式の指定は無視し、最後の【出力形式】のみに従うこと。\n\n"
+        "【基本情報の抽出ルール】\n"
+        f"{step1_prompt}\n\n"
+        "【プラン詳細の抽出ルール】\n"
+        f"{step2_prompt}\n\n"
+        "【出力形式】\n"
+        "文書IDをキー、その文書のプランJSON配列を値とするJSONオブジェクトのみを出力してください（マークダウン符号の使用禁止）。\n"
+        "全ての文書IDをキーとして必ず含めること。例:\n"
+        f"{template_json_str}"
+    )
@@ -1,3 +1,5 @@
+from __future__ import annotations
+
 import os
 import io
 import sys
@@ -7,22 +9,79 @@ import time
 import logging
 import datetime
 import tempfile
-from typing import List, Dict, Any
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, List, Dict, Any, Callable, Iterator, Optional
 
 import streamlit as st
-import pandas as pd
-import pymupdf4llm
-import google.generativeai as genai
-from pdf2image import convert_from_bytes
-from PIL import Image
 
-from google.cloud import storage
-from google.oauth2 import service_account
+from pipeline.lazy import lazy_import
+
+# 重いSDKは初回利用時に読み込む（ログイン画面の描画を待たせないため）
+pd = lazy_import("pandas")
+pymupdf4llm = lazy_import("pymupdf4llm")
+pymupdf = lazy_import("pymupdf")
+genai = lazy_import("google.generativeai")
+pdf2image = lazy_import("pdf2image")
+storage = lazy_import("google.cloud.storage")
+service_account = lazy_import("google.oauth2.service_account")
+
+if TYPE_CHECKING:
+    from PIL import Image
 
 # 各社専用プロンプトのインポート
 from extractors.tokio import build_tokio_step1_prompt, build_tokio_step2_prompt
 from extractors.sompo import build_sompo_step1_prompt, build_sompo_step2_prompt
 from extractors.mitsui import build_mitsui_step1_prompt, build_mitsui_step2_prompt
+from extractors.batch import build_batch_prompt
+
+from pipeline.page_cache import PageCache, pdf_digest
+from pipeline.modality import (
+    MODALITY_TEXT,
+    MODALITY_IMAGE,
+    MODALITY_BOTH,
+    MODALITY_PDF,
+    MODALITY_LABELS,
+    INPUT_MODE_NATIVE_PDF,
+    INPUT_MODE_LABELS,
+    japanese_ratio,
+    plan_modality,
+    resolve_input_mode,
+)
+from pipeline.numeric import add_typed_columns, rank_plans, cheapest_mask, strip_derived_columns
+from pipeline.batching import (
+    estimate_tokens,
+    make_doc_id,
+    plan_units,
+    resolve_batch_config,
+    split_batch_response,
+)
+from pipeline.ingest import (
+    IngestItem,
+    LocalDirectoryClient,
+    iter_gcs_pdfs,
+    iter_uploaded_files,
+    iter_zip_members,
+    split_skipped,
+)
+from pipeline.cascade import (
+    TIER_FAST,
+    TIER_STRONG,
+    TIER_LABELS,
+    CascadeStats,
+    resolve_cascade_config,
+    validate_rows,
+)
+from pipeline.gemini_call import (
+    CALL_BATCH,
+    CALL_PROPOSAL,
+    CALL_RETRY,
+    CALL_STEP1,
+    CALL_STEP2,
+    CALL_TYPE_LABELS,
+    GeminiCaller,
+    LatencyHistogram,
+)
+from pipeline.history import DEFAULT_DB_PATH, HISTORY_COLUMN_LABELS, ROW_FILE_HASH_KEY, ROW_MODEL_KEY, HistoryStore
 
 # ======================
 # JSTタイムゾーン定義 (UTC+9)
@@ -61,26 +120,56 @@ DEFAULT_FIELDS = [
     "ファイル名"
 ]
 
+def get_secret_section(section: str) -> Dict[str, Any]:
+    """secrets.tomlの任意セクションを辞書で取得（未設定なら空）"""
+    try:
+        return dict(st.secrets.get(section, {}))
+    except Exception:
+        return {}
+
 # ======================
 # GCSログ設定
 # ======================
-@st.cache_resource
 def init_gcs_client():
+    """GCSクライアントを生成し、(client, エラーメッセージ) を返す（バックグラウンドで実行）"""
     try:
+        # 開発・テスト用: local_root を指定するとローカルディレクトリをGCSの代わりに使う
+        local_root = get_secret_section("gcs_config").get("local_root")
+        if local_root:
+            return LocalDirectoryClient(local_root), None
         gcs_credentials_info = dict(st.secrets["gcs_service_account"])
         credentials = service_account.Credentials.from_service_account_info(gcs_credentials_info)
         client = storage.Client(credentials=credentials)
         bucket_name = st.secrets["gcs_config"]["bucket_name"]
         client.get_bucket(bucket_name)
-        return client
+        return client, None
     except KeyError as ke:
-        st.error(f"❌ GCS認証情報またはバケット名がsecrets.tomlに設定されていません。不足キー: {ke}")
-        return None
+        return None, f"❌ GCS認証情報またはバケット名がsecrets.tomlに設定されていません。不足キー: {ke}"
     except Exception as e:
-        st.error(f"❌ GCSクライアントの初期化に失敗しました: {e}")
-        return None
+        return None, f"❌ GCSクライアントの初期化に失敗しました: {e}"
+
+# ログイン画面の表示後に読み込むSDK（抽出処理・Gemini呼び出しで使用）
+PRELOAD_MODULES = [pd, genai, pymupdf4llm, pdf2image]
 
-gcs_client = init_gcs_client()
+def preload_heavy_modules():
+    for module in PRELOAD_MODULES:
+        module.preload()
+
+@st.cache_resource
+def start_background_init() -> Dict[str, Future]:
+    """GCS接続とSDKの読み込みをバックグラウンドで開始する（プロセスで1回）"""
+    executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="background-init")
+    futures = {"gcs": executor.submit(init_gcs_client)}
+    startup_config = get_secret_section("startup_config")
+    if startup_config.get("preload_sdks", True):
+        futures["sdk"] = executor.submit(preload_heavy_modules)
+    executor.shutdown(wait=False)
+    return futures
+
+def get_gcs_client():
+    """GCSクライアントを取得（初期化が未完了の場合は完了まで待つ）"""
+    client, _ = start_background_init()["gcs"].result()
+    return client
 
 # ======================
 # コンソールログ設定
@@ -109,6 +198,7 @@ def log_user_action(action_description: str):
     for handler in logger.handlers:
         handler.flush()
 
+    gcs_client = get_gcs_client()
     if gcs_client:
         try:
             bucket_name = st.secrets["gcs_config"]["bucket_name"]
@@ -181,10 +271,6 @@ if "extract_messages" not in st.session_state:
     st.session_state["extract_messages"] = []
 if "fields" not in st.session_state:
     st.session_state["fields"] = DEFAULT_FIELDS.copy()
-if "customer_df" not in st.session_state:
-    st.session_state["customer_df"] = pd.DataFrame()
-if "comparison_df" not in st.session_state:
-    st.session_state["comparison_df"] = pd.DataFrame()
 if "customer_file_name" not in st.session_state:
     st.session_state["customer_file_name"] = None
 if "proposal_message" not in st.session_state:
@@ -229,14 +315,13 @@ def load_and_map_secrets():
         st.session_state["authentication_status"] = False
         return {}
 
-AUTHENTICATION_USERS = load_and_map_secrets()
-
 def authenticate_user(username: str, password: str):
-    if username in AUTHENTICATION_USERS:
-        stored_password = AUTHENTICATION_USERS[username]["password"]
+    authentication_users = load_and_map_secrets()
+    if username in authentication_users:
+        stored_password = authentication_users[username]["password"]
         if password == stored_password:
             st.session_state["authentication_status"] = True
-            st.session_state["name"] = AUTHENTICATION_USERS[username]["name"]
+            st.session_state["name"] = authentication_users[username]["name"]
             st.session_state["username"] = username
             log_user_action("ログイン成功")
             return True
@@ -291,11 +376,6 @@ def get_aliases_for_field(field_name: str) -> List[str]:
             return v
     return [field_name]
 
-def japanese_ratio(text: str) -> float:
-    if not text: return 0.0
-    jp_chars = re.findall(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uff10-\uff19\uff21-\uff3a\uff41-\uff5a]", text)
-    return len(jp_chars) / max(len(text), 1)
-
 def detect_insurer(pdf_name: str, text: str) -> str:
     joined = f"{pdf_name}\n{text}"
     if "損保ジャパン" in joined or "ＴＨＥ すまいの保険" in joined:
@@ -350,9 +430,23 @@ def normalize_extracted_record(record: Dict[str, Any], fields: List[str], pdf_na
 # ======================
 # PDF解析・データ抽出基盤
 # ======================
-@st.cache_data
+@st.cache_resource
+def get_page_cache() -> PageCache:
+    """ページ画像・Markdownの共有キャッシュ（secretsの[cache_config]で上限を調整可能）"""
+    cache_config = get_secret_section("cache_config")
+    return PageCache(
+        max_bytes=int(cache_config.get("max_memory_mb", 512)) * 1024 * 1024,
+        ttl_seconds=float(cache_config.get("ttl_seconds", 3600)),
+        disk_dir=cache_config.get("disk_dir") or None,
+        disk_max_bytes=int(cache_config.get("max_disk_mb", 2048)) * 1024 * 1024,
+    )
+
 def extract_text_from_pdf(pdf_bytes: bytes) -> str:
     """PDFをMarkdown形式に高精度変換"""
+    key = f"md:{pdf_digest(pdf_bytes)}"
+    return get_page_cache().get_or_compute(key, lambda: _convert_pdf_to_markdown(pdf_bytes))
+
+def _convert_pdf_to_markdown(pdf_bytes: bytes) -> str:
     with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_pdf:
         temp_pdf.write(pdf_bytes)
         temp_pdf_path = temp_pdf.name
@@ -366,9 +460,70 @@ def extract_text_from_pdf(pdf_bytes: bytes) -> str:
         if os.path.exists(temp_pdf_path):
             os.remove(temp_pdf_path)
 
-@st.cache_data
-def convert_pdf_to_images(pdf_bytes: bytes):
-    return convert_from_bytes(pdf_bytes, dpi=220)
+def extract_head_text(pdf_bytes: bytes, max_pages: int = 2) -> str:
+    """保険会社判定用に先頭ページのテキスト層だけを取得（Markdown変換より大幅に軽い）"""
+    key = f"head:{max_pages}:{pdf_digest(pdf_bytes)}"
+    return get_page_cache().get_or_compute(key, lambda: _read_head_text(pdf_bytes, max_pages))
+
+def _read_head_text(pdf_bytes: bytes, max_pages: int) -> str:
+    try:
+        with pymupdf.open(stream=pdf_bytes, filetype="pdf") as doc:
+            return "\n".join(doc[i].get_text() for i in range(min(max_pages, doc.page_count)))
+    except Exception as e:
+        print(f"先頭ページのテキスト取得エラー: {e}")
+        return ""
+
+def get_input_mode(insurer: str) -> str:
+    """画面での指定を優先し、なければ[input_mode_config]の保険会社別設定で入力モードを決める"""
+    override = st.session_state.get("input_mode_override")
+    if override in INPUT_MODE_LABELS:
+        return override
+    return resolve_input_mode(insurer, get_secret_section("input_mode_config"))
+
+def build_pdf_part(pdf_bytes: bytes, pdf_name: str, uploads: Optional[Dict[str, Any]] = None):
+    """PDFをそのままGeminiに渡すパーツを作る（戻り値: パーツ, 呼び出し側で削除すべきファイル or None）
+
+    インライン送信の上限を超えるPDFは File API にアップロードして参照する。
+    uploads を渡した場合はアップロード済みのファイルを使い回し、削除は uploads の持ち主が行う。
+    """
+    inline_max_mb = float(get_secret_section("input_mode_config").get("inline_max_mb", 18))
+    if len(pdf_bytes) <= inline_max_mb * 1024 * 1024:
+        import base64
+        b64 = base64.b64encode(pdf_bytes).decode("utf-8")
+        return {"inline_data": {"mime_type": "application/pdf", "data": b64}}, None
+
+    digest = pdf_digest(pdf_bytes)
+    if uploads is not None and digest in uploads:
+        return uploads[digest], None
+
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_pdf:
+        temp_pdf.write(pdf_bytes)
+        temp_pdf_path = temp_pdf.name
+    try:
+        uploaded = genai.upload_file(path=temp_pdf_path, mime_type="application/pdf", display_name=pdf_name)
+        if uploads is not None:
+            uploads[digest] = uploaded
+            return uploaded, None
+        return uploaded, uploaded
+    finally:
+        if os.path.exists(temp_pdf_path):
+            os.remove(temp_pdf_path)
+
+def delete_uploaded_pdf(uploaded_file) -> None:
+    # File API のファイルは48時間で自動削除されるが、見積書は個人情報を含むため抽出後すぐに消す
+    try:
+        genai.delete_file(uploaded_file.name)
+    except Exception as e:
+        print(f"アップロードファイル削除エラー: {e}")
+
+# Geminiに送るのは先頭ページのみのため、それ以降はラスタ化・キャッシュしない
+MAX_IMAGE_PAGES = 4
+
+def convert_pdf_to_images(pdf_bytes: bytes, dpi: int = 220, max_pages: int = MAX_IMAGE_PAGES):
+    key = f"pages:{dpi}:{max_pages}:{pdf_digest(pdf_bytes)}"
+    return get_page_cache().get_or_compute(
+        key, lambda: pdf2image.convert_from_bytes(pdf_bytes, dpi=dpi, last_page=max_pages)
+    )
 
 def pil_image_to_gemini_part(img: "Image.Image") -> Dict[str, Any]:
     buf = io.BytesIO()
@@ -382,6 +537,26 @@ def pil_image_to_gemini_part(img: "Image.Image") -> Dict[str, Any]:
         }
     }
 
+def load_page_images(pdf_bytes: bytes, pdf_name: str) -> List[Dict[str, Any]]:
+    """先頭ページ（MAX_IMAGE_PAGES枚まで）を画像パーツに変換（失敗時は空リスト）"""
+    try:
+        pil_images = convert_pdf_to_images(pdf_bytes)
+        return [pil_image_to_gemini_part(img) for img in pil_images[:MAX_IMAGE_PAGES]]
+    except Exception as img_e:
+        st.session_state["extract_messages"].append(f"⚠️ {pdf_name}: 画像変換失敗 - {img_e}")
+        return []
+
+def build_gemini_contents(prompt: str, text: str, images: List[Any], modality: str) -> List[Any]:
+    """モダリティに応じてMarkdownと画像の送信有無を切り替える（PDF直接送信時は images にPDFパーツを渡す）"""
+    if modality == MODALITY_PDF:
+        return images + [{"text": prompt}]
+    if modality == MODALITY_IMAGE and images:
+        return [{"text": prompt}] + images
+    contents = [{"text": f"【Markdown Data】\n{text}\n\n{prompt}"}]
+    if modality != MODALITY_TEXT:
+        contents.extend(images)
+    return contents
+
 def build_multi_plan_prompt(fields: List[str], pdf_name: str, insurer: str, retry_mode: bool = False) -> str:
     """保険会社不明の場合の汎用プロンプト"""
     all_keys = list(dict.fromkeys(fields + ["保険会社", "プラン", "プラン識別子"]))
@@ -422,10 +597,24 @@ def extract_json_from_text(text: str) -> Any:
         except: pass
     return None
 
-def call_gemini_for_plan_rows(model, contents: List[Any], fields: List[str], pdf_name: str, insurer: str):
+@st.cache_resource
+def get_gemini_caller() -> GeminiCaller:
+    """Gemini呼び出しの共有ラッパー（secretsの[gemini_call_config]で期限・ヘッジ等を調整可能）"""
+    return GeminiCaller(get_secret_section("gemini_call_config"))
+
+def call_gemini_for_plan_rows(
+    model,
+    contents: List[Any],
+    fields: List[str],
+    pdf_name: str,
+    insurer: str,
+    call_type: str = CALL_STEP2,
+):
     try:
-        response = model.generate_content(
+        response = get_gemini_caller().call(
+            model,
             contents,
+            call_type,
             generation_config={"temperature": 0},
         )
         if not response or not response.text:
@@ -458,103 +647,365 @@ def call_gemini_for_plan_rows(model, contents: List[Any], fields: List[str], pdf
         st.session_state["extract_messages"].append(f"❌ {pdf_name}: Gemini API呼び出しエラー - {e}")
         return []
 
-def extract_info_with_gemini_multi_plan(pdf_bytes: bytes, fields: List[str], pdf_name: str, model):
-    with st.spinner(f"[{pdf_name}] Markdown変換と2段階抽出を実行中..."):
-        text = extract_text_from_pdf(pdf_bytes)
-        text_quality = japanese_ratio(text)
-        insurer = detect_insurer(pdf_name, text)
-        expected_count = expected_plan_count(insurer)
-
-        st.session_state["extract_messages"].append(
-            f"ℹ️ {pdf_name}: 保険会社={insurer or '不明'}, "
-            f"テキスト品質={text_quality:.2f}, 期待プラン数={expected_count}"
-        )
+def extract_info_with_gemini_multi_plan(
+    pdf_bytes: bytes,
+    fields: List[str],
+    pdf_name: str,
+    model,
+    on_status: Optional[Callable[[str], None]] = None,
+    input_mode: Optional[str] = None,
+    uploads: Optional[Dict[str, Any]] = None,
+):
+    """input_mode を省略した場合は get_input_mode() で保険会社別に決める（uploads は build_pdf_part を参照）"""
+    notify = on_status or (lambda _state: None)
+    head_text = extract_head_text(pdf_bytes)
+    input_mode = input_mode or get_input_mode(detect_insurer(pdf_name, head_text))
+    uploaded_file = None
+    spinner_label = "PDF直接送信で" if input_mode == INPUT_MODE_NATIVE_PDF else "Markdown変換と"
+    # 途中で例外や再実行（RerunException等のBaseException）が起きても、アップロードしたPDFは必ず削除する
+    try:
+        with st.spinner(f"[{pdf_name}] {spinner_label}2段階抽出を実行中..."):
+            notify("変換中")
+            if input_mode == INPUT_MODE_NATIVE_PDF:
+                # Markdown変換・ラスタ化を行わず、PDFの読み取りはGemini側に任せる
+                text = ""
+                text_quality = japanese_ratio(head_text)
+                insurer = detect_insurer(pdf_name, head_text)
+                modality_plan = {"mode": MODALITY_PDF, "reason": "PDFを直接送信"}
+            else:
+                text = extract_text_from_pdf(pdf_bytes)
+                text_quality = japanese_ratio(text)
+                insurer = detect_insurer(pdf_name, text)
+                modality_plan = plan_modality(text, insurer, get_secret_section("modality_config"))
+            expected_count = expected_plan_count(insurer)
+            modality = modality_plan["mode"]
+
+            st.session_state["extract_messages"].append(
+                f"ℹ️ {pdf_name}: 保険会社={insurer or '不明'}, "
+                f"テキスト品質={text_quality:.2f}, 期待プラン数={expected_count}, "
+                f"送信形式={MODALITY_LABELS[modality]}（{modality_plan['reason']}）"
+            )
+
+            if modality == MODALITY_PDF:
+                pdf_part, uploaded_file = build_pdf_part(pdf_bytes, pdf_name, uploads)
+                images = [pdf_part]
+            else:
+                # テキストのみで足りる場合はラスタ化自体を省略する
+                images = [] if modality == MODALITY_TEXT else load_page_images(pdf_bytes, pdf_name)
 
-        images = []
-        try:
-            pil_images = convert_pdf_to_images(pdf_bytes)
-            images = [pil_image_to_gemini_part(img) for img in pil_images[:4]]
-        except Exception as img_e:
-            st.session_state["extract_messages"].append(f"⚠️ {pdf_name}: 画像変換失敗 - {img_e}")
-
-        # --- 2段階抽出: ステップ1（基本情報の抽出） ---
-        common_info = {}
-        if insurer in ["東京海上日動", "損保ジャパン", "三井住友海上"]:
-            if insurer == "東京海上日動":
-                prompt_step1 = build_tokio_step1_prompt()
-            elif insurer == "損保ジャパン":
-                prompt_step1 = build_sompo_step1_prompt()
-            elif insurer == "三井住友海上":
-                prompt_step1 = build_mitsui_step1_prompt()
-
-            contents_step1 = [{"text": f"【Markdown Data】\n{text}\n\n{prompt_step1}"}]
-            contents_step1.extend(images)
-            try:
-                response_step1 = model.generate_content(contents_step1)
-                common_info = extract_json_from_text(response_step1.text)
-                if isinstance(common_info, list) and len(common_info) > 0:
-                    common_info = common_info[0]
-                if not isinstance(common_info, dict):
+            # --- 2段階抽出: ステップ1（基本情報の抽出） ---
+            common_info = {}
+            if insurer in ["東京海上日動", "損保ジャパン", "三井住友海上"]:
+                if insurer == "東京海上日動":
+                    prompt_step1 = build_tokio_step1_prompt()
+                elif insurer == "損保ジャパン":
+                    prompt_step1 = build_sompo_step1_prompt()
+                elif insurer == "三井住友海上":
+                    prompt_step1 = build_mitsui_step1_prompt()
+
+                contents_step1 = build_gemini_contents(prompt_step1, text, images, modality)
+                notify("ステップ1")
+                try:
+                    response_step1 = get_gemini_caller().call(model, contents_step1, CALL_STEP1)
+                    common_info = extract_json_from_text(response_step1.text)
+                    if isinstance(common_info, list) and len(common_info) > 0:
+                        common_info = common_info[0]
+                    if not isinstance(common_info, dict):
+                        common_info = {}
+                except Exception as e:
+                    print(f"ステップ1エラー: {e}")
                     common_info = {}
-            except Exception as e:
-                print(f"ステップ1エラー: {e}")
-                common_info = {}
-
-            # --- 2段階抽出: ステップ2（プラン詳細の抽出） ---
-            if insurer == "東京海上日動":
-                prompt_1 = build_tokio_step2_prompt(fields, common_info)
-            elif insurer == "損保ジャパン":
-                prompt_1 = build_sompo_step2_prompt(fields, common_info)
-            elif insurer == "三井住友海上":
-                prompt_1 = build_mitsui_step2_prompt(fields, common_info)
-        else:
-            prompt_1 = build_multi_plan_prompt(fields, pdf_name, insurer, retry_mode=False)
-
-        contents_1 = [{"text": f"【Markdown Data】\n{text}\n\n{prompt_1}"}]
-        contents_1.extend(images)
-
-        rows_1 = call_gemini_for_plan_rows(model, contents_1, fields, pdf_name, insurer)
 
-        # プラン数不足の場合のリトライ
-        if len(rows_1) < expected_count:
-            if insurer in ["東京海上日動", "損保ジャパン", "三井住友海上"]:
+                # --- 2段階抽出: ステップ2（プラン詳細の抽出） ---
                 if insurer == "東京海上日動":
-                    prompt_retry = build_tokio_step2_prompt(fields, common_info)
+                    prompt_1 = build_tokio_step2_prompt(fields, common_info)
                 elif insurer == "損保ジャパン":
-                    prompt_retry = build_sompo_step2_prompt(fields, common_info)
+                    prompt_1 = build_sompo_step2_prompt(fields, common_info)
                 elif insurer == "三井住友海上":
-                    prompt_retry = build_mitsui_step2_prompt(fields, common_info)
-                prompt_retry += "\n\n【重要】プラン数が不足しています。必ず全プラン出力してください。"
+                    prompt_1 = build_mitsui_step2_prompt(fields, common_info)
             else:
-                prompt_retry = build_multi_plan_prompt(fields, pdf_name, insurer, retry_mode=True)
-                
-            contents_2 = [{"text": f"【Markdown Data】\n{text}\n\n{prompt_retry}"}] + images
-            rows_2 = call_gemini_for_plan_rows(model, contents_2, fields, pdf_name, insurer)
-            if len(rows_2) > len(rows_1):
-                rows_1 = rows_2
-
-        # 抽出日・ファイル名の付与と重複排除
-        today = datetime.datetime.now(JST).strftime("%Y-%m-%d")
-        unique_rows = []
-        seen = set()
-        for row in rows_1:
-            row["保険会社"] = clean_value(row.get("保険会社", "")) or insurer
-            row["プラン"] = clean_value(row.get("プラン", "")) or clean_value(row.get("プラン識別子", ""))
-            row["プラン識別子"] = clean_value(row.get("プラン識別子", "")) or row["プラン"]
-            row["抽出日"] = today
-            row["ファイル名"] = pdf_name
-            key = json.dumps(row, ensure_ascii=False, sort_keys=True)
-            if key not in seen:
-                seen.add(key)
-                unique_rows.append(row)
-
-        return unique_rows
+                prompt_1 = build_multi_plan_prompt(fields, pdf_name, insurer, retry_mode=False)
+
+            contents_1 = build_gemini_contents(prompt_1, text, images, modality)
+
+            notify("ステップ2")
+            rows_1 = call_gemini_for_plan_rows(model, contents_1, fields, pdf_name, insurer)
+
+            # プラン数不足の場合のリトライ
+            if len(rows_1) < expected_count:
+                if insurer in ["東京海上日動", "損保ジャパン", "三井住友海上"]:
+                    if insurer == "東京海上日動":
+                        prompt_retry = build_tokio_step2_prompt(fields, common_info)
+                    elif insurer == "損保ジャパン":
+                        prompt_retry = build_sompo_step2_prompt(fields, common_info)
+                    elif insurer == "三井住友海上":
+                        prompt_retry = build_mitsui_step2_prompt(fields, common_info)
+                    prompt_retry += "\n\n【重要】プラン数が不足しています。必ず全プラン出力してください。"
+                else:
+                    prompt_retry = build_multi_plan_prompt(fields, pdf_name, insurer, retry_mode=True)
+
+                # テキストのみで不足した場合は、リトライ時に画像も併用する
+                if modality == MODALITY_TEXT:
+                    modality = MODALITY_BOTH
+                    images = load_page_images(pdf_bytes, pdf_name)
+                contents_2 = build_gemini_contents(prompt_retry, text, images, modality)
+                notify("リトライ")
+                rows_2 = call_gemini_for_plan_rows(model, contents_2, fields, pdf_name, insurer, call_type=CALL_RETRY)
+                if len(rows_2) > len(rows_1):
+                    rows_1 = rows_2
+
+            return finalize_rows(rows_1, insurer, pdf_name)
+    finally:
+        if uploaded_file is not None:
+            delete_uploaded_pdf(uploaded_file)
+
+def finalize_rows(rows: List[Dict[str, Any]], insurer: str, pdf_name: str) -> List[Dict[str, Any]]:
+    """抽出日・ファイル名の付与と重複排除"""
+    today = datetime.datetime.now(JST).strftime("%Y-%m-%d")
+    unique_rows = []
+    seen = set()
+    for row in rows:
+        row["保険会社"] = clean_value(row.get("保険会社", "")) or insurer
+        row["プラン"] = clean_value(row.get("プラン", "")) or clean_value(row.get("プラン識別子", ""))
+        row["プラン識別子"] = clean_value(row.get("プラン識別子", "")) or row["プラン"]
+        row["抽出日"] = today
+        row["ファイル名"] = pdf_name
+        key = json.dumps(row, ensure_ascii=False, sort_keys=True)
+        if key not in seen:
+            seen.add(key)
+            unique_rows.append(row)
+    return unique_rows
+
+# ======================
+# モデル段階実行（軽量モデルで抽出し、検証NGの文書のみ上位モデルで再抽出）
+# ======================
+@st.cache_resource
+def get_cascade_stats() -> CascadeStats:
+    return CascadeStats()
+
+def get_cascade_config() -> Dict[str, Any]:
+    return resolve_cascade_config(get_secret_section("cascade_config"))
+
+def run_extraction_tier(
+    tier: str,
+    pdf_bytes: bytes,
+    fields: List[str],
+    pdf_name: str,
+    models: Dict[str, Any],
+    on_status: Optional[Callable[[str], None]] = None,
+    uploads: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
+    started_at = time.perf_counter()
+    rows = extract_info_with_gemini_multi_plan(
+        pdf_bytes, fields, pdf_name, models[tier], on_status=on_status, uploads=uploads
+    )
+    get_cascade_stats().record_attempt(tier, time.perf_counter() - started_at)
+    return stamp_model(rows, models[tier])
+
+def stamp_model(rows: List[Dict[str, Any]], model) -> List[Dict[str, Any]]:
+    """抽出履歴用に、各行を抽出したモデル名を内部キーで付与する"""
+    model_name = str(getattr(model, "model_name", "")).removeprefix("models/")
+    for row in rows:
+        row[ROW_MODEL_KEY] = model_name
+    return rows
+
+def extract_with_cascade(
+    pdf_bytes: bytes,
+    fields: List[str],
+    pdf_name: str,
+    models: Dict[str, Any],
+    on_status: Optional[Callable[[str], None]] = None,
+) -> List[Dict[str, Any]]:
+    """軽量モデルで抽出し、ローカル検証に通らない場合のみ上位モデルで再抽出する"""
+    if TIER_FAST not in models:
+        rows = run_extraction_tier(TIER_STRONG, pdf_bytes, fields, pdf_name, models, on_status)
+        get_cascade_stats().record_document(False, [])
+        return rows
+
+    # 期待プラン数の判定だけなので、Markdown変換は行わず先頭ページのテキストで判定する
+    insurer = detect_insurer(pdf_name, extract_head_text(pdf_bytes))
+    min_filled_ratio = get_cascade_config()["min_filled_ratio"]
+    # File API にアップロードしたPDFは上位モデルでの再抽出でも使い回し、最後にまとめて削除する
+    uploads: Dict[str, Any] = {}
+    try:
+        rows = run_extraction_tier(TIER_FAST, pdf_bytes, fields, pdf_name, models, on_status, uploads)
+        issues = validate_rows(rows, fields, expected_plan_count(insurer), min_filled_ratio, insurer)
+        get_cascade_stats().record_document(bool(issues), issues)
+        if not issues:
+            return rows
+        return escalate_to_strong_model(rows, issues, pdf_bytes, fields, pdf_name, models, on_status, uploads)
+    finally:
+        for uploaded_file in uploads.values():
+            delete_uploaded_pdf(uploaded_file)
+
+def escalate_to_strong_model(
+    rows: List[Dict[str, Any]],
+    issues: List[str],
+    pdf_bytes: bytes,
+    fields: List[str],
+    pdf_name: str,
+    models: Dict[str, Any],
+    on_status: Optional[Callable[[str], None]] = None,
+    uploads: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
+    st.session_state["extract_messages"].append(
+        f"⚠️ {pdf_name}: {TIER_LABELS[TIER_FAST]}の結果が検証NG（{'、'.join(issues)}）のため{TIER_LABELS[TIER_STRONG]}で再抽出します。"
+    )
+    if on_status:
+        on_status(TIER_LABELS[TIER_STRONG])
+    strong_rows = run_extraction_tier(TIER_STRONG, pdf_bytes, fields, pdf_name, models, on_status, uploads)
+    # 上位モデルでも結果が得られない場合は、軽量モデルの結果を残す
+    return strong_rows if strong_rows else rows
+
+# ======================
+# 複数PDFのバッチ抽出（同一保険会社の文書を1リクエストに集約）
+# ======================
+STEP1_PROMPT_BUILDERS = {
+    "東京海上日動": build_tokio_step1_prompt,
+    "損保ジャパン": build_sompo_step1_prompt,
+    "三井住友海上": build_mitsui_step1_prompt,
+}
+STEP2_PROMPT_BUILDERS = {
+    "東京海上日動": build_tokio_step2_prompt,
+    "損保ジャパン": build_sompo_step2_prompt,
+    "三井住友海上": build_mitsui_step2_prompt,
+}
+
+def prepare_document(item: IngestItem) -> Dict[str, Any]:
+    """バッチ計画用に、テキスト層・保険会社・送信形式・概算トークン数を求める
+
+    PDF本体は保持せず、画像化や個別抽出が必要になった時点で item から読み直す。
+    読み込みに失敗した文書は保険会社不明として扱い、個別処理でエラーを報告させる。
+    """
+    try:
+        pdf_bytes = item.read()
+        digest = pdf_digest(pdf_bytes)
+        head_insurer = detect_insurer(item.name, extract_head_text(pdf_bytes))
+        if get_input_mode(head_insurer) == INPUT_MODE_NATIVE_PDF:
+            # PDF直接送信の文書はMarkdown変換を行わず、個別抽出に回す
+            return {"name": item.name, "item": item, "digest": digest, "text": "", "insurer": head_insurer, "modality": MODALITY_PDF, "tokens": 0}
+        text = extract_text_from_pdf(pdf_bytes)
+    except Exception:
+        return {"name": item.name, "item": item, "digest": "", "text": "", "insurer": "", "modality": MODALITY_IMAGE, "tokens": 0}
+    insurer = detect_insurer(item.name, text)
+    modality = plan_modality(text, insurer, get_secret_section("modality_config"))["mode"]
+    image_count = 0 if modality == MODALITY_TEXT else 4
+    return {
+        "name": item.name,
+        "item": item,
+        "digest": digest,
+        "text": text,
+        "insurer": insurer,
+        "modality": modality,
+        "tokens": estimate_tokens(text, image_count),
+    }
+
+def plan_extraction_units(docs: List[Dict[str, Any]]) -> List[List[int]]:
+    """保険会社が判明し、テキスト層を使える文書だけをトークン予算内でまとめる"""
+    batch_config = resolve_batch_config(get_secret_section("batch_config"))
+    groups = [
+        doc["insurer"] if doc["insurer"] in STEP2_PROMPT_BUILDERS and doc["modality"] not in (MODALITY_IMAGE, MODALITY_PDF) else ""
+        for doc in docs
+    ]
+    return plan_units(groups, [doc["tokens"] for doc in docs], batch_config["token_budget"], batch_config["max_docs"])
+
+def iter_batch_units(items: List[IngestItem], docs: Dict[int, Dict[str, Any]]) -> Iterator[List[int]]:
+    """先読み範囲（[batch_config] lookahead_docs 件）ごとに事前解析・計画し、処理単位を順に返す
+
+    解析した文書は docs にインデックスをキーとして格納する（処理済みの文書は呼び出し側で取り除く）。
+    """
+    lookahead = max(1, resolve_batch_config(get_secret_section("batch_config"))["lookahead_docs"])
+    for start in range(0, len(items), lookahead):
+        window = range(start, min(len(items), start + lookahead))
+        with st.spinner(f"バッチ計画のためにPDFを事前解析中（{window.start + 1}〜{window.stop}件目）..."):
+            for i in window:
+                docs[i] = prepare_document(items[i])
+        for unit in plan_extraction_units([docs[i] for i in window]):
+            yield [start + j for j in unit]
+
+def extract_batch_with_gemini(
+    docs: List[Dict[str, Any]],
+    fields: List[str],
+    models: Dict[str, Any],
+    status_callbacks: List[Callable[[str], None]],
+) -> List[List[Dict[str, Any]]]:
+    """同一保険会社の複数文書を1リクエストで抽出し、文書ごとの行リストを返す
+
+    応答から解析できなかった文書やローカル検証に通らない文書は、上位モデルの個別2段階抽出でやり直す。
+    """
+    tier = TIER_FAST if TIER_FAST in models else TIER_STRONG
+    model = models[tier]
+    insurer = docs[0]["insurer"]
+    doc_ids = [make_doc_id(i) for i in range(len(docs))]
+    prompt = build_batch_prompt(
+        doc_ids,
+        STEP1_PROMPT_BUILDERS[insurer](),
+        STEP2_PROMPT_BUILDERS[insurer](fields, {}),
+    )
+
+    contents = [{"text": prompt}]
+    for doc_id, doc in zip(doc_ids, docs):
+        contents.append({"text": f"<<<{doc_id} 開始>>>\nファイル名: {doc['name']}\n【Markdown Data】\n{doc['text']}"})
+        if doc["modality"] != MODALITY_TEXT:
+            contents.extend(load_page_images(doc["item"].read(), doc["name"]))
+        contents.append({"text": f"<<<{doc_id} 終了>>>"})
+
+    doc_labels = ", ".join(f"{doc_id}={doc['name']}" for doc_id, doc in zip(doc_ids, docs))
+    st.session_state["extract_messages"].append(
+        f"ℹ️ バッチ抽出: {insurer} {len(docs)}件を1リクエストで処理（{doc_labels}）"
+    )
+    for notify in status_callbacks:
+        notify("バッチ")
+
+    sections: Dict[str, List[Dict[str, Any]]] = {}
+    failed = list(doc_ids)
+    with st.spinner(f"[{insurer}] {len(docs)}件のPDFをまとめて抽出中..."):
+        started_at = time.perf_counter()
+        try:
+            response = get_gemini_caller().call(model, contents, CALL_BATCH, generation_config={"temperature": 0})
+            if not response or not response.text:
+                raise ValueError("Geminiの応答が空です。")
+            if "debug_raw_responses" not in st.session_state:
+                st.session_state["debug_raw_responses"] = []
+            st.session_state["debug_raw_responses"].append({
+                "file": f"バッチ（{doc_labels}）",
+                "raw": response.text[:3000],
+            })
+            sections, failed = split_batch_response(extract_json_from_text(response.text), doc_ids)
+        except Exception as e:
+            st.session_state["extract_messages"].append(f"⚠️ バッチ抽出エラー（個別抽出に切り替えます） - {e}")
+        # 1リクエストの所要時間を文書数で按分して記録する
+        elapsed_per_doc = (time.perf_counter() - started_at) / len(docs)
+        for _ in docs:
+            get_cascade_stats().record_attempt(tier, elapsed_per_doc)
+
+    min_filled_ratio = get_cascade_config()["min_filled_ratio"]
+    results = []
+    for doc_id, doc, notify in zip(doc_ids, docs, status_callbacks):
+        rows = [
+            normalize_extracted_record(item, fields, doc["name"], insurer)
+            for item in sections.get(doc_id, [])
+        ]
+        issues = ["バッチ応答を解析できない"] if doc_id in failed else validate_rows(
+            rows, fields, expected_plan_count(insurer), min_filled_ratio, insurer
+        )
+        get_cascade_stats().record_document(bool(issues) and tier == TIER_FAST, issues)
+        if issues:
+            # この文書だけを切り離し、上位モデルの2段階抽出で再処理する
+            st.session_state["extract_messages"].append(
+                f"⚠️ {doc['name']}: バッチ応答の検証NG（{'、'.join(issues)}）のため個別抽出します。"
+            )
+            notify(TIER_LABELS[TIER_STRONG])
+            results.append(run_extraction_tier(TIER_STRONG, doc["item"].read(), fields, doc["name"], models, notify))
+            continue
+        results.append(stamp_model(finalize_rows(rows, insurer, doc["name"]), model))
+    return results
 
 # ======================
 # AIによる提案メッセージ生成
 # ======================
 def analyze_and_generate_proposal(df: pd.DataFrame, model) -> str:
-    df_string = df.to_string(index=False)
+    df_string = strip_derived_columns(df).to_string(index=False)
     prompt = (
         "以下の保険情報比較表を詳細に分析し、顧客への提案メッセージを作成してください。\n"
         "【要件】\n"
@@ -568,20 +1019,131 @@ def analyze_and_generate_proposal(df: pd.DataFrame, model) -> str:
     )
     with st.spinner("🤖 保険情報の比較分析と提案メッセージを生成中..."):
         try:
-            response = model.generate_content(prompt)
+            response = get_gemini_caller().call(model, prompt, CALL_PROPOSAL)
             if response and response.text:
                 return response.text.strip()
             return "Geminiからの提案メッセージを取得できませんでした。"
         except Exception as e:
             return f"提案生成中にエラーが発生しました: {e}"
 
-@st.cache_data
-def to_excel_bytes(df: pd.DataFrame) -> bytes:
+def comparison_columns(fields: List[str], customer_df: pd.DataFrame) -> List[str]:
+    """比較表の列構成（顧客Excelがあればその列順、なければ抽出項目順）＋システム列"""
+    extra_cols = ["保険会社", "プラン", "プラン識別子", "ファイル名", "抽出日"]
+    if not customer_df.empty:
+        columns = strip_derived_columns(customer_df).columns.tolist()
+    else:
+        columns = fields.copy()
+    for c in extra_cols:
+        if c not in columns:
+            columns.append(c)
+    return columns
+
+def build_comparison_df(results: List[Dict[str, Any]], fields: List[str], customer_df: pd.DataFrame) -> pd.DataFrame:
+    """抽出結果（行の辞書リスト）を顧客Excelの列構成に合わせた比較表に整形"""
+    columns = comparison_columns(fields, customer_df)
+    df_extracted = pd.DataFrame(results).reindex(columns=columns)
+    if not customer_df.empty:
+        df_customer = strip_derived_columns(customer_df).reindex(columns=columns)
+        df_final = pd.concat([df_customer, df_extracted], ignore_index=True)
+    else:
+        df_final = df_extracted
+
+    # 表示用の文字列列はそのまま残し、金額・期間・建築年月の数値列を隣に付与する
+    return add_typed_columns(df_final.fillna("").astype(str))
+
+def append_comparison_rows(df: Optional[pd.DataFrame], rows: List[Dict[str, Any]], columns: List[str]) -> pd.DataFrame:
+    """比較表に抽出行を追記する（数値列の付与は追加した行のみに行う）"""
+    df_rows = add_typed_columns(pd.DataFrame(rows).reindex(columns=columns).fillna("").astype(str))
+    if df is None:
+        return df_rows
+    return pd.concat([df, df_rows], ignore_index=True)
+
+def render_extract_messages(messages: List[str]):
+    for msg in messages:
+        if msg.startswith("✅"): st.success(msg)
+        elif msg.startswith("⚠️"): st.warning(msg)
+        elif msg.startswith("❌"): st.error(msg)
+        else: st.info(msg)
+
+COMPARISON_COLUMN_CONFIG = {
+    "保険会社": st.column_config.TextColumn(
+        "保険会社",
+        pinned=True,
+    ),
+    "プラン": st.column_config.TextColumn(
+        "プラン",
+        pinned=True,
+    ),
+}
+
+def build_excel_bytes(df: pd.DataFrame) -> bytes:
+    """比較表をExcelに書き出す（抽出途中の書き出しはキャッシュしないため、こちらを直接使う）"""
     output = io.BytesIO()
     with pd.ExcelWriter(output, engine="openpyxl") as writer:
         df.to_excel(writer, index=False, sheet_name="見積情報比較表")
     return output.getvalue()
 
+@st.cache_data(max_entries=16, ttl=3600)
+def to_excel_bytes(df: pd.DataFrame) -> bytes:
+    return build_excel_bytes(df)
+
+def get_download_filename() -> str:
+    if st.session_state.get("customer_file_name"):
+        return st.session_state["customer_file_name"]
+    return "見積情報比較表_抽出結果.xlsx"
+
+# ======================
+# 抽出履歴（SQLiteに保存し、再読み込み・検索に使う）
+# ======================
+HISTORY_QUERY_LIMIT = 1000
+
+@st.cache_resource
+def get_history_store() -> Optional[HistoryStore]:
+    """抽出履歴ストア（secretsの[history_config]で保存先の変更・無効化が可能）"""
+    history_config = get_secret_section("history_config")
+    if not history_config.get("enabled", True):
+        return None
+    return HistoryStore(history_config.get("db_path") or DEFAULT_DB_PATH)
+
+def save_run_to_history(results: List[Dict[str, Any]], fields: List[str], customer_df: pd.DataFrame, source: str):
+    try:
+        store = get_history_store()
+        if store is None:
+            return
+        customer_records = customer_df.fillna("").astype(str).to_dict("records")
+        run_id = store.record_run(
+            results,
+            st.session_state.get("username") or "",
+            fields,
+            customer_records,
+            customer_file_name=st.session_state.get("customer_file_name"),
+            source=source,
+        )
+        st.session_state["extract_messages"].append(f"ℹ️ 抽出結果を履歴に保存しました（実行ID: {run_id}）")
+    except Exception as e:
+        st.session_state["extract_messages"].append(f"⚠️ 抽出履歴の保存に失敗しました: {e}")
+
+def load_run_from_history(store: HistoryStore, run_id: int):
+    """過去の実行の比較表・抽出項目・顧客Excelをセッションに復元する"""
+    loaded = store.load_run(run_id)
+    customer_df = pd.DataFrame(loaded["customer_records"])
+    st.session_state["fields"] = loaded["fields"]
+    st.session_state["customer_df"] = customer_df
+    st.session_state["customer_file_name"] = loaded["customer_file_name"]
+    st.session_state["comparison_df"] = build_comparison_df(loaded["rows"], loaded["fields"], customer_df)
+    st.session_state["proposal_message"] = ""
+    st.session_state["debug_raw_responses"] = []
+    st.session_state["extract_messages"] = [f"ℹ️ 抽出履歴（実行ID: {run_id}）の比較表を読み込みました。"]
+
+def history_records_to_df(records: List[Dict[str, Any]]) -> pd.DataFrame:
+    """検索結果を「履歴の列（抽出日・氏名など）＋抽出項目」の表に変換"""
+    if not records:
+        return pd.DataFrame(columns=list(HISTORY_COLUMN_LABELS.values()))
+    meta = pd.DataFrame(records).rename(columns=HISTORY_COLUMN_LABELS)[list(HISTORY_COLUMN_LABELS.values())]
+    body = pd.DataFrame([json.loads(r["record_json"]) for r in records])
+    body = body.drop(columns=[c for c in meta.columns if c in body.columns])
+    return pd.concat([meta, body], axis=1).fillna("")
+
 
 # ======================
 # メインUIロジック
@@ -605,7 +1167,88 @@ else:
         if st.button("ログアウト"):
             logout()
 
+        with st.expander("⚙️ キャッシュ状況", expanded=False):
+            cache_stats = get_page_cache().stats()
+            st.metric(
+                "メモリ使用量",
+                f"{cache_stats['bytes'] / 1024 / 1024:.1f} MB",
+                f"上限 {cache_stats['max_bytes'] / 1024 / 1024:.0f} MB",
+                delta_color="off",
+            )
+            st.metric("ヒット率", f"{cache_stats['hit_rate'] * 100:.1f}%")
+            st.caption(
+                f"エントリ数: {cache_stats['entries']} / ヒット: {cache_stats['hits']}"
+                f"（ディスク {cache_stats['disk_hits']}） / ミス: {cache_stats['misses']} / "
+                f"追い出し: {cache_stats['evictions']} / 期限切れ: {cache_stats['expirations']}"
+            )
+            if cache_stats["disk_entries"]:
+                st.caption(
+                    f"ディスク層: {cache_stats['disk_entries']} 件, "
+                    f"{cache_stats['disk_bytes'] / 1024 / 1024:.1f} MB"
+                )
+
+        with st.expander("🧭 モデル段階実行の統計", expanded=False):
+            cascade_summary = get_cascade_stats().summary()
+            st.metric(
+                "上位モデルへの切り替え率",
+                f"{cascade_summary['escalation_rate'] * 100:.1f}%",
+                f"{cascade_summary['escalations']} / {cascade_summary['documents']} 件",
+                delta_color="off",
+            )
+            st.dataframe(
+                pd.DataFrame([
+                    {
+                        "段階": TIER_LABELS[tier],
+                        "呼び出し数": values["calls"],
+                        "p50(秒)": round(values["p50"], 1),
+                        "p95(秒)": round(values["p95"], 1),
+                    }
+                    for tier, values in cascade_summary["tiers"].items()
+                ]),
+                hide_index=True,
+                use_container_width=True,
+            )
+            if cascade_summary["top_issues"]:
+                st.caption("検証NGの主な理由: " + " / ".join(f"{name} {count}件" for name, count in cascade_summary["top_issues"]))
+
+        with st.expander("⏱ Gemini呼び出しの統計", expanded=False):
+            call_summary = get_gemini_caller().summary()
+            st.dataframe(
+                pd.DataFrame([
+                    {
+                        "種別": CALL_TYPE_LABELS[call_type],
+                        "呼び出し数": values["calls"],
+                        "p50(秒)": round(values["p50"], 1),
+                        "p95(秒)": round(values["p95"], 1),
+                        "p99(秒)": round(values["p99"], 1),
+                        "ヘッジ": f"{values['hedge_wins']}/{values['hedged']}",
+                        "期限切れ": values["deadline"],
+                        "エラー": values["errors"],
+                        "停止中に拒否": values["rejected"],
+                    }
+                    for call_type, values in call_summary["call_types"].items()
+                ]),
+                hide_index=True,
+                use_container_width=True,
+            )
+            st.caption("ヘッジ: 追加リクエストの方が先に返った件数 / 追加リクエストを送った件数")
+            st.bar_chart(
+                pd.DataFrame(
+                    {CALL_TYPE_LABELS[t]: v["histogram"] for t, v in call_summary["call_types"].items()},
+                    index=LatencyHistogram.bucket_labels(),
+                )
+            )
+            open_breakers = [name for name, state in call_summary["breakers"].items() if state != "closed"]
+            if open_breakers:
+                st.warning(f"⚠️ 呼び出し停止中のモデル: {', '.join(open_breakers)}")
+
 if st.session_state["authentication_status"]:
+    # DataFrameの初期化はpandasの読み込みを伴うため、ログイン後に行う
+    if "customer_df" not in st.session_state:
+        st.session_state["customer_df"] = pd.DataFrame()
+    if "comparison_df" not in st.session_state:
+        st.session_state["comparison_df"] = pd.DataFrame()
+
     st.markdown("---")
     st.subheader("📄 保険自動化システム メイン機能")
 
@@ -615,7 +1258,11 @@ if st.session_state["authentication_status"]:
             st.error("❌ Secretsファイルに `GEMINI_API_KEY` が設定されていません。")
             st.stop()
         genai.configure(api_key=GEMINI_API_KEY)
-        model = genai.GenerativeModel("gemini-2.5-flash")
+        cascade_config = get_cascade_config()
+        model = genai.GenerativeModel(cascade_config["strong_model"])
+        models = {TIER_STRONG: model}
+        if cascade_config["enabled"]:
+            models[TIER_FAST] = genai.GenerativeModel(cascade_config["fast_model"])
     except KeyError:
         st.error("❌ SecretsファイルからAPIキーを読み込めませんでした。")
         st.stop()
@@ -645,6 +1292,8 @@ if st.session_state["authentication_status"]:
         try:
             df_customer = pd.read_excel(customer_file)
             df_customer.columns = [str(c) for c in df_customer.columns]
+            # 以前の抽出結果Excelを読み込んだ場合、数値化列は抽出項目に含めない
+            df_customer = strip_derived_columns(df_customer)
             st.session_state["customer_file_name"] = customer_file.name
             st.session_state["fields"] = df_customer.columns.tolist()
             st.session_state["customer_df"] = df_customer
@@ -669,88 +1318,214 @@ if st.session_state["authentication_status"]:
         st.write(", ".join(st.session_state["fields"]))
 
     st.markdown('<div class="section-header">📄 2. 見積書PDFから情報抽出</div>', unsafe_allow_html=True)
-    uploaded_pdfs = st.file_uploader(
-        "PDFファイルをアップロード（複数可）",
-        type=["pdf"],
-        accept_multiple_files=True,
-        key="pdf_uploader",
+    ingest_config = get_secret_section("ingest_config")
+    max_member_bytes = int(ingest_config.get("max_member_mb", 50)) * 1024 * 1024
+    partial_export_every = max(1, int(ingest_config.get("partial_export_every", 10)))
+    ingest_source = st.radio(
+        "取り込み元",
+        ["PDFアップロード", "ZIPアーカイブ", "GCSプレフィックス"],
+        horizontal=True,
+        key="ingest_source",
+    )
+    uploaded_pdfs, uploaded_zip, gcs_prefix = [], None, ""
+    if ingest_source == "PDFアップロード":
+        uploaded_pdfs = st.file_uploader(
+            "PDFファイルをアップロード（複数可）",
+            type=["pdf"],
+            accept_multiple_files=True,
+            key="pdf_uploader",
+        )
+        ingest_ready = bool(uploaded_pdfs)
+    elif ingest_source == "ZIPアーカイブ":
+        uploaded_zip = st.file_uploader(
+            "PDFをまとめたZIPファイルをアップロード（PDF以外のファイルはスキップします）",
+            type=["zip"],
+            key="zip_uploader",
+            help="ZIPファイル全体は処理が終わるまでサーバーのメモリ上に保持されます。",
+        )
+        st.caption("数百件規模の月末一括処理は、メモリを使わずに1件ずつ読み込むGCSプレフィックスからの取り込みをご利用ください。")
+        zip_warn_mb = int(ingest_config.get("zip_warn_mb", 100))
+        if uploaded_zip is not None and uploaded_zip.size > zip_warn_mb * 1024 * 1024:
+            st.warning(
+                f"ZIPファイルが{zip_warn_mb}MBを超えています（{uploaded_zip.size / 1024 / 1024:.0f}MB）。"
+                "GCSプレフィックスからの取り込みを推奨します。"
+            )
+        ingest_ready = uploaded_zip is not None
+    else:
+        ingest_bucket = ingest_config.get("bucket_name") or get_secret_section("gcs_config").get("bucket_name", "")
+        gcs_prefix = st.text_input(
+            f"GCSプレフィックス（バケット: {ingest_bucket or '未設定'}）",
+            placeholder="quotes/2025-10/",
+            key="gcs_prefix",
+        )
+        ingest_ready = bool(ingest_bucket and gcs_prefix)
+    batch_mode = st.checkbox(
+        "同一保険会社の見積書をまとめて抽出する（バッチモード）",
+        key="batch_mode",
+        help="1ページ完結の小さな見積書が多い場合に、複数PDFを1回のGemini呼び出しにまとめて処理時間を短縮します。",
+    )
+    st.selectbox(
+        "入力モード",
+        ["auto"] + list(INPUT_MODE_LABELS),
+        format_func=lambda mode: "自動（保険会社別の設定に従う）" if mode == "auto" else INPUT_MODE_LABELS[mode],
+        key="input_mode_override",
+        help="PDF直接送信はローカルでのMarkdown変換・画像化を省略し、PDFをそのままGeminiに渡します。",
     )
 
-    if uploaded_pdfs and st.button("PDFから情報を抽出", key="extract_button"):
-        log_user_action(f"PDF抽出開始: {len(uploaded_pdfs)}件のファイル")
+    extract_clicked = ingest_ready and st.button("PDFから情報を抽出", key="extract_button")
+    ingest_items = []
+    if extract_clicked:
         st.session_state["proposal_message"] = ""
         st.session_state["extract_messages"] = []
         st.session_state["debug_raw_responses"] = []
 
+        # 一覧（名前・サイズ）のみ取得し、PDF本体は処理の直前に1件ずつ読み込む
+        try:
+            if ingest_source == "ZIPアーカイブ":
+                item_iter = iter_zip_members(uploaded_zip, max_member_bytes)
+            elif ingest_source == "GCSプレフィックス":
+                gcs_client = get_gcs_client()
+                if gcs_client is None:
+                    raise RuntimeError("GCSクライアントが初期化されていません。")
+                item_iter = iter_gcs_pdfs(gcs_client, ingest_bucket, gcs_prefix, max_member_bytes)
+            else:
+                item_iter = iter_uploaded_files(uploaded_pdfs)
+            ingest_items, skipped_items = split_skipped(item_iter)
+        except Exception as e:
+            skipped_items = []
+            st.session_state["extract_messages"].append(f"❌ 取り込み元を開けませんでした: {e}")
+
+        for item in skipped_items:
+            st.session_state["extract_messages"].append(f"ℹ️ {item.name}: スキップ（{item.skip_reason}）")
+        if not ingest_items:
+            st.session_state["extract_messages"].append("⚠️ 処理対象のPDFがありません。")
+
+    if ingest_items:
+        log_user_action(
+            f"PDF抽出開始: {len(ingest_items)}件のファイル（{ingest_source}）" + ("（バッチモード）" if batch_mode else "")
+        )
+
         results = []
         fields = st.session_state["fields"]
+        customer_df = st.session_state["customer_df"]
         progress_bar = st.progress(0)
-        total_pdfs = len(uploaded_pdfs)
-
-        for i, pdf in enumerate(uploaded_pdfs):
+        total_pdfs = len(ingest_items)
+
+        # 1件完了するごとに進捗・処理ログ・比較表を更新する
+        file_status = [
+            {"ファイル名": item.name, "状態": "待機中", "経過秒": 0.0, "プラン数": 0}
+            for item in ingest_items
+        ]
+        status_placeholder = st.empty()
+        log_placeholder = st.empty()
+        table_placeholder = st.empty()
+        download_placeholder = st.empty()
+
+        def render_file_status():
+            status_placeholder.dataframe(pd.DataFrame(file_status), use_container_width=True, hide_index=True)
+
+        def make_status_updater(i: int, started_at: float) -> Callable[[str], None]:
+            def update_status(state: str):
+                file_status[i]["状態"] = state
+                file_status[i]["経過秒"] = round(time.perf_counter() - started_at, 1)
+                render_file_status()
+            return update_status
+
+        render_file_status()
+
+        docs: Dict[int, Dict[str, Any]] = {}
+        if batch_mode:
+            # テキスト層と保険会社を先読み範囲ごとに判定し、まとめられる文書を処理単位に束ねる
+            units = iter_batch_units(ingest_items, docs)
+        else:
+            units = ([i] for i in range(total_pdfs))
+
+        processed = 0
+        last_export = 0
+        # 比較表は顧客Excelの行から始め、処理単位ごとに新しい行だけを追記する
+        columns = comparison_columns(fields, customer_df)
+        df_partial = None if customer_df.empty else build_comparison_df([], fields, customer_df)
+        for unit in units:
+            started_at = time.perf_counter()
+            updaters = [make_status_updater(i, started_at) for i in unit]
+
+            unit_results = []
             try:
-                pdf_bytes = pdf.read()
-                rows = extract_info_with_gemini_multi_plan(pdf_bytes, fields, pdf.name, model)
-                if rows:
-                    results.extend(rows)
-                    st.session_state["extract_messages"].append(f"✅ {pdf.name} 抽出成功（{len(rows)}プラン）")
+                if len(unit) > 1:
+                    unit_rows = extract_batch_with_gemini([docs[i] for i in unit], fields, models, updaters)
+                    unit_digests = [docs[i]["digest"] for i in unit]
                 else:
-                    st.session_state["extract_messages"].append(f"⚠️ {pdf.name} は抽出に失敗したか、プランを認識できませんでした。")
+                    item = ingest_items[unit[0]]
+                    updaters[0]("読み込み中")
+                    pdf_bytes = item.read()
+                    unit_digests = [pdf_digest(pdf_bytes)]
+                    unit_rows = [extract_with_cascade(pdf_bytes, fields, item.name, models, on_status=updaters[0])]
             except Exception as e:
-                st.session_state["extract_messages"].append(f"❌ {pdf.name} 処理中に予期せぬエラー: {str(e)}")
-            progress_bar.progress((i + 1) / total_pdfs)
+                unit_rows = [None] * len(unit)
+                unit_digests = [""] * len(unit)
+                for i in unit:
+                    st.session_state["extract_messages"].append(f"❌ {ingest_items[i].name} 処理中に予期せぬエラー: {str(e)}")
+
+            for i, rows, digest, update_status in zip(unit, unit_rows, unit_digests, updaters):
+                pdf_name = ingest_items[i].name
+                if rows:
+                    for row in rows:
+                        row[ROW_FILE_HASH_KEY] = digest
+                    unit_results.extend(rows)
+                    file_status[i]["プラン数"] = len(rows)
+                    update_status("完了")
+                    st.session_state["extract_messages"].append(f"✅ {pdf_name} 抽出成功（{len(rows)}プラン）")
+                else:
+                    update_status("失敗")
+                    if rows is not None:
+                        st.session_state["extract_messages"].append(f"⚠️ {pdf_name} は抽出に失敗したか、プランを認識できませんでした。")
+            for i in unit:
+                docs.pop(i, None)
+            processed += len(unit)
+            progress_bar.progress(processed / total_pdfs)
+
+            with log_placeholder.container():
+                render_extract_messages(st.session_state["extract_messages"])
+
+            if unit_results:
+                results.extend(unit_results)
+                # 途中で再実行されても結果が残るよう、毎回セッションへ反映する
+                df_partial = append_comparison_rows(df_partial, unit_results, columns)
+                st.session_state["comparison_df"] = df_partial
+                table_placeholder.dataframe(df_partial, use_container_width=True, column_config=COMPARISON_COLUMN_CONFIG)
+                # 途中結果のExcelは [ingest_config] partial_export_every 件ごとに作り直す（キャッシュしない）
+                if processed < total_pdfs and (last_export == 0 or processed - last_export >= partial_export_every):
+                    last_export = processed
+                    download_placeholder.download_button(
+                        f"📥 途中結果をダウンロード（{processed}/{total_pdfs}件処理済み）",
+                        data=build_excel_bytes(df_partial),
+                        file_name=get_download_filename(),
+                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                        key=f"partial_download_{processed}",
+                        on_click="ignore",
+                    )
 
         progress_bar.empty()
+        log_placeholder.empty()
+        table_placeholder.empty()
+        download_placeholder.empty()
 
         if results:
-            df_extracted = pd.DataFrame(results)
-            extra_cols = ["保険会社", "プラン", "プラン識別子", "ファイル名", "抽出日"]
-
-            if not st.session_state["customer_df"].empty:
-                df_customer = st.session_state["customer_df"].copy()
-                cols_to_use = df_customer.columns.tolist()
-                for c in extra_cols:
-                    if c not in cols_to_use:
-                        cols_to_use.append(c)
-                df_customer = df_customer.reindex(columns=cols_to_use)
-                df_extracted = df_extracted.reindex(columns=cols_to_use)
-                df_final = pd.concat([df_customer, df_extracted], ignore_index=True)
-            else:
-                base_cols = st.session_state["fields"].copy()
-                for c in extra_cols:
-                    if c not in base_cols:
-                        base_cols.append(c)
-                df_final = df_extracted.reindex(columns=base_cols)
-
-            df_final = df_final.fillna("").astype(str)
-            st.session_state["comparison_df"] = df_final
             log_user_action(f"PDF抽出完了: {len(results)}件のレコードを比較表に追加")
+            save_run_to_history(results, fields, customer_df, ingest_source)
         else:
             if not st.session_state["extract_messages"]:
                 st.session_state["extract_messages"].append("PDFから情報を抽出できませんでした。処理ログを確認してください。")
 
     if st.session_state["extract_messages"]:
         with st.container():
-            for msg in st.session_state["extract_messages"]:
-                if msg.startswith("✅"): st.success(msg)
-                elif msg.startswith("⚠️"): st.warning(msg)
-                elif msg.startswith("❌"): st.error(msg)
-                else: st.info(msg)
+            render_extract_messages(st.session_state["extract_messages"])
 
     if not st.session_state["comparison_df"].empty:
         st.dataframe(
             st.session_state["comparison_df"],
             use_container_width=True,
-            column_config={
-                "保険会社": st.column_config.TextColumn(
-                    "保険会社",
-                    pinned=True,
-                ),
-                "プラン": st.column_config.TextColumn(
-                    "プラン",
-                    pinned=True,
-                ),
-            },
+            column_config=COMPARISON_COLUMN_CONFIG,
         )
     if st.session_state.get("debug_raw_responses"):
         with st.expander("🔍 Gemini生レスポンス（デバッグ用）", expanded=False):
@@ -761,9 +1536,7 @@ if st.session_state["authentication_status"]:
     st.markdown('<div class="section-header">📊 3. 抽出結果をダウンロード</div>', unsafe_allow_html=True)
     if not st.session_state["comparison_df"].empty:
         excel_data = to_excel_bytes(st.session_state["comparison_df"])
-        download_filename = "見積情報比較表_抽出結果.xlsx"
-        if st.session_state.get("customer_file_name"):
-            download_filename = st.session_state["customer_file_name"]
+        download_filename = get_download_filename()
 
         if st.download_button(
             "📥 Excelでダウンロード",
@@ -777,6 +1550,17 @@ if st.session_state["authentication_status"]:
 
     st.markdown('<div class="section-header">💬 4. 比較分析と提案メッセージの作成</div>', unsafe_allow_html=True)
     if not st.session_state["comparison_df"].empty:
+        with st.expander("📈 プラン比較（年換算保険料・補償項目ごとの最安プラン）", expanded=False):
+            ranked_df = rank_plans(st.session_state["comparison_df"])
+            mask = cheapest_mask(ranked_df)
+            highlight = mask.where(~mask, "background-color: #d4edda").where(mask, "")
+            st.dataframe(
+                ranked_df.style.apply(lambda _: highlight, axis=None),
+                use_container_width=True,
+                column_config=COMPARISON_COLUMN_CONFIG,
+            )
+            st.caption("緑色のセル: 顧客（氏名）ごとに、その補償項目を含むプランの中で年換算保険料が最も安いプラン")
+
         if st.button("提案メッセージを作成・表示", key="analyze_button"):
             log_user_action("提案メッセージ生成開始")
             proposal = analyze_and_generate_proposal(st.session_state["comparison_df"], model)
@@ -793,5 +1577,63 @@ if st.session_state["authentication_status"]:
     else:
         st.info("比較分析を行うには、先にPDFから情報を抽出してください。")
 
+    st.markdown('<div class="section-header">🗂 5. 抽出履歴</div>', unsafe_allow_html=True)
+    try:
+        history_store = get_history_store()
+    except Exception as e:
+        history_store = None
+        st.warning(f"⚠️ 抽出履歴を開けませんでした: {e}")
+    if history_store is not None:
+        with st.expander("📂 過去の比較表を読み込む", expanded=False):
+            past_runs = history_store.list_runs(limit=50)
+            if past_runs:
+                run_labels = {
+                    r["id"]: f"#{r['id']} {r['created_at']} {r['user']}（{r['row_count']}プラン"
+                    + (f"・{r['customer_file_name']}" if r["customer_file_name"] else "") + "）"
+                    for r in past_runs
+                }
+                selected_run = st.selectbox("実行", list(run_labels), format_func=run_labels.get, key="history_run")
+                if st.button("この比較表を読み込む", key="history_load_button"):
+                    load_run_from_history(history_store, selected_run)
+                    log_user_action(f"抽出履歴の読み込み: 実行ID {selected_run}")
+                    st.rerun()
+            else:
+                st.info("保存された抽出履歴はまだありません。")
+
+        with st.expander("🔎 抽出履歴を検索", expanded=False):
+            # 入力のたびに再検索しないよう、フォームで検索ボタンを押したときだけ実行する
+            with st.form("history_search_form"):
+                col_customer, col_insurer, col_date = st.columns([2, 2, 3])
+                with col_customer:
+                    history_customer = st.text_input("氏名（前方一致）", key="history_customer")
+                with col_insurer:
+                    history_insurer = st.selectbox("保険会社", [""] + list(STEP2_PROMPT_BUILDERS), key="history_insurer")
+                with col_date:
+                    history_dates = st.date_input("抽出日", value=(), key="history_dates")
+                history_search_clicked = st.form_submit_button("検索")
+            if history_search_clicked:
+                date_from = history_dates[0].strftime("%Y-%m-%d") if len(history_dates) >= 1 else ""
+                date_to = history_dates[-1].strftime("%Y-%m-%d") if len(history_dates) >= 1 else ""
+                st.session_state["history_results"] = history_store.query_rows(
+                    customer_prefix=history_customer.strip(),
+                    insurer=history_insurer,
+                    date_from=date_from,
+                    date_to=date_to,
+                    limit=HISTORY_QUERY_LIMIT,
+                )
+            if "history_results" in st.session_state:
+                records = st.session_state["history_results"]
+                st.caption(f"{len(records)}件" + ("（新しい順に上限まで表示）" if len(records) >= HISTORY_QUERY_LIMIT else ""))
+                st.dataframe(history_records_to_df(records), use_container_width=True, hide_index=True)
+
     st.markdown("---")
-    st.markdown("**保険業務自動化アシスタント** | Streamlit + Gemini 2.5 Flash")
\ No newline at end of file
+    st.markdown("**保険業務自動化アシスタント** | Streamlit + Gemini 2.5 Flash")
+
+# ======================
+# バックグラウンド初期化（画面描画後に開始）
+# ======================
+background_init = start_background_init()
+if background_init["gcs"].done():
+    _, gcs_error = background_init["gcs"].result()
+    if gcs_error:
+        st.sidebar.error(gcs_error)
@@ -0,0 +1,103 @@
+from typing import Any, Dict, List, Tuple
+
+from pipeline.config import resolve_config
+
+# ======================
+# 複数文書の1リクエスト化（バッチ抽出）
+# ======================
+# 1ページ完結の小さな見積書ごとに2〜3回APIを呼ぶと、リクエスト単位のオーバーヘッドが支配的になる。
+# 同一保険会社の文書をトークン予算の範囲で1リクエストにまとめ、応答を文書IDごとに分割する。
+
+DEFAULT_BATCH_CONFIG = {
+    # 1リクエストあたりの入力トークン予算（プロンプト本体を含む）
+    "token_budget": 30000,
+    "max_docs": 8,
+    # バッチ計画のために先に解析する文書数（全件を先に解析すると最初の結果が遅れる）
+    "lookahead_docs": 16,
+}
+
+PROMPT_TOKEN_ESTIMATE = 3000
+# 220dpiのA4ページ1枚あたりの概算（258トークン/タイル × 約10タイル）
+IMAGE_TOKEN_ESTIMATE = 2580
+
+
+def resolve_batch_config(overrides: Dict[str, Any] = None) -> Dict[str, int]:
+    return resolve_config(DEFAULT_BATCH_CONFIG, overrides)
+
+
+def estimate_tokens(text: str, image_count: int = 0) -> int:
+    """日本語は概ね1文字1トークン、ASCIIは4文字1トークンとして概算"""
+    text = text or ""
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (len(text) - ascii_chars) + ascii_chars // 4 + image_count * IMAGE_TOKEN_ESTIMATE
+
+
+def make_doc_id(index: int) -> str:
+    return f"DOC{index + 1}"
+
+
+def pack_documents(token_counts: List[int], token_budget: int, max_docs: int) -> List[List[int]]:
+    """文書の順序を保ったまま、予算内に収まるようにインデックスをまとめる"""
+    batches: List[List[int]] = []
+    current: List[int] = []
+    current_tokens = PROMPT_TOKEN_ESTIMATE
+    for i, tokens in enumerate(token_counts):
+        if current and (current_tokens + tokens > token_budget or len(current) >= max_docs):
+            batches.append(current)
+            current, current_tokens = [], PROMPT_TOKEN_ESTIMATE
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def split_batch_response(parsed: Any, doc_ids: List[str]) -> Tuple[Dict[str, List[Dict[str, Any]]], List[str]]:
+    """文書IDをキーとする応答を分割し、解析できなかった文書IDを別途返す"""
+    if isinstance(parsed, list):
+        # {"文書ID": "DOC1", "プラン": [...]} 形式の配列で返ってきた場合も受け付ける
+        keyed = {}
+        for item in parsed:
+            if isinstance(item, dict):
+                key = item.get("文書ID") or item.get("doc_id")
+                plans = item.get("プラン一覧") or item.get("plans")
+                if key and plans is not None:
+                    keyed[str(key)] = plans
+        parsed = keyed
+    if not isinstance(parsed, dict):
+        return {}, list(doc_ids)
+
+    results: Dict[str, List[Dict[str, Any]]] = {}
+    failed: List[str] = []
+    for doc_id in doc_ids:
+        section = parsed.get(doc_id)
+        if isinstance(section, dict):
+            section = [section]
+        if not isinstance(section, list):
+            failed.append(doc_id)
+            continue
+        rows = [item for item in section if isinstance(item, dict)]
+        if not rows:
+            failed.append(doc_id)
+            continue
+        results[doc_id] = rows
+    return results, failed
+
+
+def plan_units(groups: List[str], token_counts: List[int], token_budget: int, max_docs: int) -> List[List[int]]:
+    """処理単位（文書インデックスのリスト）を作る
+
+    groups が空文字の文書は単独処理、それ以外は同じグループ内で pack_documents によりまとめる。
+    単位は各単位の先頭文書の順に並べる。
+    """
+    units: List[List[int]] = []
+    members: Dict[str, List[int]] = {}
+    for i, group in enumerate(groups):
+        if group:
+            members.setdefault(group, []).append(i)
+        else:
+            units.append([i])
+    for indices in members.values():
+        for packed in pack_documents([token_counts[i] for i in indices], token_budget, max_docs):
+            units.append([indices[j] for j in packed])
+    return sorted(units, key=lambda unit: unit[0])
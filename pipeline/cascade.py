@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import re
+import threading
+from collections import Counter, deque
+from typing import Any, Dict, List, Optional
+
+from pipeline.config import resolve_config
+from pipeline.lazy import lazy_import
+from pipeline.numeric import COVERAGE_COLUMNS, MONEY_COLUMNS, parse_money
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+# ======================
+# モデル段階実行（軽量モデル → 検証NGのみ上位モデル）
+# ======================
+# 大半の見積書は軽量モデルで十分に抽出できるため、まず軽量モデルで実行し、
+# ローカル検証に通らなかった文書だけを上位モデルで再抽出する。
+
+TIER_FAST = "fast"
+TIER_STRONG = "strong"
+
+TIER_LABELS = {
+    TIER_FAST: "軽量モデル",
+    TIER_STRONG: "上位モデル",
+}
+
+DEFAULT_CASCADE_CONFIG = {
+    "enabled": True,
+    "fast_model": "gemini-2.5-flash-lite",
+    "strong_model": "gemini-2.5-flash",
+    # 抽出対象項目のうち、値が入っているべき割合の下限
+    "min_filled_ratio": 0.5,
+}
+
+REQUIRED_FIELDS = ["保険会社", "プラン", "保険料"]
+# 入力の有無を判定する対象から除く項目（システムが付与する値）
+SYSTEM_FIELDS = ["抽出日", "ファイル名", "プラン識別子"]
+# 補償項目に〇/×等の記号を出力しないよう指示している保険会社別プロンプト
+# （保険会社不明時の汎用プロンプトは補償の有無を『〇』または空欄で出力させるため対象外）
+SYMBOL_FREE_INSURERS = ["東京海上日動", "損保ジャパン", "三井住友海上"]
+
+_SYMBOL_PATTERN = re.compile(r"^(?:[〇○◯●×✕xX]|あり|なし|補償されません)$")
+
+
+def resolve_cascade_config(overrides: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    return resolve_config(DEFAULT_CASCADE_CONFIG, overrides)
+
+
+def validate_rows(
+    rows: List[Dict[str, Any]],
+    fields: List[str],
+    expected_count: int,
+    min_filled_ratio: float = DEFAULT_CASCADE_CONFIG["min_filled_ratio"],
+    insurer: str = "",
+) -> List[str]:
+    """抽出結果をローカルで検証し、問題点の一覧を返す（空なら合格）"""
+    if not rows:
+        return ["プランが抽出されていません"]
+
+    issues = []
+    if len(rows) < expected_count:
+        issues.append(f"プラン数不足（{len(rows)}/{expected_count}）")
+
+    df = pd.DataFrame(rows).fillna("").astype(str).apply(lambda col: col.str.strip())
+
+    # 保険料は抽出対象に含まれる場合のみ必須とする（normalize_extracted_record は対象項目しか出力しない）
+    required = set(fields) | {"保険会社", "プラン"}
+    for field in [f for f in REQUIRED_FIELDS if f in required]:
+        if field not in df.columns or df[field].eq("").any():
+            issues.append(f"必須項目が空: {field}")
+
+    target_fields = [f for f in fields if f not in SYSTEM_FIELDS]
+    if target_fields:
+        present = df.reindex(columns=target_fields, fill_value="")
+        filled_ratio = float(present.ne("").to_numpy().mean())
+        if filled_ratio < min_filled_ratio:
+            issues.append(f"入力済み項目が少ない（{filled_ratio:.0%}）")
+
+    coverage_cols = [c for c in COVERAGE_COLUMNS if c in df.columns]
+    if coverage_cols and insurer in SYMBOL_FREE_INSURERS:
+        symbols = df[coverage_cols].apply(lambda col: col.str.match(_SYMBOL_PATTERN))
+        bad = [c for c in coverage_cols if symbols[c].any()]
+        if bad:
+            issues.append(f"免責金額に〇/×等の記号: {'、'.join(bad)}")
+
+    for col in [c for c in MONEY_COLUMNS + coverage_cols if c in df.columns]:
+        values = df[col]
+        unparsed = values.ne("") & parse_money(values).isna() & ~values.str.match(_SYMBOL_PATTERN)
+        if unparsed.any():
+            issues.append(f"金額を解析できない: {col}")
+
+    return issues
+
+
+class CascadeStats:
+    """段階ごとの処理時間と上位モデルへの切り替え率を記録する"""
+
+    def __init__(self, window: int = 500):
+        self._lock = threading.Lock()
+        self._latencies = {TIER_FAST: deque(maxlen=window), TIER_STRONG: deque(maxlen=window)}
+        self._calls = Counter()
+        self._escalations = 0
+        self._documents = 0
+        self._issues = Counter()
+
+    def record_attempt(self, tier: str, seconds: float) -> None:
+        with self._lock:
+            self._latencies[tier].append(seconds)
+            self._calls[tier] += 1
+
+    def record_document(self, escalated: bool, issues: List[str]) -> None:
+        with self._lock:
+            self._documents += 1
+            if escalated:
+                self._escalations += 1
+            for issue in issues:
+                # 「プラン数不足（1/3）」などの詳細を落として集計する
+                self._issues[re.split(r"[（:]", issue)[0]] += 1
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            tiers = {}
+            for tier, values in self._latencies.items():
+                arr = np.array(values, dtype=float)
+                tiers[tier] = {
+                    "calls": self._calls[tier],
+                    "p50": float(np.percentile(arr, 50)) if arr.size else 0.0,
+                    "p95": float(np.percentile(arr, 95)) if arr.size else 0.0,
+                }
+            return {
+                "documents": self._documents,
+                "escalations": self._escalations,
+                "escalation_rate": self._escalations / self._documents if self._documents else 0.0,
+                "tiers": tiers,
+                "top_issues": self._issues.most_common(5),
+            }
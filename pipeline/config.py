@@ -0,0 +1,20 @@
+from typing import Any, Dict, Optional
+
+# ======================
+# secrets.toml の設定セクションの解決
+# ======================
+# 各機能は既定値の辞書を持ち、secretsの同名セクションで一部の値だけを上書きする。
+# secretsの値は文字列で書かれることもあるため、既定値の型に合わせて変換する。
+
+
+def resolve_config(defaults: Dict[str, Any], overrides: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """既定値に上書き値を重ねる（既定値にないキーは無視し、値は既定値の型に変換する）"""
+    config = dict(defaults)
+    for k, v in (overrides or {}).items():
+        if k not in config:
+            continue
+        if isinstance(defaults[k], bool):
+            config[k] = v if isinstance(v, bool) else str(v).lower() in ("1", "true", "yes")
+        else:
+            config[k] = type(defaults[k])(v)
+    return config
@@ -0,0 +1,298 @@
+import math
+import time
+import bisect
+import threading
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Tuple
+
+from pipeline.config import resolve_config
+
+# ======================
+# Gemini呼び出しラッパー（期限・ヘッジ・サーキットブレーカー・処理時間の記録）
+# ======================
+# generate_content は応答が返るまでブロックするため、1件の遅い応答がファイル全体
+# （逐次処理ではバッチ全体）を止めてしまう。呼び出しを以下の仕組みで包む。
+#   ・呼び出しごとの期限（超えたら GeminiDeadlineExceeded）
+#   ・呼び出し種別ごとのp95を過ぎても応答がなければ同じリクエストをもう1本送り、先に返った方を使う
+#   ・障害が連続したらしばらく呼び出しを止める（CircuitOpenError）
+#   ・呼び出し種別ごとの処理時間ヒストグラム
+#
+#   [gemini_call_config]
+#   deadline_seconds = 90
+#   hedge_enabled = true
+
+CALL_STEP1 = "step1"
+CALL_STEP2 = "step2"
+CALL_RETRY = "retry"
+CALL_BATCH = "batch"
+CALL_PROPOSAL = "proposal"
+
+CALL_TYPE_LABELS = {
+    CALL_STEP1: "ステップ1",
+    CALL_STEP2: "ステップ2",
+    CALL_RETRY: "リトライ",
+    CALL_BATCH: "バッチ",
+    CALL_PROPOSAL: "提案メッセージ",
+}
+
+DEFAULT_CALL_CONFIG = {
+    "deadline_seconds": 90.0,
+    # 複数文書をまとめて送るバッチ抽出は応答が長いため、期限を別に設ける
+    "batch_deadline_seconds": 240.0,
+    "hedge_enabled": True,
+    "hedge_quantile": 0.95,
+    # 記録が少ないうちはp95が不安定なため、この件数まで既定の待ち時間を使う
+    "hedge_min_samples": 20,
+    "hedge_default_delay": 30.0,
+    "hedge_min_delay": 2.0,
+    "breaker_failure_threshold": 5,
+    "breaker_reset_seconds": 30.0,
+    "max_workers": 32,
+}
+
+# ヒストグラムの区切り（秒）
+HISTOGRAM_BOUNDS = [1, 2, 4, 8, 15, 30, 60, 120]
+
+
+class GeminiCallError(Exception):
+    """Gemini呼び出しラッパーが送出する例外の基底クラス"""
+
+
+class GeminiDeadlineExceeded(GeminiCallError):
+    def __init__(self, call_type: str, seconds: float):
+        super().__init__(f"{CALL_TYPE_LABELS.get(call_type, call_type)}の応答が期限（{seconds:.0f}秒）内に返りませんでした。")
+        self.call_type = call_type
+        self.seconds = seconds
+
+
+class CircuitOpenError(GeminiCallError):
+    def __init__(self, model_name: str, retry_after: float):
+        super().__init__(
+            f"Gemini API（{model_name}）の障害を検知したため、呼び出しを停止しています（約{math.ceil(retry_after)}秒後に再開）。"
+        )
+        self.model_name = model_name
+        self.retry_after = retry_after
+
+
+def resolve_call_config(overrides: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    return resolve_config(DEFAULT_CALL_CONFIG, overrides)
+
+
+def is_outage_error(exc: BaseException) -> bool:
+    """API側の障害・過負荷とみなす例外か（入力不正・認証エラーではブレーカーを開かない）"""
+    if isinstance(exc, (GeminiDeadlineExceeded, TimeoutError, ConnectionError)):
+        return True
+    try:
+        from google.api_core import exceptions as api_exceptions
+    except ImportError:
+        return False
+    return isinstance(
+        exc,
+        (api_exceptions.ServerError, api_exceptions.TooManyRequests, api_exceptions.DeadlineExceeded),
+    )
+
+
+class LatencyHistogram:
+    """処理時間の度数分布と、分位点計算用の直近の記録"""
+
+    def __init__(self, window: int = 500):
+        self.counts = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+        self.recent = deque(maxlen=window)
+
+    def record(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(HISTOGRAM_BOUNDS, seconds)] += 1
+        self.recent.append(seconds)
+
+    def quantile(self, q: float) -> float:
+        if not self.recent:
+            return 0.0
+        values = sorted(self.recent)
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    @staticmethod
+    def bucket_labels() -> List[str]:
+        labels = [f"〜{b}秒" for b in HISTOGRAM_BOUNDS]
+        return labels + [f"{HISTOGRAM_BOUNDS[-1]}秒〜"]
+
+
+class CircuitBreaker:
+    """連続失敗で開き、一定時間後に1件だけ試行を通して回復を確認する"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+
+    def allow(self) -> Optional[float]:
+        """呼び出してよければ None、止める場合は再開までの秒数を返す（ロックは呼び出し側で取る）"""
+        if self.state == self.CLOSED:
+            return None
+        elapsed = time.monotonic() - self._opened_at
+        if self.state == self.OPEN and elapsed >= self.reset_seconds:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            if not self._trial_in_flight:
+                self._trial_in_flight = True
+                return None
+            # 試行の結果が出るまでは、次の再開時刻までの間隔を目安として返す
+            return self.reset_seconds
+        return self.reset_seconds - elapsed
+
+    def record_success(self) -> None:
+        self.state = self.CLOSED
+        self._failures = 0
+        self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        self._trial_in_flight = False
+        if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+
+
+class GeminiCaller:
+    """全セッションで共有する呼び出しラッパー（スレッドセーフ）"""
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        self.config = resolve_call_config(config)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=self.config["max_workers"], thread_name_prefix="gemini-call")
+        self._histograms = {call_type: LatencyHistogram() for call_type in CALL_TYPE_LABELS}
+        # ヘッジの待ち時間はモデルごとに求める（軽量モデルと上位モデルで応答時間が大きく異なるため）
+        self._hedge_histograms: Dict[Tuple[str, str], LatencyHistogram] = {}
+        self._counters = {call_type: Counter() for call_type in CALL_TYPE_LABELS}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def _breaker(self, model_name: str) -> CircuitBreaker:
+        if model_name not in self._breakers:
+            self._breakers[model_name] = CircuitBreaker(
+                self.config["breaker_failure_threshold"], self.config["breaker_reset_seconds"]
+            )
+        return self._breakers[model_name]
+
+    def hedge_delay(self, model_name: str, call_type: str) -> float:
+        with self._lock:
+            histogram = self._hedge_histograms.get((model_name, call_type))
+            if histogram is None or len(histogram.recent) < self.config["hedge_min_samples"]:
+                return self.config["hedge_default_delay"]
+            return max(self.config["hedge_min_delay"], histogram.quantile(self.config["hedge_quantile"]))
+
+    def deadline_for(self, call_type: str) -> float:
+        if call_type == CALL_BATCH:
+            return self.config["batch_deadline_seconds"]
+        return self.config["deadline_seconds"]
+
+    def call(self, model, contents: Any, call_type: str, **kwargs) -> Any:
+        """model.generate_content を期限・ヘッジ付きで呼び出し、最初に成功した応答を返す"""
+        model_name = str(getattr(model, "model_name", "")).removeprefix("models/")
+        with self._lock:
+            retry_after = self._breaker(model_name).allow()
+            if retry_after is not None:
+                self._counters[call_type]["rejected"] += 1
+        if retry_after is not None:
+            raise CircuitOpenError(model_name, retry_after)
+
+        deadline_seconds = self.deadline_for(call_type)
+        hedge_delay = self.hedge_delay(model_name, call_type) if self.config["hedge_enabled"] else None
+        kwargs.setdefault("request_options", {"timeout": deadline_seconds})
+
+        started_at = time.monotonic()
+        deadline = started_at + deadline_seconds
+        futures = [self._executor.submit(model.generate_content, contents, **kwargs)]
+        hedge_future = None
+        last_error: Optional[BaseException] = None
+
+        while futures:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            wait_until = deadline
+            if hedge_future is None and hedge_delay is not None:
+                wait_until = min(deadline, started_at + hedge_delay)
+            done, _ = wait(futures, timeout=max(0.0, wait_until - now), return_when=FIRST_COMPLETED)
+            for future in done:
+                futures.remove(future)
+                error = future.exception()
+                if error is None:
+                    for pending in futures:
+                        pending.cancel()
+                    elapsed = time.monotonic() - started_at
+                    self._record(model_name, call_type, elapsed, None, hedge_future is not None, future is hedge_future)
+                    return future.result()
+                last_error = error
+            if (
+                futures
+                and hedge_future is None
+                and hedge_delay is not None
+                and time.monotonic() >= started_at + hedge_delay
+                and time.monotonic() < deadline
+            ):
+                hedge_future = self._executor.submit(model.generate_content, contents, **kwargs)
+                futures.append(hedge_future)
+
+        if futures or last_error is None:
+            # 期限切れ: 実行中のリクエストは request_options のタイムアウトで打ち切られる
+            for pending in futures:
+                pending.cancel()
+            last_error = GeminiDeadlineExceeded(call_type, deadline_seconds)
+        self._record(model_name, call_type, time.monotonic() - started_at, last_error, hedge_future is not None, False)
+        raise last_error
+
+    def _record(
+        self,
+        model_name: str,
+        call_type: str,
+        seconds: float,
+        error: Optional[BaseException],
+        hedged: bool,
+        hedge_won: bool,
+    ) -> None:
+        with self._lock:
+            counters = self._counters[call_type]
+            counters["calls"] += 1
+            if hedged:
+                counters["hedged"] += 1
+            if hedge_won:
+                counters["hedge_wins"] += 1
+            breaker = self._breaker(model_name)
+            if error is None:
+                self._histograms[call_type].record(seconds)
+                self._hedge_histograms.setdefault((model_name, call_type), LatencyHistogram()).record(seconds)
+                breaker.record_success()
+                return
+            counters["deadline" if isinstance(error, GeminiDeadlineExceeded) else "errors"] += 1
+            if is_outage_error(error):
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            call_types = {}
+            for call_type, histogram in self._histograms.items():
+                counters = self._counters[call_type]
+                call_types[call_type] = {
+                    "calls": counters["calls"],
+                    "p50": histogram.quantile(0.5),
+                    "p95": histogram.quantile(0.95),
+                    "p99": histogram.quantile(0.99),
+                    "hedged": counters["hedged"],
+                    "hedge_wins": counters["hedge_wins"],
+                    "deadline": counters["deadline"],
+                    "errors": counters["errors"],
+                    "rejected": counters["rejected"],
+                    "histogram": list(histogram.counts),
+                }
+            return {
+                "call_types": call_types,
+                "breakers": {name: breaker.state for name, breaker in self._breakers.items()},
+            }
@@ -0,0 +1,223 @@
+import os
+import json
+import sqlite3
+import datetime
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# ======================
+# 抽出履歴ストア（SQLite）
+# ======================
+# 比較表はセッションにしか残らないため、抽出した行を実行単位でSQLiteに保存し、
+# 再読み込み・過去の見積の検索に使う。行ごとに氏名・保険会社・抽出日などを列として持ち、
+# 行全体は record_json に保存する（抽出項目は顧客Excelごとに異なるため）。
+#
+#   [history_config]
+#   enabled = true
+#   db_path = "extraction_history.db"
+
+DEFAULT_DB_PATH = "extraction_history.db"
+JST = datetime.timezone(datetime.timedelta(hours=+9), "JST")
+
+# 抽出行に付与する内部キー（比較表の列には含まれない）
+ROW_MODEL_KEY = "_model"
+ROW_FILE_HASH_KEY = "_file_hash"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TEXT NOT NULL,
+    user TEXT NOT NULL,
+    source TEXT NOT NULL DEFAULT '',
+    row_count INTEGER NOT NULL,
+    fields_json TEXT NOT NULL,
+    customer_json TEXT NOT NULL,
+    customer_file_name TEXT
+);
+CREATE TABLE IF NOT EXISTS extraction_rows (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    file_hash TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    insurer TEXT NOT NULL,
+    plan TEXT NOT NULL,
+    customer TEXT NOT NULL,
+    extracted_on TEXT NOT NULL,
+    user TEXT NOT NULL,
+    model TEXT NOT NULL,
+    record_json TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_rows_customer ON extraction_rows(customer, extracted_on);
+CREATE INDEX IF NOT EXISTS idx_rows_insurer ON extraction_rows(insurer, extracted_on);
+CREATE INDEX IF NOT EXISTS idx_rows_insurer_customer ON extraction_rows(insurer, customer, extracted_on);
+CREATE INDEX IF NOT EXISTS idx_rows_extracted_on ON extraction_rows(extracted_on);
+CREATE INDEX IF NOT EXISTS idx_rows_file_hash ON extraction_rows(file_hash);
+CREATE INDEX IF NOT EXISTS idx_rows_run ON extraction_rows(run_id);
+"""
+
+# 検索結果の表示用の列名
+HISTORY_COLUMN_LABELS = {
+    "extracted_on": "抽出日",
+    "customer": "氏名",
+    "insurer": "保険会社",
+    "plan": "プラン",
+    "file_name": "ファイル名",
+    "model": "抽出モデル",
+    "user": "ユーザー",
+    "run_id": "実行ID",
+}
+
+_ROW_COLUMNS = ["run_id", "file_hash", "file_name", "insurer", "plan", "customer", "extracted_on", "user", "model"]
+
+
+def public_record(row: Dict[str, Any]) -> Dict[str, Any]:
+    """内部キー（_で始まるキー）を除いた行"""
+    return {k: v for k, v in row.items() if not str(k).startswith("_")}
+
+
+class HistoryStore:
+    """抽出履歴の保存・検索。接続は呼び出しごとに開くため、複数セッションから同時に使える"""
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH):
+        self.db_path = db_path
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, exist_ok=True)
+        self._write_lock = threading.Lock()
+        with self._connect() as conn:
+            # WALにすると、書き込み中も他セッションの検索がブロックされない
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA synchronous=NORMAL")
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def record_run(
+        self,
+        rows: List[Dict[str, Any]],
+        user: str,
+        fields: List[str],
+        customer_records: Optional[List[Dict[str, Any]]] = None,
+        customer_file_name: Optional[str] = None,
+        source: str = "",
+    ) -> int:
+        """1回の抽出結果を保存し、実行IDを返す"""
+        created_at = datetime.datetime.now(JST).strftime("%Y-%m-%d %H:%M:%S")
+        with self._write_lock, self._connect() as conn:
+            cur = conn.execute(
+                "INSERT INTO runs (created_at, user, source, row_count, fields_json, customer_json, customer_file_name) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    created_at,
+                    user,
+                    source,
+                    len(rows),
+                    json.dumps(fields, ensure_ascii=False),
+                    json.dumps(customer_records or [], ensure_ascii=False),
+                    customer_file_name,
+                ),
+            )
+            run_id = cur.lastrowid
+            conn.executemany(
+                f"INSERT INTO extraction_rows ({', '.join(_ROW_COLUMNS)}, record_json) VALUES ({', '.join('?' * (len(_ROW_COLUMNS) + 1))})",
+                [
+                    (
+                        run_id,
+                        str(row.get(ROW_FILE_HASH_KEY, "")),
+                        str(row.get("ファイル名", "")),
+                        str(row.get("保険会社", "")),
+                        str(row.get("プラン", "")),
+                        str(row.get("氏名", "")),
+                        str(row.get("抽出日", "")),
+                        user,
+                        str(row.get(ROW_MODEL_KEY, "")),
+                        json.dumps(public_record(row), ensure_ascii=False),
+                    )
+                    for row in rows
+                ],
+            )
+        return run_id
+
+    def list_runs(self, limit: int = 50) -> List[Dict[str, Any]]:
+        with self._connect() as conn:
+            cur = conn.execute(
+                "SELECT id, created_at, user, source, row_count, customer_file_name FROM runs ORDER BY id DESC LIMIT ?",
+                (limit,),
+            )
+            return [dict(r) for r in cur.fetchall()]
+
+    def load_run(self, run_id: int) -> Dict[str, Any]:
+        """実行IDの抽出行・抽出項目・顧客Excelの行を返す（存在しない場合は KeyError）"""
+        with self._connect() as conn:
+            run = conn.execute("SELECT * FROM runs WHERE id = ?", (run_id,)).fetchone()
+            if run is None:
+                raise KeyError(run_id)
+            cur = conn.execute("SELECT record_json FROM extraction_rows WHERE run_id = ? ORDER BY id", (run_id,))
+            rows = [json.loads(r["record_json"]) for r in cur.fetchall()]
+        return {
+            "run": dict(run),
+            "customer_file_name": run["customer_file_name"],
+            "fields": json.loads(run["fields_json"]),
+            "customer_records": json.loads(run["customer_json"]),
+            "rows": rows,
+        }
+
+    def query_rows(
+        self,
+        customer_prefix: str = "",
+        insurer: str = "",
+        date_from: str = "",
+        date_to: str = "",
+        limit: int = 1000,
+    ) -> List[Dict[str, Any]]:
+        """氏名（前方一致）・保険会社・抽出日の範囲で履歴を検索し、新しい順に返す"""
+        sql, params = self._rows_query(customer_prefix, insurer, date_from, date_to, limit)
+        with self._connect() as conn:
+            cur = conn.execute(sql, params)
+            return [dict(r) for r in cur.fetchall()]
+
+    def explain_query_rows(self, **filters) -> List[str]:
+        """query_rows と同じ条件での実行計画（EXPLAIN QUERY PLAN の detail 列）"""
+        sql, params = self._rows_query(**filters)
+        with self._connect() as conn:
+            return [r["detail"] for r in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()]
+
+    def _rows_query(
+        self,
+        customer_prefix: str = "",
+        insurer: str = "",
+        date_from: str = "",
+        date_to: str = "",
+        limit: int = 1000,
+    ) -> Tuple[str, List[Any]]:
+        """検索SQLとパラメータ
+
+        前方一致は LIKE ではなく範囲条件で表し、氏名（保険会社の指定があれば保険会社＋氏名）のインデックスを使わせる。
+        """
+        clauses, params = [], []
+        if customer_prefix:
+            clauses.append("customer >= ? AND customer < ?")
+            params += [customer_prefix, customer_prefix + "\U0010ffff"]
+        if insurer:
+            clauses.append("insurer = ?")
+            params.append(insurer)
+        if date_from:
+            clauses.append("extracted_on >= ?")
+            params.append(date_from)
+        if date_to:
+            clauses.append("extracted_on <= ?")
+            params.append(date_to)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        sql = (
+            f"SELECT {', '.join(_ROW_COLUMNS)}, record_json FROM extraction_rows {where} "
+            "ORDER BY extracted_on DESC, id DESC LIMIT ?"
+        )
+        return sql, params + [limit]
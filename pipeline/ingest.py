@@ -0,0 +1,188 @@
+import io
+import os
+import zipfile
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+
+# ======================
+# 一括取り込み（ZIPアーカイブ・GCSプレフィックス）
+# ======================
+# 月末の一括処理では数百件のPDFを扱うため、全ファイルをメモリに展開しない。
+# 一覧（名前・サイズ）だけを先に取得し、中身は抽出処理の直前に1件ずつ読み込む。
+# ただしZIPアーカイブは st.file_uploader 経由のため、アーカイブ全体がStreamlitのメモリ上に残る
+# （一時ファイルへ書き出しても元のアップロードは解放されない）。大量の一括処理はGCSプレフィックスを使う。
+
+DEFAULT_MAX_MEMBER_BYTES = 50 * 1024 * 1024
+_READ_CHUNK = 1024 * 1024
+
+
+class IngestItem:
+    """取り込み対象1件。read() を呼ぶまで中身は読み込まない"""
+
+    def __init__(self, name: str, size: int, loader: Callable[[], bytes], skip_reason: Optional[str] = None):
+        self.name = name
+        self.size = size
+        self.skip_reason = skip_reason
+        self._loader = loader
+
+    def read(self) -> bytes:
+        return self._loader()
+
+    def __repr__(self) -> str:
+        return f"<IngestItem {self.name} ({self.size} bytes)>"
+
+
+def is_pdf_name(name: str) -> bool:
+    return name.lower().endswith(".pdf")
+
+
+def _check_pdf(name: str, data: bytes) -> bytes:
+    if not data.startswith(b"%PDF"):
+        raise ValueError(f"{name} はPDF形式ではありません。")
+    return data
+
+
+def _read_limited(stream, name: str, max_bytes: int) -> bytes:
+    """展開しながら読み込み、上限を超えたら中断する（ZIP爆弾対策）"""
+    buf = io.BytesIO()
+    while True:
+        chunk = stream.read(_READ_CHUNK)
+        if not chunk:
+            break
+        buf.write(chunk)
+        if buf.tell() > max_bytes:
+            raise ValueError(f"{name} がサイズ上限（{max_bytes // 1024 // 1024}MB）を超えています。")
+    return buf.getvalue()
+
+
+def _zip_member_name(info: zipfile.ZipInfo) -> str:
+    # UTF-8フラグのないZIP（Windowsの標準機能で作成したもの等）はCP932として復号する
+    if info.flag_bits & 0x800:
+        return info.filename
+    try:
+        return info.filename.encode("cp437").decode("cp932")
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return info.filename
+
+
+def iter_uploaded_files(files: List[Any]) -> Iterator[IngestItem]:
+    """st.file_uploader のアップロードファイルを IngestItem に変換"""
+    for f in files:
+        yield IngestItem(f.name, getattr(f, "size", 0), f.getvalue)
+
+
+def iter_zip_members(fileobj, max_member_bytes: int = DEFAULT_MAX_MEMBER_BYTES) -> Iterator[IngestItem]:
+    """ZIPアーカイブ内のPDFを1件ずつ返す（PDF以外はskip_reason付きで返す）
+
+    展開は1件ずつ行うが、fileobj（アーカイブ本体）は読み込み中ずっと保持される。
+    """
+    archive = zipfile.ZipFile(fileobj)
+    for info in archive.infolist():
+        if info.is_dir():
+            continue
+        name = _zip_member_name(info)
+        base_name = os.path.basename(name)
+        if base_name.startswith(".") or name.startswith("__MACOSX/"):
+            continue
+        if not is_pdf_name(name):
+            yield IngestItem(name, info.file_size, lambda: b"", skip_reason="PDF以外のファイル")
+            continue
+        if info.file_size > max_member_bytes:
+            yield IngestItem(name, info.file_size, lambda: b"", skip_reason="サイズ上限超過")
+            continue
+
+        def load(info=info, name=name) -> bytes:
+            with archive.open(info) as member:
+                return _check_pdf(name, _read_limited(member, name, max_member_bytes))
+
+        yield IngestItem(name, info.file_size, load)
+
+
+def iter_gcs_pdfs(client, bucket_name: str, prefix: str, max_member_bytes: int = DEFAULT_MAX_MEMBER_BYTES) -> Iterator[IngestItem]:
+    """GCSバケットのプレフィックス配下のPDFを1件ずつ返す（一覧取得はページ単位で遅延）"""
+    for blob in client.list_blobs(bucket_name, prefix=prefix):
+        if blob.name.endswith("/"):
+            continue
+        size = blob.size or 0
+        if not is_pdf_name(blob.name):
+            yield IngestItem(blob.name, size, lambda: b"", skip_reason="PDF以外のファイル")
+            continue
+        if size > max_member_bytes:
+            yield IngestItem(blob.name, size, lambda: b"", skip_reason="サイズ上限超過")
+            continue
+        yield IngestItem(blob.name, size, lambda blob=blob: _check_pdf(blob.name, blob.download_as_bytes()))
+
+
+def split_skipped(items: Iterator[IngestItem]) -> Tuple[List[IngestItem], List[IngestItem]]:
+    """処理対象とスキップ対象に分ける（中身は読み込まない）"""
+    targets, skipped = [], []
+    for item in items:
+        (skipped if item.skip_reason else targets).append(item)
+    return targets, skipped
+
+
+# ======================
+# ローカルディレクトリによるGCS代替（テスト・開発用）
+# ======================
+# google.cloud.storage.Client のうち本アプリが使うメソッドだけを、
+# ルートディレクトリ配下の「バケット名/オブジェクト名」のファイルで再現する。
+
+class LocalBlob:
+    def __init__(self, bucket_dir: str, name: str):
+        self.name = name
+        self._path = os.path.join(bucket_dir, *name.split("/"))
+
+    @property
+    def size(self) -> int:
+        return os.path.getsize(self._path) if os.path.exists(self._path) else 0
+
+    def exists(self) -> bool:
+        return os.path.isfile(self._path)
+
+    def download_as_bytes(self) -> bytes:
+        with open(self._path, "rb") as f:
+            return f.read()
+
+    def download_as_string(self) -> bytes:
+        return self.download_as_bytes()
+
+    def upload_from_string(self, data, content_type: str = None) -> None:
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        with open(self._path, "wb") as f:
+            f.write(data)
+
+
+class LocalBucket:
+    def __init__(self, root: str, name: str):
+        self.name = name
+        self._dir = os.path.join(root, name)
+
+    def blob(self, name: str) -> LocalBlob:
+        return LocalBlob(self._dir, name)
+
+
+class LocalDirectoryClient:
+    def __init__(self, root: str):
+        self.root = root
+
+    def bucket(self, bucket_name: str) -> LocalBucket:
+        return LocalBucket(self.root, bucket_name)
+
+    def get_bucket(self, bucket_name: str) -> LocalBucket:
+        if not os.path.isdir(os.path.join(self.root, bucket_name)):
+            raise FileNotFoundError(f"バケットが見つかりません: {bucket_name}")
+        return self.bucket(bucket_name)
+
+    def list_blobs(self, bucket_or_name, prefix: str = "") -> Iterator[LocalBlob]:
+        bucket_name = getattr(bucket_or_name, "name", bucket_or_name)
+        bucket_dir = os.path.join(self.root, bucket_name)
+        # GCSと同じく、オブジェクト名の辞書順で返す
+        names = []
+        for dirpath, _, filenames in os.walk(bucket_dir):
+            for filename in filenames:
+                rel = os.path.relpath(os.path.join(dirpath, filename), bucket_dir)
+                names.append(rel.replace(os.sep, "/"))
+        for name in sorted(names):
+            if name.startswith(prefix or ""):
+                yield LocalBlob(bucket_dir, name)
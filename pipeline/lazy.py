@@ -0,0 +1,50 @@
+import importlib
+import threading
+from types import ModuleType
+
+# ======================
+# 重いSDKの遅延インポート
+# ======================
+# pandas / google.generativeai / pymupdf4llm などは読み込みに数秒かかるため、
+# ログイン画面の描画前には読み込まず、最初に属性へアクセスした時点でインポートする。
+# バックグラウンドスレッドからの先読み（preload）と同時にアクセスされても安全なようにロックで保護する。
+
+
+class LazyModule:
+    """属性アクセス時に初めて実モジュールをインポートするプロキシ"""
+
+    def __init__(self, name: str):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+        self.__dict__["_lock"] = threading.Lock()
+
+    def _load(self) -> ModuleType:
+        module = self.__dict__["_module"]
+        if module is None:
+            with self.__dict__["_lock"]:
+                module = self.__dict__["_module"]
+                if module is None:
+                    module = importlib.import_module(self.__dict__["_name"])
+                    self.__dict__["_module"] = module
+        return module
+
+    @property
+    def loaded(self) -> bool:
+        return self.__dict__["_module"] is not None
+
+    def preload(self) -> None:
+        self._load()
+
+    def __getattr__(self, attr: str):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr: str, value) -> None:
+        setattr(self._load(), attr, value)
+
+    def __repr__(self) -> str:
+        state = "loaded" if self.loaded else "not loaded"
+        return f"<LazyModule {self.__dict__['_name']} ({state})>"
+
+
+def lazy_import(name: str) -> LazyModule:
+    return LazyModule(name)
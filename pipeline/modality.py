@@ -0,0 +1,115 @@
+import re
+from typing import Any, Dict, List, Optional
+
+from pipeline.config import resolve_config
+
+# ======================
+# 入力モダリティ（テキスト／画像）の選択
+# ======================
+# デジタル生成の見積書はテキスト層だけで十分に抽出できるため、ラスタ化と画像送信を省く。
+# 逆にスキャンPDFはテキスト層が空に近いので、Markdownを送らず画像のみとする。
+# どちらとも判断できない場合のみ両方を送る。
+
+MODALITY_TEXT = "text"
+MODALITY_IMAGE = "image"
+MODALITY_BOTH = "both"
+# PDFをそのままGeminiに渡す（ローカルでのMarkdown変換・ラスタ化を行わない）
+MODALITY_PDF = "pdf"
+
+MODALITY_LABELS = {
+    MODALITY_TEXT: "テキストのみ",
+    MODALITY_IMAGE: "画像のみ",
+    MODALITY_BOTH: "テキスト＋画像",
+    MODALITY_PDF: "PDF直接",
+}
+
+# 入力モード（保険会社ごとに secrets.toml の[input_mode_config]で選択）
+#   [input_mode_config]
+#   default = "markdown"
+#   "損保ジャパン" = "native_pdf"
+INPUT_MODE_MARKDOWN = "markdown"
+INPUT_MODE_NATIVE_PDF = "native_pdf"
+
+INPUT_MODE_LABELS = {
+    INPUT_MODE_MARKDOWN: "Markdown＋画像（ローカル前処理）",
+    INPUT_MODE_NATIVE_PDF: "PDF直接送信",
+}
+
+# 既定のしきい値（secrets.tomlの[modality_config]で上書き可能。
+# 値は benchmarks/modality_eval.py でオフライン評価セットに対して検証する）
+DEFAULT_MODALITY_THRESHOLDS = {
+    # テキストのみとする条件: 日本語比率・文字数・必須アンカーの充足率がすべて以上
+    "text_only_min_ratio": 0.25,
+    "text_only_min_chars": 400.0,
+    "text_only_min_anchor_ratio": 1.0,
+    # 画像のみとする条件: 日本語比率または文字数のいずれかが以下
+    "image_only_max_ratio": 0.05,
+    "image_only_max_chars": 80.0,
+}
+
+# テキスト層に含まれているべき見出し（各社プロンプトが参照する項目名）
+INSURER_ANCHORS = {
+    "東京海上日動": ["建築年月", "免責金額", "保険料", "プラン"],
+    "損保ジャパン": ["建築年月", "自己負担額", "保険料", "プラン"],
+    "三井住友海上": ["建築年月", "免責金額", "保険料", "コース"],
+}
+GENERIC_ANCHORS = ["保険料", "保険期間", "保険金額"]
+
+
+def japanese_ratio(text: str) -> float:
+    if not text: return 0.0
+    jp_chars = re.findall(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uff10-\uff19\uff21-\uff3a\uff41-\uff5a]", text)
+    return len(jp_chars) / max(len(text), 1)
+
+
+def resolve_input_mode(insurer: str, config: Optional[Dict[str, Any]] = None) -> str:
+    """保険会社別の設定（なければ default）から入力モードを決める"""
+    config = config or {}
+    mode = config.get(insurer) or config.get("default") or INPUT_MODE_MARKDOWN
+    return mode if mode in INPUT_MODE_LABELS else INPUT_MODE_MARKDOWN
+
+
+def resolve_thresholds(overrides: Optional[Dict[str, Any]] = None) -> Dict[str, float]:
+    return resolve_config(DEFAULT_MODALITY_THRESHOLDS, overrides)
+
+
+def find_anchors(text: str, insurer: str) -> List[str]:
+    """テキスト層に見つかったアンカー語の一覧"""
+    compact = re.sub(r"[\s　]+", "", text or "")
+    anchors = INSURER_ANCHORS.get(insurer, GENERIC_ANCHORS)
+    return [a for a in anchors if a in compact]
+
+
+def plan_modality(text: str, insurer: str, thresholds: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """テキスト品質とアンカーの有無から送信モダリティを決める"""
+    th = resolve_thresholds(thresholds)
+    stripped = re.sub(r"[\s|\-:#*]+", "", text or "")
+    char_count = len(stripped)
+    ratio = japanese_ratio(text)
+    anchors = INSURER_ANCHORS.get(insurer, GENERIC_ANCHORS)
+    hits = find_anchors(text, insurer)
+    anchor_ratio = len(hits) / len(anchors) if anchors else 0.0
+
+    plan = {
+        "mode": MODALITY_BOTH,
+        "reason": "",
+        "text_quality": ratio,
+        "char_count": char_count,
+        "anchor_hits": hits,
+        "anchor_ratio": anchor_ratio,
+    }
+
+    if ratio <= th["image_only_max_ratio"] or char_count <= th["image_only_max_chars"]:
+        plan["mode"] = MODALITY_IMAGE
+        plan["reason"] = "テキスト層がほぼ空（スキャンPDFと判断）"
+    elif (
+        ratio >= th["text_only_min_ratio"]
+        and char_count >= th["text_only_min_chars"]
+        and anchor_ratio >= th["text_only_min_anchor_ratio"]
+    ):
+        plan["mode"] = MODALITY_TEXT
+        plan["reason"] = "テキスト層が高品質で必要な見出しを含む"
+    else:
+        missing = [a for a in anchors if a not in hits]
+        plan["reason"] = "テキスト品質が不十分" + (f"（不足: {'、'.join(missing)}）" if missing else "")
+    return plan
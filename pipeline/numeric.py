@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+from typing import List, Optional
+
+from pipeline.lazy import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+# ======================
+# 抽出値の数値化（表示用文字列の隣に型付き列を追加）
+# ======================
+# 抽出結果は表示・Excel出力のため文字列のまま保持し、並べ替えや比較に使う数値列を別途付与する。
+# 処理はすべて pandas の文字列アクセサと NumPy 演算で行い、行ごとの Python ループは使わない。
+
+MONEY_COLUMNS = [
+    "保険料",
+    "建物_基本_保険金額",
+    "建物_地震_保険金額",
+    "家財_基本_保険金額",
+    "家財_地震_保険金額",
+]
+
+# 免責金額（自己負担額）として抽出される補償項目
+COVERAGE_COLUMNS = [
+    "火災、落雷、破裂・爆発",
+    "風災、雹(ひょう)災、雪災",
+    "水濡れ",
+    "盗難",
+    "水災",
+    "破損、汚損等",
+    "地震・噴火・津波",
+    "盗難・水濡（ぬ）れ等",
+    "物体の落下、飛来、水濡れ、騒じょう",
+    "不測かつ突発的な事故",
+]
+
+PERIOD_COLUMN = "保険期間"
+BUILT_COLUMN = "建築年月"
+PREMIUM_COLUMN = "保険料"
+
+YEN_SUFFIX = "_円"
+PERIOD_TYPED_COLUMN = "保険期間_年"
+BUILT_TYPED_COLUMN = "建築年月_日付"
+ANNUAL_PREMIUM_COLUMN = "年換算保険料_円"
+PREMIUM_RANK_COLUMN = "保険料順位"
+CHEAPEST_COLUMN = "最安の補償項目"
+
+_FULLWIDTH_TABLE = str.maketrans(
+    "０１２３４５６７８９，．／－　",
+    "0123456789,./- ",
+)
+
+_NUMBER = r"(\d+(?:\.\d+)?)"
+_MONEY_PATTERN = rf"(?=\d)(?:{_NUMBER}億)?(?:{_NUMBER}万)?(?:{_NUMBER}千)?{_NUMBER}?"
+_MONTH_MARK = r"[かヶケカヵ]?月"
+
+# 和暦の元年 - 1（西暦 = 和暦年 + オフセット）
+_ERA_OFFSETS = {
+    "令和": 2018, "R": 2018,
+    "平成": 1988, "H": 1988,
+    "昭和": 1925, "S": 1925,
+}
+
+
+def _normalize_text(series: pd.Series) -> pd.Series:
+    """全角数字・記号を半角にし、桁区切りと空白を除去"""
+    s = series.astype("string").str.translate(_FULLWIDTH_TABLE)
+    return s.str.replace(r"[,\s]", "", regex=True)
+
+
+def parse_money(series: pd.Series) -> pd.Series:
+    """「5万円」「12,000円」「1億2000万円」などを円単位の数値に変換（解析不能はNaN）"""
+    s = _normalize_text(series).str.replace(r"(\d+)千万", r"\g<1>000万", regex=True)
+    parts = s.str.extract(_MONEY_PATTERN).astype(float)
+    units = np.array([1e8, 1e4, 1e3, 1.0])
+    values = parts.to_numpy()
+    total = np.nansum(values * units, axis=1)
+    total[np.isnan(values).all(axis=1)] = np.nan
+    return pd.Series(total, index=series.index, dtype="float64")
+
+
+def parse_period_years(series: pd.Series) -> pd.Series:
+    """「5年間」「1年6ヶ月」「6か月」などを年数に変換"""
+    s = _normalize_text(series)
+    # 始期日を含む表記（例: 2025年4月1日から5年間）では「年間」を優先
+    explicit = s.str.extract(r"(\d+)年間")[0].astype(float)
+    compound = s.str.extract(rf"^(?:(\d+)年)?(?:(\d+){_MONTH_MARK}間?)?$").astype(float)
+    has_compound = compound.notna().any(axis=1)
+    compound_years = compound[0].fillna(0) + compound[1].fillna(0) / 12
+    years = explicit.where(explicit.notna(), compound_years.where(has_compound))
+    return years.astype("float64")
+
+
+def parse_built_date(series: pd.Series) -> pd.Series:
+    """「2015年3月」「平成27年3月」「H27.3」「2015/03」などを月初の日付に変換"""
+    s = _normalize_text(series).str.replace("元年", "1年", regex=False)
+    parts = s.str.extract(r"(令和|平成|昭和|R|H|S)?(\d{1,4})[年/.\-](?:(\d{1,2})月?)?")
+    era_offset = parts[0].map(_ERA_OFFSETS).astype(float)
+    year = parts[1].astype(float)
+    year = year + era_offset.fillna(0)
+    # 元号なしの2桁年は判別できないため対象外
+    year = year.where(era_offset.notna() | (year >= 1000))
+    month = parts[2].astype(float).fillna(1)
+    month = month.where((month >= 1) & (month <= 12))
+    return pd.to_datetime(
+        pd.DataFrame({"year": year, "month": month, "day": 1}),
+        errors="coerce",
+    )
+
+
+def _insert_after(df: pd.DataFrame, anchor: str, name: str, values: pd.Series) -> None:
+    if name in df.columns:
+        df.drop(columns=[name], inplace=True)
+    df.insert(df.columns.get_loc(anchor) + 1, name, values)
+
+
+def add_typed_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """金額・期間・建築年月の各列の隣に数値（日付）列を追加した新しいDataFrameを返す"""
+    typed = df.copy()
+    for col in MONEY_COLUMNS + COVERAGE_COLUMNS:
+        if col in typed.columns:
+            _insert_after(typed, col, col + YEN_SUFFIX, parse_money(typed[col]))
+    if PERIOD_COLUMN in typed.columns:
+        _insert_after(typed, PERIOD_COLUMN, PERIOD_TYPED_COLUMN, parse_period_years(typed[PERIOD_COLUMN]))
+    if BUILT_COLUMN in typed.columns:
+        _insert_after(typed, BUILT_COLUMN, BUILT_TYPED_COLUMN, parse_built_date(typed[BUILT_COLUMN]))
+    return typed
+
+
+# ======================
+# プラン比較エンジン
+# ======================
+def _group_keys(df: pd.DataFrame, group_by: Optional[List[str]]) -> List[pd.Series]:
+    if group_by is None:
+        group_by = [c for c in ["氏名"] if c in df.columns]
+    if not group_by:
+        return [pd.Series(0, index=df.index)]
+    return [df[c] for c in group_by]
+
+
+def cheapest_by_coverage(ranked: pd.DataFrame, group_by: Optional[List[str]] = None) -> pd.DataFrame:
+    """補償項目ごとに、顧客内で年換算保険料が最も安いプランを True とするDataFrame
+
+    その項目の免責金額が数値で取れている（＝補償対象の）プランの中で判定する。
+    """
+    coverage_cols = [c for c in COVERAGE_COLUMNS if c + YEN_SUFFIX in ranked.columns]
+    if not coverage_cols or ANNUAL_PREMIUM_COLUMN not in ranked.columns:
+        return pd.DataFrame(index=ranked.index)
+    covered = ranked[[c + YEN_SUFFIX for c in coverage_cols]].notna().to_numpy()
+    annual = ranked[ANNUAL_PREMIUM_COLUMN].to_numpy(dtype="float64")
+    masked = pd.DataFrame(
+        np.where(covered, annual[:, None], np.nan),
+        index=ranked.index,
+        columns=coverage_cols,
+    )
+    group_min = masked.groupby(_group_keys(ranked, group_by), dropna=False).transform("min")
+    return (masked == group_min) & covered
+
+
+def rank_plans(df: pd.DataFrame, group_by: Optional[List[str]] = None) -> pd.DataFrame:
+    """年換算保険料・顧客内の保険料順位・補償項目ごとの最安を付与する
+
+    group_by の列（既定は「氏名」）が同じ行を1人の顧客のプラン群として比較する。
+    """
+    ranked = df if PREMIUM_COLUMN + YEN_SUFFIX in df.columns else add_typed_columns(df)
+    ranked = ranked.copy()
+    nan = pd.Series(np.nan, index=ranked.index)
+
+    premium = ranked.get(PREMIUM_COLUMN + YEN_SUFFIX, nan)
+    years = ranked.get(PERIOD_TYPED_COLUMN, nan)
+    # 期間不明の場合は年払いとみなす
+    years = years.where(years > 0, 1.0)
+    annual = premium / years
+    ranked[ANNUAL_PREMIUM_COLUMN] = annual
+    ranked[PREMIUM_RANK_COLUMN] = (
+        annual.groupby(_group_keys(ranked, group_by), dropna=False).rank(method="min").astype("Int64")
+    )
+
+    cheapest = cheapest_by_coverage(ranked, group_by)
+    if cheapest.empty or not len(cheapest.columns):
+        ranked[CHEAPEST_COLUMN] = ""
+        return ranked
+    labels = np.array([c + " / " for c in cheapest.columns], dtype=object)
+    joined = cheapest.to_numpy().astype(object) @ labels
+    ranked[CHEAPEST_COLUMN] = pd.Series(joined, index=ranked.index, dtype="string").str.removesuffix(" / ")
+    return ranked
+
+
+def cheapest_mask(ranked: pd.DataFrame, group_by: Optional[List[str]] = None) -> pd.DataFrame:
+    """最安セルを True とする表示用マスク（Styler の強調表示向け）"""
+    mask = pd.DataFrame(False, index=ranked.index, columns=ranked.columns)
+    cheapest = cheapest_by_coverage(ranked, group_by)
+    for col in cheapest.columns:
+        if col in mask.columns:
+            mask[col] = cheapest[col]
+    if PREMIUM_RANK_COLUMN in ranked.columns:
+        mask[ANNUAL_PREMIUM_COLUMN] = ranked[PREMIUM_RANK_COLUMN].eq(1).fillna(False).astype(bool)
+    return mask
+
+
+DERIVED_COLUMNS = (
+    [c + YEN_SUFFIX for c in MONEY_COLUMNS + COVERAGE_COLUMNS]
+    + [PERIOD_TYPED_COLUMN, BUILT_TYPED_COLUMN, ANNUAL_PREMIUM_COLUMN, PREMIUM_RANK_COLUMN, CHEAPEST_COLUMN]
+)
+
+
+def strip_derived_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """数値化・比較で付与した列を除き、表示用の文字列列だけを残す"""
+    return df.drop(columns=[c for c in DERIVED_COLUMNS if c in df.columns])
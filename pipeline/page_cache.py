@@ -0,0 +1,282 @@
+import io
+import os
+import sys
+import time
+import zlib
+import pickle
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# ======================
+# ページ画像・Markdown用のサイズ管理キャッシュ
+# ======================
+# st.cache_data はエントリ数・サイズ・有効期限の上限なしにプロセス全体で値を保持するため、
+# 220dpiのPIL画像リストが溜まるとコンテナのメモリを圧迫する。
+# ここではエントリごとの実バイト数を計上し、全体の上限を超えたらLRUで追い出す。
+# 追い出したエントリは（有効な場合）圧縮してローカルディスクへ退避する。
+
+
+def pdf_digest(pdf_bytes: bytes) -> str:
+    """PDFバイト列のキャッシュキー用ハッシュ"""
+    return hashlib.sha256(pdf_bytes).hexdigest()
+
+
+def estimate_size(value: Any) -> int:
+    """キャッシュ値のメモリ上のおおよそのバイト数"""
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_size(v) for v in value)
+    if hasattr(value, "getbands") and hasattr(value, "size"):
+        # PIL画像: 幅 × 高さ × チャンネル数（展開後のラスタサイズ）
+        width, height = value.size
+        return width * height * len(value.getbands())
+    return sys.getsizeof(value)
+
+
+def _is_pil_image(value: Any) -> bool:
+    return hasattr(value, "getbands") and hasattr(value, "save")
+
+
+def _encode_for_disk(value: Any) -> bytes:
+    """ディスク退避用に値を圧縮シリアライズする（画像はPNG、テキストはzlib）"""
+    if isinstance(value, str):
+        payload = ("text", zlib.compress(value.encode("utf-8"), 6))
+    elif isinstance(value, (list, tuple)) and value and all(_is_pil_image(v) for v in value):
+        pages = []
+        for img in value:
+            buf = io.BytesIO()
+            img.save(buf, format="PNG", compress_level=1)
+            pages.append(buf.getvalue())
+        payload = ("images", pages)
+    else:
+        payload = ("pickle", zlib.compress(pickle.dumps(value), 6))
+    return pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _decode_from_disk(data: bytes) -> Any:
+    kind, body = pickle.loads(data)
+    if kind == "text":
+        return zlib.decompress(body).decode("utf-8")
+    if kind == "images":
+        from PIL import Image
+
+        pages = []
+        for page in body:
+            img = Image.open(io.BytesIO(page))
+            img.load()
+            pages.append(img)
+        return pages
+    return pickle.loads(zlib.decompress(body))
+
+
+class PageCache:
+    """バイト数上限・LRU・TTL・ディスク退避付きのスレッドセーフなキャッシュ"""
+
+    def __init__(
+        self,
+        max_bytes: int = 512 * 1024 * 1024,
+        ttl_seconds: float = 3600,
+        disk_dir: Optional[str] = None,
+        disk_max_bytes: int = 2 * 1024 * 1024 * 1024,
+    ):
+        self.max_bytes = int(max_bytes)
+        self.ttl_seconds = float(ttl_seconds)
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = int(disk_max_bytes)
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+        # key -> (value, size, stored_at)
+        self._entries: "OrderedDict[str, Tuple[Any, int, float]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self._stats = {
+            "hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "spills": 0,
+        }
+
+    # --- 公開API ---
+    def get(self, key: str) -> Tuple[bool, Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, size, stored_at = entry
+                if self._expired(stored_at):
+                    self._drop(key)
+                    self._stats["expirations"] += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return True, value
+
+        found, value, stored_at = self._load_from_disk(key)
+        with self._lock:
+            if not found:
+                self._stats["misses"] += 1
+                return False, None
+            self._stats["disk_hits"] += 1
+            if estimate_size(value) > self.max_bytes:
+                # メモリに載らない値はディスク上のファイルをそのまま使い、書き戻さない
+                return True, value
+            # TTLはディスク上の更新時刻（＝最初に格納した時点）から引き継ぐ
+            evicted = self._store(key, value, stored_at)
+        self._spill_all(evicted)
+        return True, value
+
+    def put(self, key: str, value: Any) -> None:
+        with self._lock:
+            evicted = self._store(key, value)
+        # PNGエンコード・ディスク書き込みは重いため、ロックを外してから行う
+        self._spill_all(evicted)
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any]) -> Any:
+        found, value = self.get(key)
+        if found:
+            return value
+        # 計算はロック外で行う（同一キーの同時計算は許容し、後勝ちで格納）
+        value = compute()
+        self.put(key, value)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        for path, _, _ in self._disk_files():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+            stats["max_bytes"] = self.max_bytes
+        lookups = stats["hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        disk_files = self._disk_files()
+        stats["disk_entries"] = len(disk_files)
+        stats["disk_bytes"] = sum(size for _, size, _ in disk_files)
+        return stats
+
+    # --- 内部処理（_lock 保持中に呼ぶこと。ディスク層を除く） ---
+    def _expired(self, stored_at: float) -> bool:
+        return self.ttl_seconds > 0 and time.time() - stored_at > self.ttl_seconds
+
+    def _drop(self, key: str) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def _store(self, key: str, value: Any, stored_at: Optional[float] = None) -> List[Tuple[str, Any, float]]:
+        """値を格納し、ディスクへ退避すべきエントリ (key, value, stored_at) の一覧を返す"""
+        stored_at = time.time() if stored_at is None else stored_at
+        size = estimate_size(value)
+        if key in self._entries:
+            self._drop(key)
+        if size > self.max_bytes:
+            # 単体で上限を超える値はメモリに載せず、ディスクにのみ置く
+            return [(key, value, stored_at)]
+        self._entries[key] = (value, size, stored_at)
+        self._bytes += size
+        evicted = []
+        while self._bytes > self.max_bytes and self._entries:
+            old_key, (old_value, _, stored_at) = next(iter(self._entries.items()))
+            self._drop(old_key)
+            self._stats["evictions"] += 1
+            if not self._expired(stored_at):
+                evicted.append((old_key, old_value, stored_at))
+        return evicted
+
+    # --- ディスク層 ---
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".bin")
+
+    def _disk_files(self):
+        if not self.disk_dir or not os.path.isdir(self.disk_dir):
+            return []
+        files = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(".bin"):
+                continue
+            path = os.path.join(self.disk_dir, name)
+            try:
+                st_ = os.stat(path)
+            except OSError:
+                continue
+            files.append((path, st_.st_size, st_.st_mtime))
+        return files
+
+    def _spill_all(self, evicted: List[Tuple[str, Any, float]]) -> None:
+        """_lock を保持せずに呼ぶこと"""
+        for key, value, stored_at in evicted:
+            self._spill(key, value, stored_at)
+
+    def _spill(self, key: str, value: Any, stored_at: float) -> None:
+        if not self.disk_dir or self.disk_max_bytes <= 0:
+            return
+        try:
+            data = _encode_for_disk(value)
+            if len(data) > self.disk_max_bytes:
+                return
+            fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            path = self._disk_path(key)
+            os.replace(tmp_path, path)
+            # ディスク上のTTLは退避時点ではなく、最初に格納した時点から数える
+            os.utime(path, (stored_at, stored_at))
+            with self._lock:
+                self._stats["spills"] += 1
+            self._trim_disk()
+        except Exception as e:
+            print(f"キャッシュのディスク退避エラー: {e}")
+
+    def _trim_disk(self) -> None:
+        files = sorted(self._disk_files(), key=lambda f: f[2])
+        total = sum(size for _, size, _ in files)
+        now = time.time()
+        for path, size, mtime in files:
+            expired = self.ttl_seconds > 0 and now - mtime > self.ttl_seconds
+            if not expired and total <= self.disk_max_bytes:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def _load_from_disk(self, key: str) -> Tuple[bool, Any, float]:
+        """戻り値: (見つかったか, 値, 格納時刻＝ファイルの更新時刻)"""
+        if not self.disk_dir:
+            return False, None, 0.0
+        path = self._disk_path(key)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return False, None, 0.0
+        if self.ttl_seconds > 0 and time.time() - mtime > self.ttl_seconds:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return False, None, 0.0
+        try:
+            with open(path, "rb") as f:
+                return True, _decode_from_disk(f.read()), mtime
+        except Exception as e:
+            print(f"キャッシュのディスク読み込みエラー: {e}")
+            return False, None, 0.0
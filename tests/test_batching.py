@@ -0,0 +1,104 @@
+import pytest
+
+from pipeline.batching import (
+    IMAGE_TOKEN_ESTIMATE,
+    PROMPT_TOKEN_ESTIMATE,
+    estimate_tokens,
+    make_doc_id,
+    pack_documents,
+    plan_units,
+    resolve_batch_config,
+    split_batch_response,
+)
+
+BUDGET = PROMPT_TOKEN_ESTIMATE + 10000
+
+
+@pytest.mark.parametrize(
+    "token_counts, max_docs, expected",
+    [
+        # 予算内に収まる限り順にまとめる
+        ([4000, 4000, 2000, 4000], 8, [[0, 1, 2], [3]]),
+        ([5000, 5000, 5000], 8, [[0, 1], [2]]),
+        # 文書数の上限
+        ([100] * 5, 2, [[0, 1], [2, 3], [4]]),
+        # 単独で予算を超える文書は1件だけの単位にする
+        ([50000], 8, [[0]]),
+        ([1000, 50000, 1000], 8, [[0], [1], [2]]),
+        ([], 8, []),
+    ],
+)
+def test_pack_documents(token_counts, max_docs, expected):
+    assert pack_documents(token_counts, BUDGET, max_docs) == expected
+
+
+def test_plan_units_groups_by_insurer_and_keeps_order():
+    groups = ["東京海上日動", "", "損保ジャパン", "東京海上日動", "損保ジャパン", ""]
+    units = plan_units(groups, [1000] * 6, BUDGET, 8)
+    assert units == [[0, 3], [1], [2, 4], [5]]
+
+
+def test_plan_units_splits_group_over_budget():
+    groups = ["東京海上日動"] * 3
+    assert plan_units(groups, [6000, 6000, 6000], BUDGET, 8) == [[0], [1], [2]]
+
+
+def test_split_batch_response_by_doc_id():
+    parsed = {
+        "DOC1": [{"プラン": "プラン1"}, {"プラン": "プラン2"}],
+        "DOC2": {"プラン": "プラン1"},
+    }
+    sections, failed = split_batch_response(parsed, ["DOC1", "DOC2"])
+    assert [row["プラン"] for row in sections["DOC1"]] == ["プラン1", "プラン2"]
+    assert sections["DOC2"] == [{"プラン": "プラン1"}]
+    assert failed == []
+
+
+def test_split_batch_response_missing_and_extra_markers():
+    # DOC2 が欠落し、依頼していない DOC9 が含まれる応答
+    parsed = {"DOC1": [{"プラン": "プラン1"}], "DOC9": [{"プラン": "プラン1"}]}
+    sections, failed = split_batch_response(parsed, ["DOC1", "DOC2", "DOC3"])
+    assert list(sections) == ["DOC1"]
+    # 欠落した文書は個別抽出に回す
+    assert failed == ["DOC2", "DOC3"]
+
+
+@pytest.mark.parametrize("section", [[], "解析不能", [1, "x"], None])
+def test_split_batch_response_unusable_section(section):
+    sections, failed = split_batch_response({"DOC1": section, "DOC2": [{"プラン": "A"}]}, ["DOC1", "DOC2"])
+    assert failed == ["DOC1"]
+    assert list(sections) == ["DOC2"]
+
+
+def test_split_batch_response_accepts_list_form():
+    parsed = [
+        {"文書ID": "DOC1", "プラン一覧": [{"プラン": "A"}]},
+        {"doc_id": "DOC2", "plans": [{"プラン": "B"}]},
+        "ignored",
+    ]
+    sections, failed = split_batch_response(parsed, ["DOC1", "DOC2"])
+    assert sections == {"DOC1": [{"プラン": "A"}], "DOC2": [{"プラン": "B"}]}
+    assert failed == []
+
+
+@pytest.mark.parametrize("parsed", [None, "text", 123])
+def test_split_batch_response_unparseable_falls_back_for_all(parsed):
+    assert split_batch_response(parsed, ["DOC1", "DOC2"]) == ({}, ["DOC1", "DOC2"])
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("保険料") == 3
+    assert estimate_tokens("abcdefgh") == 2
+    assert estimate_tokens("", image_count=2) == 2 * IMAGE_TOKEN_ESTIMATE
+    assert estimate_tokens(None) == 0
+
+
+def test_make_doc_id_is_one_based():
+    assert [make_doc_id(i) for i in range(3)] == ["DOC1", "DOC2", "DOC3"]
+
+
+def test_resolve_batch_config():
+    config = resolve_batch_config({"max_docs": "4", "unknown": 1})
+    assert config["max_docs"] == 4
+    assert config["token_budget"] == 30000
+    assert "unknown" not in config
@@ -0,0 +1,55 @@
+import pytest
+
+from pipeline.cascade import resolve_cascade_config, validate_rows
+
+
+def test_validate_rows_without_premium_field():
+    fields = ["氏名", "所在地", "建築年月"]
+    rows = [
+        {"保険会社": "東京海上日動", "プラン": "プラン1", "氏名": "山田太郎", "所在地": "東京都千代田区", "建築年月": "2010年4月"},
+        {"保険会社": "東京海上日動", "プラン": "プラン2", "氏名": "山田太郎", "所在地": "東京都千代田区", "建築年月": "2010年4月"},
+    ]
+    assert validate_rows(rows, fields, expected_count=2) == []
+
+
+def test_validate_rows_requires_premium_when_requested():
+    fields = ["氏名", "保険料"]
+    rows = [{"保険会社": "東京海上日動", "プラン": "プラン1", "氏名": "山田太郎", "保険料": ""}]
+    assert "必須項目が空: 保険料" in validate_rows(rows, fields, expected_count=1)
+
+
+def test_validate_rows_always_requires_insurer_and_plan():
+    rows = [{"保険会社": "", "プラン": "", "氏名": "山田太郎"}]
+    issues = validate_rows(rows, ["氏名"], expected_count=1)
+    assert "必須項目が空: 保険会社" in issues
+    assert "必須項目が空: プラン" in issues
+
+
+def test_validate_rows_reports_missing_plans():
+    rows = [{"保険会社": "損保ジャパン", "プラン": "プラン1", "保険料": "12,340円"}]
+    assert validate_rows(rows, ["保険料"], expected_count=3) == ["プラン数不足（1/3）"]
+
+
+def test_validate_rows_accepts_symbols_for_generic_prompt():
+    # 保険会社不明時の汎用プロンプトは補償の有無を〇/空欄で出力させる
+    rows = [{"保険会社": "あいおいニッセイ同和", "プラン": "プラン1", "保険料": "12,340円", "水災": "〇", "盗難": ""}]
+    assert validate_rows(rows, ["保険料", "水災", "盗難"], expected_count=1, insurer="") == []
+
+
+@pytest.mark.parametrize("insurer", ["東京海上日動", "損保ジャパン", "三井住友海上"])
+def test_validate_rows_rejects_symbols_for_known_insurers(insurer):
+    rows = [{"保険会社": insurer, "プラン": "プラン1", "保険料": "12,340円", "水災": "〇", "盗難": "5万円"}]
+    issues = validate_rows(rows, ["保険料", "水災", "盗難"], expected_count=1, insurer=insurer)
+    assert issues == ["免責金額に〇/×等の記号: 水災"]
+
+
+def test_validate_rows_reports_unparseable_amounts():
+    rows = [{"保険会社": "東京海上日動", "プラン": "プラン1", "保険料": "要相談"}]
+    assert validate_rows(rows, ["保険料"], expected_count=1, insurer="東京海上日動") == ["金額を解析できない: 保険料"]
+
+
+def test_resolve_cascade_config_coerces_types():
+    config = resolve_cascade_config({"enabled": "false", "min_filled_ratio": "0.8", "unknown": 1})
+    assert config["enabled"] is False
+    assert config["min_filled_ratio"] == 0.8
+    assert "unknown" not in config
@@ -0,0 +1,185 @@
+import threading
+from collections import deque
+
+import pytest
+from google.api_core import exceptions as api_exceptions
+
+from pipeline import gemini_call
+from pipeline.gemini_call import (
+    CALL_BATCH,
+    CALL_STEP1,
+    CALL_STEP2,
+    CircuitBreaker,
+    CircuitOpenError,
+    GeminiCaller,
+    GeminiDeadlineExceeded,
+    resolve_call_config,
+)
+
+
+class FakeModel:
+    """呼び出しごとに behaviors を先頭から1つずつ実行する generate_content の代替"""
+
+    def __init__(self, *behaviors):
+        self.model_name = "models/fake-model"
+        self.behaviors = deque(behaviors)
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, contents, **kwargs):
+        with self._lock:
+            self.calls += 1
+            behavior = self.behaviors.popleft()
+        return behavior()
+
+
+def returns(value):
+    return lambda: value
+
+
+def blocks_until(event, value="slow"):
+    def behavior():
+        event.wait(5)
+        return value
+    return behavior
+
+
+def raises(error):
+    def behavior():
+        raise error
+    return behavior
+
+
+@pytest.fixture
+def release():
+    event = threading.Event()
+    yield event
+    # 止めたままのワーカースレッドを残さない
+    event.set()
+
+
+def test_resolve_call_config_coerces_types():
+    config = resolve_call_config({"hedge_enabled": "false", "deadline_seconds": "5", "max_workers": "4", "unknown": 1})
+    assert config["hedge_enabled"] is False
+    assert config["deadline_seconds"] == 5.0
+    assert config["max_workers"] == 4
+    assert "unknown" not in config
+
+
+def test_returns_first_response():
+    caller = GeminiCaller({"hedge_enabled": False})
+    model = FakeModel(returns("ok"))
+    assert caller.call(model, "prompt", CALL_STEP2) == "ok"
+    summary = caller.summary()["call_types"][CALL_STEP2]
+    assert summary["calls"] == 1
+    assert summary["hedged"] == 0
+
+
+def test_hedge_wins_when_first_request_is_slow(release):
+    caller = GeminiCaller({"hedge_default_delay": 0.05, "deadline_seconds": 5.0})
+    model = FakeModel(blocks_until(release), returns("hedged"))
+    assert caller.call(model, "prompt", CALL_STEP2) == "hedged"
+    assert model.calls == 2
+    summary = caller.summary()["call_types"][CALL_STEP2]
+    assert summary["hedged"] == 1
+    assert summary["hedge_wins"] == 1
+
+
+def test_hedge_delay_follows_recorded_latency():
+    caller = GeminiCaller({"hedge_min_samples": 3, "hedge_default_delay": 30.0, "hedge_min_delay": 2.0})
+    model = FakeModel(*[returns("ok")] * 3)
+    assert caller.hedge_delay("fake-model", CALL_STEP2) == 30.0
+    for _ in range(3):
+        caller.call(model, "prompt", CALL_STEP2)
+    # 記録が揃うとp95（ここではほぼ0秒）を使い、下限で切り上げる
+    assert caller.hedge_delay("fake-model", CALL_STEP2) == 2.0
+
+
+def test_hedge_delay_is_tracked_per_model():
+    caller = GeminiCaller({"hedge_min_samples": 3, "hedge_default_delay": 30.0, "hedge_min_delay": 2.0})
+    fast = FakeModel(*[returns("ok")] * 3)
+    for _ in range(3):
+        caller.call(fast, "prompt", CALL_STEP2)
+    strong = FakeModel()
+    strong.model_name = "models/strong-model"
+    # 軽量モデルの応答時間は上位モデルのヘッジ判定に使わない
+    assert caller.hedge_delay("fake-model", CALL_STEP2) == 2.0
+    assert caller.hedge_delay("strong-model", CALL_STEP2) == 30.0
+    assert caller.hedge_delay("fake-model", CALL_STEP1) == 30.0
+
+
+def test_deadline_exceeded(release):
+    caller = GeminiCaller({"hedge_enabled": False, "deadline_seconds": 0.1})
+    model = FakeModel(blocks_until(release))
+    with pytest.raises(GeminiDeadlineExceeded):
+        caller.call(model, "prompt", CALL_STEP2)
+    assert caller.summary()["call_types"][CALL_STEP2]["deadline"] == 1
+
+
+def test_batch_calls_use_batch_deadline():
+    caller = GeminiCaller({"deadline_seconds": 10.0, "batch_deadline_seconds": 60.0})
+    assert caller.deadline_for(CALL_STEP2) == 10.0
+    assert caller.deadline_for(CALL_BATCH) == 60.0
+
+
+def test_deadline_is_passed_as_request_timeout():
+    caller = GeminiCaller({"hedge_enabled": False, "deadline_seconds": 7.0})
+    received = {}
+
+    class Model(FakeModel):
+        def generate_content(self, contents, **kwargs):
+            received.update(kwargs)
+            return "ok"
+
+    caller.call(Model(), "prompt", CALL_STEP2)
+    assert received["request_options"] == {"timeout": 7.0}
+
+
+def test_breaker_opens_after_consecutive_outages():
+    caller = GeminiCaller({"hedge_enabled": False, "breaker_failure_threshold": 3, "breaker_reset_seconds": 60.0})
+    model = FakeModel(*[raises(api_exceptions.ServiceUnavailable("down"))] * 3)
+    for _ in range(3):
+        with pytest.raises(api_exceptions.ServiceUnavailable):
+            caller.call(model, "prompt", CALL_STEP2)
+    with pytest.raises(CircuitOpenError):
+        caller.call(model, "prompt", CALL_STEP2)
+    # 停止中はモデルを呼び出さない
+    assert model.calls == 3
+    assert caller.summary()["breakers"] == {"fake-model": CircuitBreaker.OPEN}
+    assert caller.summary()["call_types"][CALL_STEP2]["rejected"] == 1
+
+
+def test_breaker_ignores_non_outage_errors():
+    caller = GeminiCaller({"hedge_enabled": False, "breaker_failure_threshold": 2})
+    model = FakeModel(*[raises(api_exceptions.InvalidArgument("bad request"))] * 3)
+    for _ in range(3):
+        with pytest.raises(api_exceptions.InvalidArgument):
+            caller.call(model, "prompt", CALL_STEP2)
+    assert caller.summary()["breakers"] == {"fake-model": CircuitBreaker.CLOSED}
+
+
+def test_breaker_half_open_allows_single_trial(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(gemini_call.time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=30.0)
+    breaker.record_failure()
+    assert breaker.allow() is None
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.allow() == 30.0
+
+    now[0] += 30.0
+    # 再開時刻を過ぎると1件だけ試行を通す
+    assert breaker.allow() is None
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # 試行中の呼び出しは止め、0秒ではない再開の目安を返す
+    assert breaker.allow() == 30.0
+
+    # 試行が失敗すると再び開き、成功すると閉じる
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    now[0] += 30.0
+    assert breaker.allow() is None
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow() is None
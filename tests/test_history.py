@@ -0,0 +1,136 @@
+import sqlite3
+
+import pytest
+
+from pipeline.history import ROW_FILE_HASH_KEY, ROW_MODEL_KEY, HistoryStore
+
+
+def row(customer, insurer, extracted_on, plan="プラン1", **extra):
+    values = {
+        "氏名": customer,
+        "保険会社": insurer,
+        "プラン": plan,
+        "抽出日": extracted_on,
+        "ファイル名": f"{customer}_{insurer}.pdf",
+        "保険料": "12,340円",
+        ROW_MODEL_KEY: "gemini-2.5-flash-lite",
+        ROW_FILE_HASH_KEY: f"hash-{customer}-{insurer}",
+    }
+    values.update(extra)
+    return values
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = HistoryStore(str(tmp_path / "history" / "extraction_history.db"))
+    store.record_run(
+        [
+            row("山田太郎", "東京海上日動", "2025-09-01"),
+            row("山田花子", "損保ジャパン", "2025-10-15"),
+            row("山本一郎", "東京海上日動", "2025-10-20"),
+        ],
+        user="user1",
+        fields=["氏名", "保険料"],
+        source="GCSプレフィックス",
+    )
+    store.record_run(
+        [row("山田太郎", "三井住友海上", "2025-11-01"), row("鈴木次郎", "東京海上日動", "2025-11-02")],
+        user="user2",
+        fields=["氏名", "保険料"],
+    )
+    return store
+
+
+def names(rows):
+    return [(r["customer"], r["insurer"]) for r in rows]
+
+
+def test_record_and_load_run_round_trip(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.db"))
+    rows = [row("山田太郎", "東京海上日動", "2025-10-01"), row("山田太郎", "東京海上日動", "2025-10-01", plan="プラン2")]
+    customer_records = [{"氏名": "山田太郎", "保険料": "10,000円"}]
+    run_id = store.record_run(
+        rows, user="user1", fields=["氏名", "保険料"], customer_records=customer_records,
+        customer_file_name="顧客.xlsx", source="PDFアップロード",
+    )
+
+    loaded = store.load_run(run_id)
+    assert loaded["fields"] == ["氏名", "保険料"]
+    assert loaded["customer_records"] == customer_records
+    assert loaded["customer_file_name"] == "顧客.xlsx"
+    assert loaded["run"]["row_count"] == 2
+    assert loaded["run"]["source"] == "PDFアップロード"
+    # 内部キーは行には残さず、列として保存する
+    assert [r["プラン"] for r in loaded["rows"]] == ["プラン1", "プラン2"]
+    assert all(not any(k.startswith("_") for k in r) for r in loaded["rows"])
+    stored = store.query_rows(customer_prefix="山田太郎")
+    assert {r["model"] for r in stored} == {"gemini-2.5-flash-lite"}
+    assert {r["file_hash"] for r in stored} == {"hash-山田太郎-東京海上日動"}
+
+
+def test_load_missing_run(store):
+    with pytest.raises(KeyError):
+        store.load_run(999)
+
+
+def test_list_runs_newest_first(store):
+    runs = store.list_runs()
+    assert [r["user"] for r in runs] == ["user2", "user1"]
+    assert [r["row_count"] for r in runs] == [2, 3]
+    assert len(store.list_runs(limit=1)) == 1
+
+
+def test_query_by_customer_prefix(store):
+    assert names(store.query_rows(customer_prefix="山田")) == [
+        ("山田太郎", "三井住友海上"),
+        ("山田花子", "損保ジャパン"),
+        ("山田太郎", "東京海上日動"),
+    ]
+    assert names(store.query_rows(customer_prefix="山田太")) == [("山田太郎", "三井住友海上"), ("山田太郎", "東京海上日動")]
+    assert store.query_rows(customer_prefix="佐藤") == []
+
+
+@pytest.mark.parametrize(
+    "filters, expected",
+    [
+        ({"insurer": "東京海上日動"}, [("鈴木次郎", "東京海上日動"), ("山本一郎", "東京海上日動"), ("山田太郎", "東京海上日動")]),
+        ({"customer_prefix": "山", "insurer": "東京海上日動"}, [("山本一郎", "東京海上日動"), ("山田太郎", "東京海上日動")]),
+        ({"date_from": "2025-10-15", "date_to": "2025-11-01"}, [("山田太郎", "三井住友海上"), ("山本一郎", "東京海上日動"), ("山田花子", "損保ジャパン")]),
+        ({"customer_prefix": "山田", "date_to": "2025-10-31"}, [("山田花子", "損保ジャパン"), ("山田太郎", "東京海上日動")]),
+        ({"insurer": "あいおいニッセイ同和"}, []),
+        ({"limit": 2}, [("鈴木次郎", "東京海上日動"), ("山田太郎", "三井住友海上")]),
+    ],
+)
+def test_query_filters(store, filters, expected):
+    assert names(store.query_rows(**filters)) == expected
+
+
+def test_query_returns_record_json(store):
+    (found,) = store.query_rows(customer_prefix="鈴木")
+    assert found["run_id"] == 2
+    assert '"保険料": "12,340円"' in found["record_json"]
+
+
+@pytest.mark.parametrize(
+    "filters, index",
+    [
+        ({"customer_prefix": "山田"}, "idx_rows_customer"),
+        ({"customer_prefix": "山田", "insurer": "東京海上日動"}, "idx_rows_insurer_customer"),
+        ({"insurer": "東京海上日動"}, "idx_rows_insurer"),
+        ({"date_from": "2025-10-01"}, "idx_rows_extracted_on"),
+    ],
+)
+def test_queries_use_an_index(store, filters, index):
+    plan = store.explain_query_rows(**filters)
+    assert plan[0].startswith(f"SEARCH extraction_rows USING INDEX {index} ")
+
+
+def test_existing_database_gets_new_indexes(tmp_path):
+    path = str(tmp_path / "history.db")
+    HistoryStore(path)
+    with sqlite3.connect(path) as conn:
+        conn.execute("DROP INDEX idx_rows_insurer_customer")
+    HistoryStore(path)
+    with sqlite3.connect(path) as conn:
+        indexes = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert "idx_rows_insurer_customer" in indexes
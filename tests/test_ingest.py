@@ -0,0 +1,152 @@
+import io
+import zipfile
+
+import pytest
+
+from pipeline.ingest import (
+    IngestItem,
+    LocalDirectoryClient,
+    iter_gcs_pdfs,
+    iter_uploaded_files,
+    iter_zip_members,
+    split_skipped,
+)
+
+PDF = b"%PDF-1.4\n% quote\n"
+
+
+def make_zip(members, compression=zipfile.ZIP_STORED) -> bytes:
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", compression=compression) as archive:
+        for name, data in members:
+            archive.writestr(name, data)
+    return buf.getvalue()
+
+
+def read_all(items):
+    """1件ずつ読み込み、失敗した文書があっても残りを続けて読む"""
+    results = {}
+    for item in items:
+        try:
+            results[item.name] = item.read()
+        except Exception as e:
+            results[item.name] = e
+    return results
+
+
+def test_zip_members_skip_non_pdf_and_hidden_files():
+    data = make_zip([
+        ("quotes/a.pdf", PDF),
+        ("quotes/readme.txt", b"text"),
+        ("quotes/.DS_Store", b""),
+        ("__MACOSX/quotes/._a.pdf", b""),
+        ("quotes/B.PDF", PDF),
+    ])
+    targets, skipped = split_skipped(iter_zip_members(io.BytesIO(data)))
+    assert [item.name for item in targets] == ["quotes/a.pdf", "quotes/B.PDF"]
+    assert [(item.name, item.skip_reason) for item in skipped] == [("quotes/readme.txt", "PDF以外のファイル")]
+    assert [item.read() for item in targets] == [PDF, PDF]
+
+
+def test_zip_member_size_cap():
+    data = make_zip([("small.pdf", PDF), ("large.pdf", PDF + b"x" * 1000)])
+    targets, skipped = split_skipped(iter_zip_members(io.BytesIO(data), max_member_bytes=100))
+    assert [item.name for item in targets] == ["small.pdf"]
+    assert [(item.name, item.skip_reason) for item in skipped] == [("large.pdf", "サイズ上限超過")]
+
+
+def test_zip_member_names_without_utf8_flag_are_decoded_as_cp932():
+    # Windows標準機能で作ったZIPを再現するため、UTF-8フラグなしでCP932のファイル名に書き換える
+    name = "見積書.pdf"
+    placeholder = "x" * (len(name.encode("cp932")) - len(".pdf")) + ".pdf"
+    data = make_zip([(placeholder, PDF), ("UTF8見積.pdf", PDF)])
+    data = data.replace(placeholder.encode("ascii"), name.encode("cp932"))
+    items = list(iter_zip_members(io.BytesIO(data)))
+    assert [item.name for item in items] == [name, "UTF8見積.pdf"]
+    assert items[0].read() == PDF
+
+
+def test_zip_member_read_error_does_not_abort_the_run():
+    broken = PDF + b"broken member"
+    data = make_zip([("a.pdf", PDF), ("broken.pdf", broken), ("fake.pdf", b"not a pdf"), ("c.pdf", PDF)])
+    # 格納データを書き換えてCRCエラーにする
+    data = data.replace(b"broken member", b"BROKEN MEMBER")
+    results = read_all(split_skipped(iter_zip_members(io.BytesIO(data)))[0])
+    assert results["a.pdf"] == PDF
+    assert isinstance(results["broken.pdf"], zipfile.BadZipFile)
+    assert isinstance(results["fake.pdf"], ValueError)
+    assert results["c.pdf"] == PDF
+
+
+def test_zip_members_are_read_lazily():
+    data = make_zip([("a.pdf", PDF)], compression=zipfile.ZIP_DEFLATED)
+    item = next(iter_zip_members(io.BytesIO(data)))
+    assert item.size == len(PDF)
+    assert item.read() == PDF
+
+
+@pytest.fixture
+def gcs(tmp_path):
+    client = LocalDirectoryClient(str(tmp_path))
+    bucket = client.bucket("quotes")
+    for name, data in [
+        ("2025-10/b.pdf", PDF),
+        ("2025-10/a.pdf", PDF),
+        ("2025-10/notes.txt", b"text"),
+        ("2025-10/large.pdf", PDF + b"x" * 1000),
+        ("2025-10/fake.pdf", b"not a pdf"),
+        ("2025-11/c.pdf", PDF),
+    ]:
+        bucket.blob(name).upload_from_string(data)
+    return client
+
+
+def test_gcs_prefix_lists_pdfs_in_name_order(gcs):
+    targets, skipped = split_skipped(iter_gcs_pdfs(gcs, "quotes", "2025-10/", max_member_bytes=100))
+    assert [item.name for item in targets] == ["2025-10/a.pdf", "2025-10/b.pdf", "2025-10/fake.pdf"]
+    assert [(item.name, item.skip_reason) for item in skipped] == [
+        ("2025-10/large.pdf", "サイズ上限超過"),
+        ("2025-10/notes.txt", "PDF以外のファイル"),
+    ]
+
+
+def test_gcs_read_error_does_not_abort_the_run(gcs):
+    targets, _ = split_skipped(iter_gcs_pdfs(gcs, "quotes", "2025-10/", max_member_bytes=100))
+    results = read_all(targets)
+    assert results["2025-10/a.pdf"] == PDF
+    assert results["2025-10/b.pdf"] == PDF
+    assert isinstance(results["2025-10/fake.pdf"], ValueError)
+
+
+def test_gcs_empty_prefix_match(gcs):
+    assert list(iter_gcs_pdfs(gcs, "quotes", "2026-01/")) == []
+
+
+def test_split_skipped_keeps_order():
+    items = [
+        IngestItem("a.pdf", 1, lambda: PDF),
+        IngestItem("b.txt", 1, lambda: b"", skip_reason="PDF以外のファイル"),
+        IngestItem("c.pdf", 1, lambda: PDF),
+    ]
+    targets, skipped = split_skipped(iter(items))
+    assert [item.name for item in targets] == ["a.pdf", "c.pdf"]
+    assert [item.name for item in skipped] == ["b.txt"]
+
+
+def test_uploaded_files_are_read_on_demand():
+    class Uploaded:
+        name = "a.pdf"
+        size = len(PDF)
+
+        def __init__(self):
+            self.reads = 0
+
+        def getvalue(self):
+            self.reads += 1
+            return PDF
+
+    uploaded = Uploaded()
+    item = next(iter_uploaded_files([uploaded]))
+    assert uploaded.reads == 0
+    assert item.read() == PDF
+    assert uploaded.reads == 1
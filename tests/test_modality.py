@@ -0,0 +1,78 @@
+import pytest
+
+from pipeline.modality import (
+    GENERIC_ANCHORS,
+    INPUT_MODE_MARKDOWN,
+    INPUT_MODE_NATIVE_PDF,
+    INSURER_ANCHORS,
+    MODALITY_BOTH,
+    MODALITY_IMAGE,
+    MODALITY_TEXT,
+    find_anchors,
+    plan_modality,
+    resolve_input_mode,
+    resolve_thresholds,
+)
+
+FILLER = "火災保険の補償内容と支払条件についての説明です。" * 20
+
+
+def quote_text(anchors):
+    """アンカー語を見出しに持つ、テキスト層が十分な見積書"""
+    return "\n".join(f"| {anchor} | 値 |" for anchor in anchors) + "\n" + FILLER
+
+
+@pytest.mark.parametrize(
+    "text, insurer, expected",
+    [
+        # 既知の保険会社: 全アンカーがあればテキストのみ
+        (quote_text(INSURER_ANCHORS["東京海上日動"]), "東京海上日動", MODALITY_TEXT),
+        # 既知の保険会社: アンカーが1つでも欠ければ両方
+        (quote_text(INSURER_ANCHORS["東京海上日動"][:-1]), "東京海上日動", MODALITY_BOTH),
+        # 損保ジャパンは「免責金額」ではなく「自己負担額」をアンカーとする
+        (quote_text(INSURER_ANCHORS["東京海上日動"]), "損保ジャパン", MODALITY_BOTH),
+        # 保険会社不明: 汎用アンカーで判定する
+        (quote_text(GENERIC_ANCHORS), "", MODALITY_TEXT),
+        (quote_text(GENERIC_ANCHORS[:1]), "", MODALITY_BOTH),
+        # テキスト層が空・ごく短い・日本語をほぼ含まない場合は画像のみ
+        ("", "東京海上日動", MODALITY_IMAGE),
+        ("保険料 12,340円", "", MODALITY_IMAGE),
+        ("Page 1 of 2 " * 50, "", MODALITY_IMAGE),
+        # 文字数が足りない場合は両方
+        (quote_text(GENERIC_ANCHORS).replace(FILLER, FILLER[:100]), "", MODALITY_BOTH),
+    ],
+)
+def test_plan_modality(text, insurer, expected):
+    assert plan_modality(text, insurer)["mode"] == expected
+
+
+def test_plan_modality_reports_missing_anchors():
+    plan = plan_modality(quote_text(["建築年月", "保険料", "プラン"]), "東京海上日動")
+    assert plan["mode"] == MODALITY_BOTH
+    assert "免責金額" in plan["reason"]
+    assert plan["anchor_ratio"] == 0.75
+
+
+def test_plan_modality_respects_threshold_overrides():
+    text = quote_text(INSURER_ANCHORS["三井住友海上"])
+    assert plan_modality(text, "三井住友海上")["mode"] == MODALITY_TEXT
+    assert plan_modality(text, "三井住友海上", {"text_only_min_chars": "5000"})["mode"] == MODALITY_BOTH
+    assert plan_modality(text, "三井住友海上", {"image_only_max_chars": 5000})["mode"] == MODALITY_IMAGE
+
+
+def test_find_anchors_ignores_whitespace():
+    assert find_anchors("保 険 料\n保険　期間", "") == ["保険料", "保険期間"]
+
+
+def test_resolve_thresholds_coerces_to_float():
+    thresholds = resolve_thresholds({"text_only_min_chars": "250.5", "unknown": 1})
+    assert thresholds["text_only_min_chars"] == 250.5
+    assert thresholds["image_only_max_chars"] == 80.0
+    assert "unknown" not in thresholds
+
+
+def test_resolve_input_mode():
+    config = {"default": INPUT_MODE_MARKDOWN, "損保ジャパン": INPUT_MODE_NATIVE_PDF}
+    assert resolve_input_mode("損保ジャパン", config) == INPUT_MODE_NATIVE_PDF
+    assert resolve_input_mode("東京海上日動", config) == INPUT_MODE_MARKDOWN
+    assert resolve_input_mode("", {"default": "unknown"}) == INPUT_MODE_MARKDOWN
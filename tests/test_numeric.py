@@ -0,0 +1,153 @@
+import math
+
+import pandas as pd
+import pytest
+
+from pipeline.numeric import (
+    ANNUAL_PREMIUM_COLUMN,
+    BUILT_TYPED_COLUMN,
+    CHEAPEST_COLUMN,
+    PERIOD_TYPED_COLUMN,
+    PREMIUM_RANK_COLUMN,
+    add_typed_columns,
+    cheapest_mask,
+    parse_built_date,
+    parse_money,
+    parse_period_years,
+    rank_plans,
+    strip_derived_columns,
+)
+
+
+def parse_one(parser, value):
+    return parser(pd.Series([value])).iloc[0]
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("12,340円", 12340),
+        ("１２，３４０円", 12340),
+        ("5万円", 50000),
+        ("1.5万円", 15000),
+        ("1億2000万円", 120000000),
+        ("1億2,000万円", 120000000),
+        ("3千万円", 30000000),
+        ("2億円", 200000000),
+        ("1万5千円", 15000),
+        ("0円", 0),
+        ("", None),
+        ("〇", None),
+        ("補償されません", None),
+        (None, None),
+    ],
+)
+def test_parse_money(value, expected):
+    result = parse_one(parse_money, value)
+    if expected is None:
+        assert math.isnan(result)
+    else:
+        assert result == expected
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("5年", 5.0),
+        ("5年間", 5.0),
+        ("１０年", 10.0),
+        ("1年6ヶ月", 1.5),
+        ("1年6か月", 1.5),
+        ("6か月", 0.5),
+        ("2025年4月1日から5年間", 5.0),
+        ("", None),
+        ("長期", None),
+    ],
+)
+def test_parse_period_years(value, expected):
+    result = parse_one(parse_period_years, value)
+    if expected is None:
+        assert math.isnan(result)
+    else:
+        assert result == pytest.approx(expected)
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("2015年3月", "2015-03-01"),
+        ("2015/03", "2015-03-01"),
+        ("２０１５年３月", "2015-03-01"),
+        ("平成27年3月", "2015-03-01"),
+        ("H27.3", "2015-03-01"),
+        ("令和元年5月", "2019-05-01"),
+        ("R2.10", "2020-10-01"),
+        ("昭和60年", "1985-01-01"),
+        ("2015年13月", None),
+        ("27年3月", None),
+        ("", None),
+        ("不明", None),
+    ],
+)
+def test_parse_built_date(value, expected):
+    result = parse_one(parse_built_date, value)
+    if expected is None:
+        assert pd.isna(result)
+    else:
+        assert result == pd.Timestamp(expected)
+
+
+def test_add_typed_columns_places_values_next_to_source():
+    df = pd.DataFrame({"保険料": ["1万円"], "保険期間": ["5年"], "建築年月": ["H27.3"], "水災": [""]})
+    typed = add_typed_columns(df)
+    assert list(typed.columns) == [
+        "保険料", "保険料_円", "保険期間", PERIOD_TYPED_COLUMN, "建築年月", BUILT_TYPED_COLUMN, "水災", "水災_円",
+    ]
+    assert typed["保険料_円"].iloc[0] == 10000
+    assert math.isnan(typed["水災_円"].iloc[0])
+    assert list(strip_derived_columns(typed).columns) == list(df.columns)
+
+
+def plans(*rows):
+    return pd.DataFrame(rows, columns=["氏名", "プラン", "保険料", "保険期間", "水災", "盗難"])
+
+
+def test_rank_plans_uses_annual_premium_per_customer():
+    df = plans(
+        ["山田", "A", "50,000円", "5年", "0円", "0円"],
+        ["山田", "B", "12,000円", "1年", "", "1万円"],
+        ["鈴木", "A", "30,000円", "", "5万円", ""],
+    )
+    ranked = rank_plans(df)
+    assert list(ranked[ANNUAL_PREMIUM_COLUMN]) == [10000, 12000, 30000]
+    assert list(ranked[PREMIUM_RANK_COLUMN]) == [1, 2, 1]
+    assert list(ranked[CHEAPEST_COLUMN]) == ["盗難 / 水災", "", "水災"]
+
+
+def test_rank_plans_ties_share_the_cheapest_plan():
+    df = plans(
+        ["山田", "A", "10,000円", "1年", "0円", ""],
+        ["山田", "B", "1万円", "1年", "5万円", ""],
+        ["山田", "C", "20,000円", "1年", "0円", "0円"],
+    )
+    ranked = rank_plans(df)
+    assert list(ranked[PREMIUM_RANK_COLUMN]) == [1, 1, 3]
+    assert list(ranked[CHEAPEST_COLUMN]) == ["水災", "水災", "盗難"]
+
+    mask = cheapest_mask(ranked)
+    assert list(mask["水災"]) == [True, True, False]
+    assert list(mask["盗難"]) == [False, False, True]
+    assert list(mask[ANNUAL_PREMIUM_COLUMN]) == [True, True, False]
+    assert not mask["保険料"].any()
+
+
+def test_rank_plans_with_unparseable_premium():
+    df = plans(
+        ["山田", "A", "", "1年", "0円", ""],
+        ["山田", "B", "要相談", "1年", "0円", ""],
+    )
+    ranked = rank_plans(df)
+    assert ranked[ANNUAL_PREMIUM_COLUMN].isna().all()
+    assert ranked[PREMIUM_RANK_COLUMN].isna().all()
+    assert list(ranked[CHEAPEST_COLUMN]) == ["", ""]
+    assert not cheapest_mask(ranked)[ANNUAL_PREMIUM_COLUMN].any()
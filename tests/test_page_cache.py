@@ -0,0 +1,123 @@
+import threading
+
+import pytest
+from PIL import Image
+
+from pipeline import page_cache
+from pipeline.page_cache import PageCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(page_cache.time, "time", lambda: now[0])
+    return now
+
+
+def test_lru_evicts_least_recently_used():
+    cache = PageCache(max_bytes=10, ttl_seconds=0)
+    cache.put("a", "aaaa")
+    cache.put("b", "bbbb")
+    assert cache.get("a") == (True, "aaaa")
+    cache.put("c", "cccc")
+    assert cache.get("b") == (False, None)
+    assert cache.get("a") == (True, "aaaa")
+    assert cache.get("c") == (True, "cccc")
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] == 8
+
+
+def test_memory_entry_expires(clock):
+    cache = PageCache(max_bytes=100, ttl_seconds=10)
+    cache.put("a", "value")
+    clock[0] += 9
+    assert cache.get("a") == (True, "value")
+    clock[0] += 2
+    assert cache.get("a") == (False, None)
+    assert cache.stats()["expirations"] == 1
+
+
+def test_evicted_entry_is_spilled_and_reloaded(tmp_path):
+    cache = PageCache(max_bytes=10, ttl_seconds=0, disk_dir=str(tmp_path))
+    cache.put("a", "aaaaaa")
+    cache.put("b", "bbbbbb")
+    assert cache.stats()["spills"] == 1
+    assert cache.get("a") == (True, "aaaaaa")
+    stats = cache.stats()
+    assert stats["disk_hits"] == 1
+    assert stats["disk_entries"] == 2
+
+
+def test_page_images_survive_spill(tmp_path):
+    pages = [Image.new("RGB", (8, 8), (255, 0, 0)), Image.new("RGB", (8, 8), (0, 0, 255))]
+    cache = PageCache(max_bytes=300, ttl_seconds=0, disk_dir=str(tmp_path))
+    cache.put("pages", pages)
+    cache.put("other", [Image.new("RGB", (8, 8))])
+    found, loaded = cache.get("pages")
+    assert found
+    assert [img.getpixel((0, 0)) for img in loaded] == [(255, 0, 0), (0, 0, 255)]
+
+
+def test_disk_ttl_counts_from_first_store(clock, tmp_path):
+    cache = PageCache(max_bytes=10, ttl_seconds=10, disk_dir=str(tmp_path))
+    cache.put("a", "aaaaaa")
+    clock[0] += 1
+    cache.put("b", "bbbbbb")
+    # 退避から数えると有効だが、最初の格納から数えると期限切れ
+    clock[0] += 9.5
+    assert cache.get("a") == (False, None)
+
+
+def test_disk_hit_does_not_restart_ttl(clock, tmp_path):
+    cache = PageCache(max_bytes=10, ttl_seconds=10, disk_dir=str(tmp_path))
+    cache.put("a", "aaaaaa")
+    clock[0] += 1
+    cache.put("b", "bbbbbb")
+    clock[0] += 4
+    assert cache.get("a") == (True, "aaaaaa")
+    clock[0] += 6
+    assert cache.get("a") == (False, None)
+
+
+def test_oversize_value_is_spilled_once(tmp_path):
+    cache = PageCache(max_bytes=5, ttl_seconds=0, disk_dir=str(tmp_path))
+    cache.put("big", "x" * 20)
+    for _ in range(3):
+        assert cache.get("big") == (True, "x" * 20)
+    stats = cache.stats()
+    assert stats["spills"] == 1
+    assert stats["entries"] == 0
+    assert stats["disk_hits"] == 3
+
+
+def test_spill_runs_without_holding_the_lock(tmp_path, monkeypatch):
+    cache = PageCache(max_bytes=10, ttl_seconds=0, disk_dir=str(tmp_path))
+    lock_free = []
+    encode = page_cache._encode_for_disk
+
+    def checking_encode(value):
+        # 別スレッドからロックを取得できれば、退避中にロックを保持していない
+        def try_lock():
+            acquired = cache._lock.acquire(timeout=1)
+            if acquired:
+                cache._lock.release()
+            lock_free.append(acquired)
+
+        thread = threading.Thread(target=try_lock)
+        thread.start()
+        thread.join()
+        return encode(value)
+
+    monkeypatch.setattr(page_cache, "_encode_for_disk", checking_encode)
+    cache.put("a", "aaaaaa")
+    cache.put("b", "bbbbbb")
+    assert lock_free == [True]
+
+
+def test_get_or_compute_computes_once():
+    cache = PageCache(max_bytes=100)
+    calls = []
+    compute = lambda: calls.append(1) or "value"
+    assert cache.get_or_compute("k", compute) == "value"
+    assert cache.get_or_compute("k", compute) == "value"
+    assert len(calls) == 1